@@ -0,0 +1,70 @@
+"""Import-time profile of the bot's entry point.
+
+    python benchmarks/import_time.py [--module M] [--top N] [--runs N]
+
+Runs ``python -X importtime -c "import M"`` in fresh interpreters and prints
+the total import time and the top-level packages whose modules take the
+most time to import themselves.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+# Enough for the settings to load without a real bot
+_ENV = {"TELEGRAM_BOT_TOKEN": "0:import-time", "TELEGRAM_BOT_USERNAME": "bench"}
+
+
+def profile(module: str) -> list[tuple[str, int, int]]:
+    """(module, self µs, cumulative µs) of every import, in import order."""
+    env = {**_ENV, **os.environ}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        imports.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="ev_registration_bot.bot_main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    totals = []
+    packages: dict[str, list[int]] = defaultdict(list)
+    for _ in range(args.runs):
+        imports = profile(args.module)
+        totals.append(sum(self_us for _, self_us, _ in imports))
+        by_package: dict[str, int] = defaultdict(int)
+        for name, self_us, _ in imports:
+            by_package[name.strip().split(".")[0]] += self_us
+        for package, self_us in by_package.items():
+            packages[package].append(self_us)
+
+    print(
+        f"{args.module}: median {statistics.median(totals) / 1000:.0f} ms "
+        f"over {args.runs} runs"
+    )
+    slowest = sorted(
+        packages.items(), key=lambda item: statistics.median(item[1]), reverse=True
+    )
+    for name, times in slowest[: args.top]:
+        print(f"  {statistics.median(times) / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Time the handler input parsing in ev_registration_bot.parsing.
+
+    python benchmarks/parsing_bench.py [--repeat N]
+
+Compares it with the split() chains it replaced. The parsers cache their
+results, so each is timed twice: on a cache hit, as for the same few
+dozen labels shown to every user, and uncached through ``__wrapped__``,
+as for a label seen the first time. tests/test_parsing.py checks what the
+parsers return.
+"""
+
+import argparse
+import datetime
+import timeit
+
+from ev_registration_bot.parsing import (
+    format_date_label,
+    parse_date_label,
+    parse_slot_label,
+    slot_label,
+)
+
+
+def _iso(day: datetime.date, minute: int) -> str:
+    return f"{day.isoformat()}T{minute // 60:02d}:{minute % 60:02d}:00+03:00"
+
+
+def _old_date(text: str) -> datetime.date:
+    day = text.split(".")[0]
+    month = text.split(".")[1]
+    year = text.split(".")[2]
+    return datetime.date(int(year), int(month), int(day))
+
+
+def _old_label(start: str, end: str, places: int) -> str:
+    return (
+        f"{':'.join(start.split('T')[1].split('+')[0].split(':')[:2])}-"
+        f"{':'.join(end.split('T')[1].split('+')[0].split(':')[:2])} ({places} мест)"
+    )
+
+
+def _old_slot(text: str) -> tuple[str, str, int]:
+    start = text.split("-")[0]
+    end = text.split("-")[1].split(" ")[0]
+    return start, end, int(text.split("(")[1].split(" ")[0])
+
+
+def benchmark(repeat: int) -> None:
+    day = datetime.date.today()
+    start, end = _iso(day, 13 * 60), _iso(day, 14 * 60)
+    date_label = format_date_label(day)
+    label = slot_label(start, end, 4)
+    cases = [
+        ("date label", lambda: _old_date(date_label), parse_date_label, (date_label,)),
+        (
+            "slot label",
+            lambda: _old_label(start, end, 4),
+            slot_label,
+            (start, end, 4),
+        ),
+        ("slot choice", lambda: _old_slot(label), parse_slot_label, (label,)),
+    ]
+    for name, old, new, args in cases:
+        timings = [
+            min(timeit.repeat(call, number=repeat, repeat=5)) / repeat
+            for call in (old, lambda: new(*args), lambda: new.__wrapped__(*args))
+        ]
+        old_time, hit_time, miss_time = timings
+        print(
+            f"{name:12} split: {old_time * 1e9:6.0f} ns  "
+            f"cache hit: {hit_time * 1e9:6.0f} ns ({old_time / hit_time:.1f}x)  "
+            f"uncached: {miss_time * 1e9:6.0f} ns ({old_time / miss_time:.1f}x)"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=100000)
+    args = parser.parse_args()
+    benchmark(args.repeat)
+
+
+if __name__ == "__main__":
+    main()
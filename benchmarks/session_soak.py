@@ -0,0 +1,100 @@
+"""Soak test of the idle-session expiry in ev_registration_bot.sessions.
+
+    python benchmarks/session_soak.py [--updates N] [--rate N] [--no-expiry]
+
+Feeds simulated updates into a real Application's user_data under a fake
+clock: most come from recently active users, a steady share from users
+never seen before, and nobody ever finishes or cancels their booking.
+Sweeps run as the job would. Memory (tracemalloc), live sessions and their
+estimated JSON size are printed every tenth of the run; with expiry they
+level off once the first users time out, with ``--no-expiry`` they grow
+with every new user. tests/test_sessions.py runs a short version.
+"""
+
+import argparse
+import random
+import tracemalloc
+
+from telegram.ext import ApplicationBuilder, CallbackContext
+
+from ev_registration_bot import sessions, time_utils
+from ev_registration_bot.config import get_settings
+
+
+def soak(updates: int, rate: float, new_user_share: float, expire: bool) -> None:
+    settings = get_settings().sessions
+    application = ApplicationBuilder().token("0:soak").build()
+    rng = random.Random(0)
+    now = 1_700_000_000.0
+    time_utils.set_clock(lambda: now)
+
+    recent_users: list[int] = []
+    next_user_id = 1
+    next_sweep = now + settings.sweep_seconds
+    report_every = max(updates // 10, 1)
+    peaks = []
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for update in range(1, updates + 1):
+        now += 1 / rate
+        if not recent_users or rng.random() < new_user_share:
+            user_id = next_user_id
+            next_user_id += 1
+            recent_users.append(user_id)
+            if len(recent_users) > 1000:
+                recent_users.pop(0)
+        else:
+            user_id = rng.choice(recent_users)
+
+        # What the handlers leave behind for an abandoned booking
+        sessions.touch(user_id, now)
+        user_data = CallbackContext(application, user_id=user_id).user_data
+        user_data.setdefault("message_ids", []).append(update)
+        user_data["chat_id"] = user_id
+        user_data["commune"] = "GERMAN"
+        user_data["date"] = "2024-06-03"
+
+        if now >= next_sweep:
+            next_sweep += settings.sweep_seconds
+            if expire:
+                sessions.expire_idle(
+                    application,
+                    now,
+                    settings.idle_timeout_seconds + settings.sweep_seconds,
+                )
+            # There is no Bot API here to delete the leftover messages with
+            sessions._cleanups.clear()
+
+        if update % report_every == 0:
+            live, size = sessions.session_sizes(application, now)
+            memory = tracemalloc.get_traced_memory()[0] - baseline
+            peaks.append(memory)
+            print(
+                f"{update:>10} updates  {live:>8} sessions  "
+                f"{size / 1e6:7.1f} MB JSON  {memory / 1e6:7.1f} MB traced"
+            )
+    tracemalloc.stop()
+    time_utils.set_clock(None)
+
+    if expire:
+        # Flat once the first sessions expire: the last half stays within 20%
+        half = peaks[len(peaks) // 2 :]
+        assert max(half) <= 1.2 * min(half), "memory kept growing"
+        print("memory flat over the second half of the run")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=2_000_000)
+    # Simulated updates per second; with the default timeout about a tenth of
+    # the run is needed before the first sessions expire
+    parser.add_argument("--rate", type=float, default=50)
+    parser.add_argument("--new-user-share", type=float, default=0.2)
+    parser.add_argument("--no-expiry", action="store_true")
+    args = parser.parse_args()
+    soak(args.updates, args.rate, args.new_user_share, not args.no_expiry)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Time the Moscow time helpers in ev_registration_bot.time_utils.
+
+    python benchmarks/time_bench.py [--repeat N]
+
+Compares them with the pytz localization and ISO string comparisons they
+replaced, on a full day of half-hour slots. A fixed clock is installed, so
+the numbers don't depend on the time of day the benchmark runs at.
+"""
+
+import argparse
+import datetime
+import timeit
+
+import pytz
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.google_calendar_helper.schedule import first_bookable_minute
+
+_moscow_tz = pytz.timezone("Europe/Moscow")
+
+# Mid-afternoon, so the today filter drops about half of the slots; just
+# after a slot has started, which must be dropped too
+_NOW = datetime.datetime(2024, 6, 3, 15, 0, 30, tzinfo=time_utils.MOSCOW_TZ)
+_DAY = _NOW.date()
+_MINUTES = range(10 * 60, 21 * 60, 30)
+
+
+def _old_slot_times() -> list[str]:
+    return [
+        _moscow_tz.localize(
+            datetime.datetime.combine(_DAY, datetime.time(minute // 60, minute % 60))
+        ).isoformat()
+        for minute in _MINUTES
+    ]
+
+
+def _new_slot_times() -> list[str]:
+    return [time_utils.iso_at(_DAY, minute) for minute in _MINUTES]
+
+
+def _old_filter(slots: list[str]) -> list[str]:
+    now = datetime.datetime.fromtimestamp(_NOW.timestamp(), _moscow_tz)
+    return [slot for slot in slots if slot >= now.isoformat()]
+
+
+def _new_filter(slots: list[str]) -> list[str]:
+    first_minute = first_bookable_minute(_DAY, time_utils.now())
+    return [slot for slot in slots if time_utils.iso_minute(slot) >= first_minute]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    time_utils.set_clock(_NOW.timestamp)
+    slots = _new_slot_times()
+    assert slots == _old_slot_times()
+    assert _new_filter(slots) == _old_filter(slots), "filters disagree"
+
+    cases = [
+        ("slot times", _old_slot_times, _new_slot_times),
+        ("today filter", lambda: _old_filter(slots), lambda: _new_filter(slots)),
+    ]
+    for name, old, new in cases:
+        old_time = min(timeit.repeat(old, number=args.repeat, repeat=5)) / args.repeat
+        new_time = min(timeit.repeat(new, number=args.repeat, repeat=5)) / args.repeat
+        print(
+            f"{name:12} pytz: {old_time * 1e6:7.2f} µs  "
+            f"time_utils: {new_time * 1e6:7.2f} µs  ({old_time / new_time:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
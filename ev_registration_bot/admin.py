@@ -0,0 +1,178 @@
+"""Commands for the staff listed in TELEGRAM_ADMIN_IDS."""
+
+import asyncio
+import datetime
+import functools
+import io
+import logging
+import tempfile
+
+from telegram import Update
+from telegram.ext import Application, CommandHandler, ContextTypes
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.config import get_settings
+from ev_registration_bot.google_calendar_helper.bulk_availability import (
+    DayAvailability,
+    get_availability,
+)
+from ev_registration_bot.google_calendar_helper.capacity_stats import (
+    DayCapacity,
+    get_capacity,
+)
+from ev_registration_bot.google_calendar_helper.export_bookings import (
+    export_bookings,
+)
+from ev_registration_bot.google_calendar_helper.utils import get_communes
+
+logger = logging.getLogger(__name__)
+
+
+_WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+
+# Exports bigger than this are spilled to a temporary file while written
+_SPOOL_MAX_BYTES = 1024 * 1024
+
+_MAX_AVAILABILITY_DAYS = 60
+
+
+def admin_only(handler):
+    """Ignore the command unless it comes from an admin."""
+
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        if user is None or user.id not in get_settings().telegram.admin_ids:
+            return None
+        return await handler(update, context)
+
+    return wrapper
+
+
+def _export_file(
+    export_format: str, first_day: datetime.date, last_day: datetime.date
+) -> tuple[tempfile.SpooledTemporaryFile, int]:
+    output = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_BYTES)
+    if export_format == "parquet":
+        count = export_bookings(output, export_format, first_day, last_day)
+    else:
+        text = io.TextIOWrapper(output, encoding="utf-8-sig", newline="")
+        count = export_bookings(text, export_format, first_day, last_day)
+        text.flush()
+        text.detach()
+    output.seek(0)
+    return output, count
+
+
+@admin_only
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/export [first day] [last day] [csv|parquet]; the next 30 days by default."""
+    args = list(context.args or [])
+    export_format = "csv"
+    if args and args[-1] in ("csv", "parquet"):
+        export_format = args.pop()
+    try:
+        today = time_utils.today()
+        first_day = datetime.date.fromisoformat(args[0]) if args else today
+        last_day = (
+            datetime.date.fromisoformat(args[1])
+            if len(args) > 1
+            else first_day + datetime.timedelta(days=30)
+        )
+    except ValueError:
+        await update.message.reply_text(
+            "Формат: /export 2024-06-01 2024-06-30 [csv|parquet]"
+        )
+        return
+
+    try:
+        output, count = await asyncio.to_thread(
+            _export_file, export_format, first_day, last_day
+        )
+    except Exception:
+        logger.exception("Bookings export failed")
+        await update.message.reply_text("Не удалось выгрузить записи")
+        return
+
+    with output:
+        await update.message.reply_document(
+            output,
+            filename=f"bookings_{first_day}_{last_day}.{export_format}",
+            caption=f"Записей: {count}",
+        )
+
+
+def _day_label(day: datetime.date) -> str:
+    return f"{day.day:02d}.{day.month:02d} {_WEEKDAYS[day.weekday()]}"
+
+
+def _format_day(day: datetime.date, stats: DayCapacity | None) -> str:
+    label = _day_label(day)
+    if stats is None:
+        return f"{label}: нет данных"
+    return (
+        f"{label}: лекции {stats.peak_guests}/{stats.guest_limit} "
+        f"({stats.lecture_guests} гостей, {stats.lecture_bookings} записей), "
+        f"терапии {stats.therapy_bookings}, свободно {stats.free_hours} ч"
+    )
+
+
+@admin_only
+async def capacity_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/capacity: occupancy of every commune over the next week."""
+    capacity = await get_capacity(time_utils.now())
+    sections = [
+        "\n".join(
+            [commune.settings.label] + [_format_day(day, stats) for day, stats in days]
+        )
+        for commune, days in capacity.items()
+    ]
+    await update.message.reply_text("\n\n".join(sections))
+
+
+def _format_availability(availability: DayAvailability) -> str:
+    slots = availability.slots
+    therapy_free = sum(slot.therapy_free for slot in slots)
+    lecture_places = max((slot.lecture_places for slot in slots), default=0)
+    line = (
+        f"{_day_label(availability.day)}: терапия {therapy_free}/{len(slots)}, "
+        f"лекция до {lecture_places} мест"
+    )
+    return line + " (кэш)" if availability.stale else line
+
+
+@admin_only
+async def availability_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """/availability [days] [30|60]: free slots of every commune, 30 days by default."""
+    args = context.args or []
+    try:
+        days = int(args[0]) if args else 30
+        duration_minutes = int(args[1]) if len(args) > 1 else 30
+        if not 0 < days <= _MAX_AVAILABILITY_DAYS or duration_minutes not in (30, 60):
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(
+            f"Формат: /availability [1-{_MAX_AVAILABILITY_DAYS} дней] [30|60]"
+        )
+        return
+
+    today = time_utils.today()
+    availability = await get_availability(
+        get_communes(),
+        [today + datetime.timedelta(days=offset) for offset in range(days)],
+        duration_minutes,
+    )
+    # One message per commune keeps each under Telegram's length limit
+    for commune in get_communes():
+        lines = [
+            _format_availability(day) for day in availability if day.commune == commune
+        ] or ["нет данных"]
+        await update.message.reply_text("\n".join([commune.settings.label, *lines]))
+
+
+def add_admin_handlers(application: Application) -> None:
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("capacity", capacity_command))
+    application.add_handler(CommandHandler("availability", availability_command))
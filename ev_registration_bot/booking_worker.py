@@ -0,0 +1,116 @@
+import asyncio
+import logging
+
+from googleapiclient.errors import HttpError
+from telegram.ext import ContextTypes, JobQueue
+
+from ev_registration_bot.config import get_settings
+from ev_registration_bot.google_calendar_helper import booking_outbox, events_cache
+from ev_registration_bot.google_calendar_helper.booking_outbox import PendingBooking
+from ev_registration_bot.google_calendar_helper.circuit_breaker import (
+    CircuitOpenError,
+    is_quota_error,
+)
+from ev_registration_bot.google_calendar_helper.google_calendar_create import (
+    delete_event,
+    insert_event,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _is_retryable(error: HttpError) -> bool:
+    return error.resp.status >= 500 or is_quota_error(error)
+
+
+async def _notify_failure(
+    context: ContextTypes.DEFAULT_TYPE, booking: PendingBooking
+) -> None:
+    if booking.chat_id is None:
+        return
+    start = booking.body["start"]["dateTime"]
+    try:
+        await context.bot.send_message(
+            booking.chat_id,
+            f"К сожалению, не удалось сохранить Вашу запись на "
+            f"{start[8:10]}.{start[5:7]} {start[11:16]}.\n\n"
+            f"Чтобы записаться повторно нажмите /start",
+        )
+    except Exception:
+        logger.exception(
+            "Failed to notify chat %s about booking failure", booking.chat_id
+        )
+
+
+async def _retry_or_fail(
+    context: ContextTypes.DEFAULT_TYPE, booking: PendingBooking, error: str
+) -> None:
+    if booking.attempts + 1 >= get_settings().outbox.max_attempts:
+        logger.error("Giving up on booking %s: %s", booking.event_id, error)
+        booking_outbox.mark_failed(booking, error)
+        events_cache.invalidate_day(booking.commune, booking.day)
+        await _notify_failure(context, booking)
+        return
+    delay = booking_outbox.schedule_retry(booking, error)
+    logger.warning(
+        "Booking %s failed (%s), retrying in %.0fs", booking.event_id, error, delay
+    )
+
+
+async def flush_outbox(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Insert due bookings into Calendar.
+
+    Every booking carries its own event id, so a retry after a lost response
+    gets 409 Conflict instead of a duplicate, and that counts as success.
+    """
+    for booking in booking_outbox.due_bookings():
+        if booking_outbox.is_cancelled(booking.event_id):
+            booking_outbox.mark_cancelled(booking)
+            continue
+        try:
+            await asyncio.to_thread(insert_event, booking)
+        except CircuitOpenError:
+            # Calendar is down: keep the booking due without spending an attempt
+            continue
+        except HttpError as error:
+            if error.resp.status == 409:
+                logger.info("Booking %s was already inserted", booking.event_id)
+            elif _is_retryable(error):
+                await _retry_or_fail(context, booking, str(error))
+                continue
+            else:
+                logger.error(
+                    "Calendar rejected booking %s: %s", booking.event_id, error
+                )
+                booking_outbox.mark_failed(booking, str(error))
+                events_cache.invalidate_day(booking.commune, booking.day)
+                await _notify_failure(context, booking)
+                continue
+        except Exception as error:
+            # Expired tokens, timeouts and connection errors are worth retrying
+            await _retry_or_fail(context, booking, repr(error))
+            continue
+
+        # The mirror no longer matches the calendar for that day. Supersede it
+        # before the reservation goes, so until the day is fetched again every
+        # worker still sees the booking as reserved
+        events_cache.invalidate_day(booking.commune, booking.day)
+        booking_outbox.mark_done(booking)
+        if booking_outbox.is_cancelled(booking.event_id):
+            # Cancelled while it was being inserted
+            try:
+                await asyncio.to_thread(delete_event, booking.commune, booking.event_id)
+                events_cache.invalidate_day(booking.commune, booking.day)
+            except Exception:
+                logger.exception(
+                    "Failed to delete cancelled booking %s", booking.event_id
+                )
+
+
+def schedule_outbox(job_queue: JobQueue) -> None:
+    job_queue.run_repeating(
+        flush_outbox,
+        interval=get_settings().outbox.flush_interval_seconds,
+        first=0,
+        name="flush_booking_outbox",
+    )
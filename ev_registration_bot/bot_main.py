@@ -1,24 +1,81 @@
+import asyncio
 import datetime
 import enum
+import functools
 import logging
-import re
+import uuid
 from typing import List
 
-import pytz
+from ev_registration_bot import time_utils
+from ev_registration_bot.admin import add_admin_handlers
 from ev_registration_bot.config import get_settings
+from ev_registration_bot.booking_worker import flush_outbox, schedule_outbox
+from ev_registration_bot.send_queue import schedule_send_queue
+from ev_registration_bot import user_profiles
+from ev_registration_bot.user_profiles import PHONE_REGEX, UserProfile
+from ev_registration_bot.parsing import (
+    DURATION_LABELS,
+    VISIT_TYPE_LABELS,
+    YES_NO_LABELS,
+    format_date_label,
+    parse_date_label,
+    parse_slot_label,
+    slot_label,
+)
+from ev_registration_bot.google_calendar_helper.reminders import schedule_reminders
+from ev_registration_bot.health import schedule_heartbeat
+from ev_registration_bot.prewarm import schedule_prewarm
+from ev_registration_bot.sessions import add_session_handlers
+from ev_registration_bot.settings_reload import schedule_settings_reload
+from ev_registration_bot.shared_state.backend import get_backend
+from ev_registration_bot.shared_state.persistence import BackendPersistence
+from ev_registration_bot.webhook import run_worker
+from ev_registration_bot.logging_config import (
+    log_context,
+    parse_sample_rates,
+    setup_logging,
+)
+from ev_registration_bot.telegram_request import make_request
+from ev_registration_bot.tracing import (
+    SpanContext,
+    configure_tracing,
+    continue_trace,
+    traced,
+)
+from ev_registration_bot.metrics import (
+    TELEGRAM_RATE_LIMITED,
+    instrumented,
+    start_metrics_server,
+)
 from ev_registration_bot.google_calendar_helper.utils import (
     VisitType,
+    get_commune,
+    get_commune_by_label,
     get_commune_guest_limit,
+    get_communes,
 )
 from ev_registration_bot.google_calendar_helper.google_calendar_create import (
     create_event,
 )
+from ev_registration_bot.google_calendar_helper.capacity_matrix import day_has_room
+from ev_registration_bot.google_calendar_helper import user_bookings, waitlist
+from ev_registration_bot.google_calendar_helper.manage_bookings import (
+    BookingStillPendingError,
+    cancel_booking,
+    free_slots_for_move,
+    reschedule_booking,
+)
+from ev_registration_bot.google_calendar_helper.schedule import get_bookable_days
+from ev_registration_bot.google_calendar_helper.user_bookings import UserBooking
 from ev_registration_bot.google_calendar_helper.google_calendar_get import (
     Commune,
+    CalendarUnavailableException,
     OutOfTimeException,
     get_free_slots_for_a_day,
     get_lecture_free_slots_for_a_day,
     get_lecture_free_half_an_hour_slots_for_a_day,
+    served_stale_data,
+    warm_up,
 )
 from telegram import (
     InlineKeyboardButton,
@@ -26,6 +83,7 @@ from telegram import (
     ReplyKeyboardRemove,
     Update,
 )
+from telegram.error import RetryAfter
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -34,34 +92,30 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
-import google
+from google.auth.exceptions import RefreshError
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
-moscow_tz = pytz.timezone("Europe/Moscow")
-
-
-communes = [
-    "Север-американские",
-    "Северо-Германские",
-]
-
-visit_type = [
-    ["Терапия (индивидуально, 1 час)"],
-    ["Лекция (с другими гостями, 30 мин. или 1 час)"],
-]
 
-user_id: int | None = None
-
-registration_amount_done: bool = False
-user_children_amount: int | None = None
-user_chosen_commune: str | None = None
-user_visit_type: str | None = None
-total_guests: int | None = None
-visit_duration: str | None = None
+visit_type = [[label] for label in VISIT_TYPE_LABELS]
+
+# Per-chat booking state, kept in user_data (JSON values only) so it can be
+# persisted and picked up by another worker
+_BOOKING_KEYS = (
+    "commune",
+    "visit_type",
+    "date",
+    "visit_duration",
+    "available_places",
+    "start_time",
+    "end_time",
+    "children_amount",
+    "registration_name",
+    "registration_amount",
+    "registration_amount_done",
+    "registration_phone",
+    "repeat_booking",
+)
 
 (
     CHOOSE_COMMUNE,
@@ -78,7 +132,66 @@ visit_duration: str | None = None
     MAKE_REGISTRATION,
 ) = range(12)
 
+(
+    CANCEL_CHOOSE_BOOKING,
+    CANCEL_CONFIRM,
+    RESCHEDULE_CHOOSE_BOOKING,
+    RESCHEDULE_CHOOSE_DATE,
+    RESCHEDULE_CHOOSE_TIME,
+) = range(12, 17)
+
+WAITLIST_CHOOSE_SLOT = 17
+
+_WAITLIST_MARK = "⏳ "
+_OTHER_DATE = "Выбрать другую дату"
+
+_REPEAT_MARK = "🔁 "
+
+
+def _chosen_commune(context: ContextTypes.DEFAULT_TYPE) -> Commune | None:
+    name = context.user_data.get("commune")
+    return get_commune(name) if name else None
 
+
+def _chosen_visit_type(context: ContextTypes.DEFAULT_TYPE) -> VisitType | None:
+    value = context.user_data.get("visit_type")
+    return VisitType(value) if value else None
+
+
+def _chosen_date(context: ContextTypes.DEFAULT_TYPE) -> datetime.date:
+    return datetime.date.fromisoformat(context.user_data["date"])
+
+
+def conversation_handler(state: str, starts_trace: bool = False):
+    """Record latency metrics and a trace span for a conversation handler.
+
+    The span of the handler a flow starts with is the root of a trace; it is
+    kept in user_data, so the handlers of the following updates (on whichever
+    worker) become its children and a booking is exported as one trace.
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def traced_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            trace = None if starts_trace else context.user_data.get("trace")
+            parent = SpanContext(*trace) if trace else None
+            chat_id = update.effective_chat.id if update.effective_chat else None
+            with continue_trace(parent, f"handler.{state}") as span:
+                with log_context(chat_id, context.user_data.get("booking_id")):
+                    result = await handler(update, context)
+                if parent is None:
+                    context.user_data["trace"] = list(span.context())
+                span.set_attribute("conversation.state", state)
+                span.set_attribute("commune", context.user_data.get("commune"))
+                span.set_attribute("visit_type", context.user_data.get("visit_type"))
+            return result
+
+        return instrumented(state)(traced_handler)
+
+    return decorator
+
+
+@traced("delete_previous_messages")
 async def delete_previous_messages(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Delete all stored messages for the current chat."""
     if not context.user_data.get("message_ids"):
@@ -94,7 +207,7 @@ async def delete_previous_messages(context: ContextTypes.DEFAULT_TYPE) -> None:
             await context.bot.delete_messages(chat_id, message_ids)
             context.user_data["message_ids"] = []
         except Exception as e:
-            logger.error(f"Failed to delete messages: {e}")
+            logger.error("Failed to delete messages: %s", e)
 
 
 async def store_message(
@@ -107,29 +220,25 @@ async def store_message(
     context.user_data["chat_id"] = update.message.chat_id
 
 
+@conversation_handler("START", starts_trace=True)
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
 
     await delete_previous_messages(context)
 
-    global user_id
-    user_id = update.message.from_user.id
-    global registration_amount_done
-    registration_amount_done = False
-    global user_children_amount
-    user_children_amount = None
-    global user_chosen_commune
-    user_chosen_commune = None
-    global user_visit_type
-    user_visit_type = None
-    global visit_duration
-    visit_duration = None
+    for key in _BOOKING_KEYS:
+        context.user_data.pop(key, None)
 
     # Clear previous message IDs
     context.user_data["message_ids"] = []
     context.user_data["chat_id"] = update.message.chat_id
+    context.user_data["booking_id"] = uuid.uuid4().hex[:12]
 
     reply_keyboard = [["Зарегистрироваться"]]
+    profile = await asyncio.to_thread(user_profiles.load, update.effective_user.id)
+    repeat_label = _profile_label(profile) if profile else None
+    if repeat_label:
+        reply_keyboard.append([repeat_label])
     message = await update.message.reply_text(
         "Здесь можно зарегистрироваться на посещение",
         reply_markup=ReplyKeyboardMarkup(
@@ -143,36 +252,86 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     return CHOOSE_COMMUNE
 
 
-def get_reply_keyboard():
-    now = datetime.datetime.now(moscow_tz)
-    today = now.date()
-    tomorrow = today + datetime.timedelta(days=1)
-    day_after_tomorrow = today + datetime.timedelta(days=2)
-    two_days_after_tomorrow = today + datetime.timedelta(days=3)
+def _profile_label(profile: UserProfile) -> str | None:
+    """Text of the button repeating the last booking; None if it can't be repeated."""
+    try:
+        label = get_commune(profile.commune).settings.label
+    except KeyError:
+        return None
+    kind = "терапия" if profile.visit_type == VisitType.THERAPY.value else "лекция"
+    return (
+        f"{_REPEAT_MARK}Как в прошлый раз: {label}, {kind}, "
+        f"{profile.registration_amount} чел., {profile.registration_name}"
+    )
 
-    def format_date(date):
-        return f"{date.day}.{date.month:02d}.{date.year}"
 
-    if now.hour < 21:
-        reply_keyboard = [
-            [format_date(today)],
-            [format_date(tomorrow)],
-            [format_date(day_after_tomorrow)],
-        ]
-    else:
-        reply_keyboard = [
-            [format_date(tomorrow)],
-            [format_date(day_after_tomorrow)],
-            [format_date(two_days_after_tomorrow)],
-        ]
+async def _repeat_last_booking(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int | None:
+    """Fill the booking from the user's profile and ask for the date straight away."""
+    profile = await asyncio.to_thread(user_profiles.load, update.effective_user.id)
+    if profile is None or _profile_label(profile) != update.message.text:
+        return None
+
+    context.user_data.update(
+        commune=profile.commune,
+        visit_type=profile.visit_type,
+        children_amount=profile.children_amount,
+        registration_name=profile.registration_name,
+        registration_amount=profile.registration_amount,
+        registration_phone=profile.phone,
+        repeat_booking=True,
+    )
+    message = await update.message.reply_text(
+        "Выберете дату\n\nНажмите /cancel чтобы выйти",
+        reply_markup=ReplyKeyboardMarkup(
+            get_reply_keyboard(
+                _chosen_commune(context), visit_type=_chosen_visit_type(context)
+            ),
+        ),
+    )
+    await store_message(update, context, update.message.message_id)
+    await store_message(update, context, message.message_id)
+
+    if _chosen_visit_type(context) == VisitType.THERAPY:
+        return CHOOSE_TIME
+    return CHOOSE_VISIT_DURATION
 
-    return reply_keyboard
+
+def _stale_note() -> str:
+    if served_stale_data():
+        return "\n\n⚠️ Календарь сейчас недоступен, расписание может быть немного устаревшим"
+    return ""
+
+
+def get_reply_keyboard(
+    commune: Commune | None = None,
+    days_shown: int = 3,
+    visit_type: VisitType | None = None,
+):
+    now = time_utils.now()
+    if commune is None or visit_type is None:
+        days = get_bookable_days(commune, now, days_shown)
+    else:
+        # Skip the days the capacity matrix knows to be fully booked
+        days = [
+            day
+            for day in get_bookable_days(commune, now, 14)
+            if day_has_room(commune, day, visit_type) is not False
+        ][:days_shown]
+    return [[format_date_label(day)] for day in days]
 
 
+@conversation_handler("CHOOSE_COMMUNE")
 async def choose_commune(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await delete_previous_messages(context)
 
-    reply_keyboard = [communes]
+    if (update.message.text or "").startswith(_REPEAT_MARK):
+        next_state = await _repeat_last_booking(update, context)
+        if next_state is not None:
+            return next_state
+
+    reply_keyboard = [[commune.settings.label for commune in get_communes()]]
     message = await update.message.reply_text(
         "Выберите коммуну\n\nЗдесь будет описание каждой коммуны\n\nНажмите /cancel чтобы выйти",
         reply_markup=ReplyKeyboardMarkup(
@@ -186,24 +345,22 @@ async def choose_commune(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CHOOSE_VISIT_TYPE
 
 
+@conversation_handler("CHOOSE_VISIT_TYPE")
 async def choose_visit_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await delete_previous_messages(context)
 
     reply_keyboard = visit_type
     user_message = update.message.text
 
-    global user_chosen_commune
-    if user_message == "Север-американские":
-        user_chosen_commune = Commune.AMERICAN
-    elif user_message == "Северо-Германские":
-        user_chosen_commune = Commune.GERMAN
-    else:
+    commune = get_commune_by_label(user_message)
+    if commune is None:
         message = await update.message.reply_text(
             "Пожалуйста выберите из списка\n\nНажмите /cancel чтобы выйти"
         )
         await store_message(update, context, update.message.message_id)
         await store_message(update, context, message.message_id)
         return CHOOSE_VISIT_TYPE
+    context.user_data["commune"] = commune.name
 
     message = await update.message.reply_text(
         "Выберите тип посещения\n\nНажмите /cancel чтобы выйти",
@@ -218,16 +375,15 @@ async def choose_visit_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CHOOSE_DATE
 
 
+@conversation_handler("CHOOSE_DATE")
 async def choose_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await delete_previous_messages(context)
 
     user_message = update.message.text
 
-    global user_visit_type
-    if user_message == "Терапия (индивидуально, 1 час)":
-        user_visit_type = VisitType.THERAPY
-    elif user_message == "Лекция (с другими гостями, 30 мин. или 1 час)":
-        user_visit_type = VisitType.LECTURE
+    chosen_visit_type = VISIT_TYPE_LABELS.get(user_message)
+    if chosen_visit_type is not None:
+        context.user_data["visit_type"] = chosen_visit_type.value
     else:
         message = await update.message.reply_text(
             "Пожалуйста выберите из списка\n\nНажмите /cancel чтобы выйти"
@@ -236,7 +392,9 @@ async def choose_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await store_message(update, context, message.message_id)
         return CHOOSE_DATE
 
-    reply_keyboard = get_reply_keyboard()
+    reply_keyboard = get_reply_keyboard(
+        _chosen_commune(context), visit_type=_chosen_visit_type(context)
+    )
 
     message = await update.message.reply_text(
         "Выберете дату\n\nНажмите /cancel чтобы выйти",
@@ -248,24 +406,26 @@ async def choose_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await store_message(update, context, update.message.message_id)
     await store_message(update, context, message.message_id)
 
-    if user_visit_type == VisitType.THERAPY:
+    if _chosen_visit_type(context) == VisitType.THERAPY:
         return CHOOSE_TIME
     return CHOOSE_VISIT_DURATION
 
 
+@conversation_handler("CHOOSE_VISIT_DURATION")
 async def choose_visit_duration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await delete_previous_messages(context)
 
-    user_message = update.message.text
-    global user_chosen_commune
-    day = user_message.split(".")[0]
-    month = user_message.split(".")[1]
-    year = user_message.split(".")[2]
-
-    global date
-    date = moscow_tz.localize(datetime.datetime(int(year), int(month), int(day))).date()
+    date = parse_date_label(update.message.text or "")
+    if date is None:
+        message = await update.message.reply_text(
+            "Пожалуйста выберите из списка\n\nНажмите /cancel чтобы выйти"
+        )
+        await store_message(update, context, update.message.message_id)
+        await store_message(update, context, message.message_id)
+        return CHOOSE_VISIT_DURATION
+    context.user_data["date"] = date.isoformat()
 
-    reply_keyboard = [["30 минут"], ["1 час"]]
+    reply_keyboard = [[label] for label in DURATION_LABELS]
     message = await update.message.reply_text(
         "Выберете длительность посещения\n\nНажмите /cancel чтобы выйти",
         reply_markup=ReplyKeyboardMarkup(
@@ -279,24 +439,23 @@ async def choose_visit_duration(update: Update, context: ContextTypes.DEFAULT_TY
     return CHOOSE_TIME_FOR_LECTURE
 
 
+@conversation_handler("CHOOSE_TIME_FOR_LECTURE")
 async def choose_time_for_lecture(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await delete_previous_messages(context)
 
     user_message = update.message.text
-    global date
-    global user_chosen_commune
-    global visit_duration
-    visit_duration = user_message
+    date = _chosen_date(context)
+    commune = _chosen_commune(context)
+    context.user_data["visit_duration"] = user_message
 
     try:
-        if user_message == "30 минут":
+        duration = DURATION_LABELS.get(user_message)
+        if duration == 30:
             free_slots_for_a_day = get_lecture_free_half_an_hour_slots_for_a_day(
-                date, user_chosen_commune
-            )
-        elif user_message == "1 час":
-            free_slots_for_a_day = get_lecture_free_slots_for_a_day(
-                date, user_chosen_commune
+                date, commune
             )
+        elif duration == 60:
+            free_slots_for_a_day = get_lecture_free_slots_for_a_day(date, commune)
         else:
             message = await update.message.reply_text(
                 "Пожалуйста выберите из списка\n\nНажмите /cancel чтобы выйти"
@@ -309,13 +468,23 @@ async def choose_time_for_lecture(update: Update, context: ContextTypes.DEFAULT_
         message = await update.message.reply_text(
             "На выбранный день все занято. Пожалуйста, выберите другую дату\n\nНажмите /cancel чтобы выйти",
             reply_markup=ReplyKeyboardMarkup(
-                get_reply_keyboard(),
+                get_reply_keyboard(_chosen_commune(context)),
+            ),
+        )
+        await store_message(update, context, update.message.message_id)
+        await store_message(update, context, message.message_id)
+        return CHOOSE_DATE
+    except CalendarUnavailableException:
+        message = await update.message.reply_text(
+            "Расписание временно недоступно. Пожалуйста, попробуйте чуть позже или выберите другую дату\n\nНажмите /cancel чтобы выйти",
+            reply_markup=ReplyKeyboardMarkup(
+                get_reply_keyboard(_chosen_commune(context)),
             ),
         )
         await store_message(update, context, update.message.message_id)
         await store_message(update, context, message.message_id)
         return CHOOSE_DATE
-    except google.auth.exceptions.RefreshError:
+    except RefreshError:
         message = await update.message.reply_text(
             "Что-то пошло не так...\n\nЧтобы записаться повторно нажмите /start",
             reply_markup=ReplyKeyboardRemove(),
@@ -335,11 +504,11 @@ async def choose_time_for_lecture(update: Update, context: ContextTypes.DEFAULT_
         return ConversationHandler.END
 
     if free_slots_for_a_day:
-        guest_limit = get_commune_guest_limit(user_chosen_commune)
+        guest_limit = get_commune_guest_limit(commune)
         reply_keyboard = [
             [
                 InlineKeyboardButton(
-                    f"{':'.join(slot.start.split('T')[1].split('+')[0].split(':')[:2])}-{':'.join(slot.end.split('T')[1].split('+')[0].split(':')[:2])} ({guest_limit - slot.total_guests} мест)"
+                    slot_label(slot.start, slot.end, guest_limit - slot.total_guests)
                 )
             ]
             for slot in free_slots_for_a_day
@@ -348,17 +517,22 @@ async def choose_time_for_lecture(update: Update, context: ContextTypes.DEFAULT_
 
         if not reply_keyboard:
             message = await update.message.reply_text(
-                "На выбранный день все места заняты. Пожалуйста, выберите другую дату\n\nНажмите /cancel чтобы выйти",
+                "На выбранный день все места заняты. Можно встать в лист ожидания, "
+                "мы напишем, если место освободится, или выбрать другую дату\n\nНажмите /cancel чтобы выйти",
                 reply_markup=ReplyKeyboardMarkup(
-                    get_reply_keyboard(),
+                    [
+                        [_WAITLIST_MARK + slot_label(slot.start, slot.end)]
+                        for slot in free_slots_for_a_day
+                    ]
+                    + [[_OTHER_DATE]],
                 ),
             )
             await store_message(update, context, update.message.message_id)
             await store_message(update, context, message.message_id)
-            return CHOOSE_DATE
+            return WAITLIST_CHOOSE_SLOT
 
         message = await update.message.reply_text(
-            "Выберете время\n\nНажмите /cancel чтобы выйти",
+            f"Выберете время{_stale_note()}\n\nНажмите /cancel чтобы выйти",
             reply_markup=ReplyKeyboardMarkup(
                 reply_keyboard,
             ),
@@ -370,36 +544,81 @@ async def choose_time_for_lecture(update: Update, context: ContextTypes.DEFAULT_
         return ARE_CHILDREN
 
 
-async def choose_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@conversation_handler("WAITLIST_CHOOSE_SLOT")
+async def waitlist_choose_slot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await delete_previous_messages(context)
 
-    logger.info("User %s started free time.", update.message.from_user.first_name)
-    user = update.message.from_user
     user_message = update.message.text
-    logger.info("Free time for %s.", user.first_name)
+    commune = _chosen_commune(context)
+    choice = None
+    if (user_message or "").startswith(_WAITLIST_MARK):
+        choice = parse_slot_label(user_message.removeprefix(_WAITLIST_MARK))
+    if choice is None:
+        message = await update.message.reply_text(
+            "Выберите дату\n\nНажмите /cancel чтобы выйти",
+            reply_markup=ReplyKeyboardMarkup(get_reply_keyboard(commune)),
+        )
+        await store_message(update, context, update.message.message_id)
+        await store_message(update, context, message.message_id)
+        return CHOOSE_DATE
+
+    date = _chosen_date(context)
+    place = await asyncio.to_thread(
+        waitlist.join,
+        commune,
+        date,
+        choice.start_minute,
+        choice.end_minute,
+        update.effective_chat.id,
+    )
+    message = await update.message.reply_text(
+        f"Вы в листе ожидания на {date.day}.{date.month:02d} "
+        f"{choice.start}-{choice.end}, Ваш номер в очереди: {place}. "
+        f"Мы напишем, если место освободится\n\nЧтобы записаться на другое время нажмите /start",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    await store_message(update, context, update.message.message_id)
+    await store_message(update, context, message.message_id)
+    return ConversationHandler.END
 
-    global user_chosen_commune
 
-    day = user_message.split(".")[0]
-    month = user_message.split(".")[1]
-    year = user_message.split(".")[2]
+@conversation_handler("CHOOSE_TIME")
+async def choose_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await delete_previous_messages(context)
 
-    global date
-    date = moscow_tz.localize(datetime.datetime(int(year), int(month), int(day))).date()
+    date = parse_date_label(update.message.text or "")
+    if date is None:
+        message = await update.message.reply_text(
+            "Пожалуйста выберите из списка\n\nНажмите /cancel чтобы выйти"
+        )
+        await store_message(update, context, update.message.message_id)
+        await store_message(update, context, message.message_id)
+        return CHOOSE_TIME
+    context.user_data["date"] = date.isoformat()
 
     try:
-        free_slots_for_a_day = get_free_slots_for_a_day(date, user_chosen_commune)
+        free_slots_for_a_day = get_free_slots_for_a_day(date, _chosen_commune(context))
     except OutOfTimeException:
         message = await update.message.reply_text(
             "На выбранный день все занято. Пожалуйста, выберите другую дату\n\nНажмите /cancel чтобы выйти",
             reply_markup=ReplyKeyboardMarkup(
-                get_reply_keyboard(),
+                get_reply_keyboard(_chosen_commune(context)),
             ),
         )
         await store_message(update, context, update.message.message_id)
         await store_message(update, context, message.message_id)
         return CHOOSE_DATE
-    except google.auth.exceptions.RefreshError:
+    except CalendarUnavailableException:
+        message = await update.message.reply_text(
+            "Расписание временно недоступно. Пожалуйста, попробуйте чуть позже или выберите другую дату\n\nНажмите /cancel чтобы выйти",
+            reply_markup=ReplyKeyboardMarkup(
+                get_reply_keyboard(_chosen_commune(context)),
+            ),
+        )
+        await store_message(update, context, update.message.message_id)
+        await store_message(update, context, message.message_id)
+        return CHOOSE_DATE
+    except RefreshError:
         message = await update.message.reply_text(
             "Что-то пошло не так...\n\nЧтобы записаться повторно нажмите /start",
             reply_markup=ReplyKeyboardRemove(),
@@ -420,16 +639,12 @@ async def choose_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if free_slots_for_a_day:
         reply_keyboard = [
-            [
-                InlineKeyboardButton(
-                    f"{':'.join(slot.start.split('T')[1].split('+')[0].split(':')[:2])}-{':'.join(slot.end.split('T')[1].split('+')[0].split(':')[:2])}"
-                )
-            ]
+            [InlineKeyboardButton(slot_label(slot.start, slot.end))]
             for slot in free_slots_for_a_day
         ]
 
         message = await update.message.reply_text(
-            "Выберете время\n\nНажмите /cancel чтобы выйти",
+            f"Выберете время{_stale_note()}\n\nНажмите /cancel чтобы выйти",
             reply_markup=ReplyKeyboardMarkup(
                 reply_keyboard,
             ),
@@ -441,43 +656,43 @@ async def choose_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ARE_CHILDREN
 
 
+@conversation_handler("ARE_CHILDREN")
 async def are_children(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await delete_previous_messages(context)
 
-    user_message = update.message.text
-    global user_visit_type
-    try:
-        chosen_start_time = user_message.split("-")[0]
-        if user_visit_type == VisitType.THERAPY:
-            chosen_end_time = user_message.split("-")[1]
-        else:
-            chosen_end_time = user_message.split("-")[1].split(" ")[0]
-            # Store the available places from the message
-            global available_places
-            available_places = int(user_message.split("(")[1].split(" ")[0])
-        print(chosen_start_time, chosen_end_time)
-    except IndexError:
+    choice = parse_slot_label(update.message.text or "")
+    is_lecture = _chosen_visit_type(context) != VisitType.THERAPY
+    if choice is None or (is_lecture and choice.places is None):
         message = await update.message.reply_text(
             "Пожалуйста выберите из списка\n\nНажмите /cancel чтобы выйти",
         )
         await store_message(update, context, update.message.message_id)
         await store_message(update, context, message.message_id)
         return ARE_CHILDREN
+    if is_lecture:
+        # Store the available places from the message
+        context.user_data["available_places"] = choice.places
+
+    date = _chosen_date(context)
+    context.user_data["start_time"] = time_utils.iso_at(date, choice.start_minute)
+    context.user_data["end_time"] = time_utils.iso_at(date, choice.end_minute)
+
+    note = ""
+    if context.user_data.get("repeat_booking"):
+        if _chosen_visit_type(context) == VisitType.THERAPY or context.user_data[
+            "registration_amount"
+        ] <= context.user_data.get("available_places", 0):
+            return await _register(
+                update, context, context.user_data["registration_phone"]
+            )
+        # The whole party doesn't fit any more, ask for the details again
+        context.user_data["repeat_booking"] = False
+        note = f"На выбранное время осталось {context.user_data['available_places']} мест\n\n"
 
-    global chosen_start_time_str
-    chosen_start_time_str = (
-        f"{date.year}-{date.month:02d}-{date.day}T{chosen_start_time}:00+03:00"
-    )
-
-    global chosen_end_time_str
-    chosen_end_time_str = (
-        f"{date.year}-{date.month:02d}-{date.day}T{chosen_end_time}:00+03:00"
-    )
-
-    reply_keyboard = [["Да", "Нет"]]
+    reply_keyboard = [list(YES_NO_LABELS)]
 
     message = await update.message.reply_text(
-        "Будут ли с Вами дети?\n\nНажмите /cancel чтобы выйти",
+        f"{note}Будут ли с Вами дети?\n\nНажмите /cancel чтобы выйти",
         reply_markup=ReplyKeyboardMarkup(
             reply_keyboard,
         ),
@@ -489,14 +704,14 @@ async def are_children(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CHILDREN_AMOUNT
 
 
+@conversation_handler("CHILDREN_AMOUNT")
 async def children_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await delete_previous_messages(context)
 
-    global user_children_amount
-    user_message = update.message.text
-    if user_message == "Нет":
-        # Set the user_children_amount to 0 when "Нет" is selected
-        user_children_amount = 0
+    with_children = YES_NO_LABELS.get(update.message.text)
+    if with_children is False:
+        # Set the children amount to 0 when "Нет" is selected
+        context.user_data["children_amount"] = 0
         message = await update.message.reply_text(
             "На какое имя зарегистрировать?\n\nНажмите /cancel чтобы выйти",
             reply_markup=ReplyKeyboardRemove(),
@@ -504,7 +719,7 @@ async def children_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await store_message(update, context, update.message.message_id)
         await store_message(update, context, message.message_id)
         return REGISTER_AMOUNT
-    elif user_message == "Да":
+    elif with_children:
         reply_keyboard = [["1"], ["2"], ["3"], ["4"], ["5"]]
         message = await update.message.reply_text(
             "Укажите какое количество детей будет с Вами\n\nНажмите /cancel чтобы выйти",
@@ -524,22 +739,22 @@ async def children_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CHILDREN_AMOUNT
 
 
+@conversation_handler("REGISTER_NAME")
 async def register_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await delete_previous_messages(context)
 
     user_message = update.message.text
-    global user_children_amount
-    if user_children_amount is None or user_children_amount != 0:
+    if context.user_data.get("children_amount") != 0:
         try:
             # This is to ensure if the previous state was CHILDREN_AMOUNT
-            user_children_amount = int(user_message)
-            if user_children_amount > 5:
+            context.user_data["children_amount"] = int(user_message)
+            if context.user_data["children_amount"] > 5:
                 message = await update.message.reply_text(
                     "Пожалуйста, выберите из списка\n\nНажмите /cancel чтобы выйти"
                 )
                 await store_message(update, context, update.message.message_id)
                 await store_message(update, context, message.message_id)
-                user_children_amount = None
+                context.user_data["children_amount"] = None
                 return CHILDREN_AMOUNT
         except ValueError:
             message = await update.message.reply_text(
@@ -547,7 +762,7 @@ async def register_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             )
             await store_message(update, context, update.message.message_id)
             await store_message(update, context, message.message_id)
-            user_children_amount = None
+            context.user_data["children_amount"] = None
             return CHILDREN_AMOUNT
 
         message = await update.message.reply_text(
@@ -560,6 +775,7 @@ async def register_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     return REGISTER_AMOUNT
 
 
+@conversation_handler("REGISTER_AMOUNT")
 async def register_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await delete_previous_messages(context)
 
@@ -567,11 +783,11 @@ async def register_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_message = update.message.text
 
     if user_message:
-        global registration_name
-        registration_name = user_message
+        context.user_data["registration_name"] = user_message
 
         # For lecture visits, show only the available number of places
-        if user_visit_type == VisitType.LECTURE:
+        if _chosen_visit_type(context) == VisitType.LECTURE:
+            available_places = context.user_data["available_places"]
             reply_keyboard = [[str(i)] for i in range(1, min(6, available_places + 1))]
             if not reply_keyboard:
                 message = await update.message.reply_text(
@@ -603,24 +819,20 @@ async def register_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return REGISTER_PHONE
 
 
+@conversation_handler("REGISTER_PHONE")
 async def register_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await delete_previous_messages(context)
 
-    global registration_amount_done
     user = update.message.from_user
     user_message = update.message.text
 
-    logger.info(f"line 279 {registration_amount_done=}")
-
     if user_message:
-        if not registration_amount_done:
-            global registration_amount
+        if not context.user_data.get("registration_amount_done"):
             try:
                 registration_amount = int(user_message)
-                logger.info(
-                    f"кол-во человек зарегистрировано -- {registration_amount} чел"
-                )
-                registration_amount_done = True
+                logger.debug("Party size chosen: %s", registration_amount)
+                context.user_data["registration_amount"] = registration_amount
+                context.user_data["registration_amount_done"] = True
                 if int(user_message) > 5:
                     message = await update.message.reply_text(
                         "Количество не должно превышать 5 человек\n\nПожалуйста выберите из списка\n\nНажмите /cancel чтобы выйти",
@@ -630,8 +842,9 @@ async def register_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     return REGISTER_PHONE
 
                 # For lecture visits, check if the requested number of guests exceeds available places
+                available_places = context.user_data.get("available_places", 0)
                 if (
-                    user_visit_type == VisitType.LECTURE
+                    _chosen_visit_type(context) == VisitType.LECTURE
                     and registration_amount > available_places
                 ):
                     message = await update.message.reply_text(
@@ -642,7 +855,7 @@ async def register_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     )
                     await store_message(update, context, update.message.message_id)
                     await store_message(update, context, message.message_id)
-                    registration_amount_done = False
+                    context.user_data["registration_amount_done"] = False
                     return REGISTER_PHONE
             except ValueError:
                 message = await update.message.reply_text(
@@ -660,22 +873,19 @@ async def register_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await store_message(update, context, update.message.message_id)
         await store_message(update, context, message.message_id)
 
-        logger.info(f"line 306 {registration_amount_done=}")
         return MAKE_REGISTRATION
 
 
+@conversation_handler("MAKE_REGISTRATION")
 async def make_registration(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await delete_previous_messages(context)
 
     user = update.message.from_user
     user_message = update.message.text
-    phone_regex = re.compile(
-        r'^(\+7|8)(\s|-)?(\()?[0-9]{3}(\))?(\s|-)?([0-9]{3})(\s|-)?([0-9]{2})(\s|-)?([0-9]{2})$'
-    )
 
     if user_message:
         # / check regexp
-        if not phone_regex.match(user_message):
+        if not PHONE_REGEX.match(user_message):
             message = await update.message.reply_text(
                 "Номер телефона не соответствует формату. Попробуйте снова.\n\nНажмите /cancel чтобы выйти",
             )
@@ -683,48 +893,41 @@ async def make_registration(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await store_message(update, context, message.message_id)
             return MAKE_REGISTRATION
 
-        registration_phone = user_message
+        return await _register(update, context, user_message)
 
-        try:
-            assert isinstance(
-                user_children_amount, int
-            ), "children_amount must be an integer"
-            assert isinstance(
-                user_chosen_commune, Commune
-            ), "commune must be of type Commune"
-            assert isinstance(
-                user_visit_type, VisitType
-            ), "visit_type must be of type VisitType"
-
-            registration_result = create_event(
-                summary=f"{registration_name}+{registration_amount}",
-                start_time=chosen_start_time_str,
-                end_time=chosen_end_time_str,
-                children_amount=user_children_amount,
-                phone=registration_phone,
-                commune=user_chosen_commune,
-                visit_type=user_visit_type,
-                total_guests=registration_amount,
-            )
-        except (ValueError, AssertionError) as e:
-            logger.error(f"An error occurred: {e}")
-            message = await update.message.reply_text(
-                "Что-то пошло не так...\n\nЧтобы записаться повторно нажмите /start",
-                reply_markup=ReplyKeyboardRemove(),
-            )
-            await store_message(update, context, update.message.message_id)
-            await store_message(update, context, message.message_id)
-            return ConversationHandler.END
-
-        if registration_result:
-            # Delete all previous messages before showing success
-            await delete_previous_messages(context)
-            await update.message.reply_text(
-                "Вы успешно зарегистрированы!\nБудем Вас ждать!\n\nЧтобы записаться повторно нажмите /start",
-                reply_markup=ReplyKeyboardRemove(),
-            )
-            return ConversationHandler.END
 
+async def _register(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, registration_phone: str
+) -> int:
+    """Book the slot chosen in the conversation and end it."""
+    booking = context.user_data
+    commune = _chosen_commune(context)
+    visit_type = _chosen_visit_type(context)
+
+    try:
+        assert isinstance(
+            booking.get("children_amount"), int
+        ), "children_amount must be an integer"
+        assert isinstance(commune, Commune), "commune must be of type Commune"
+        assert isinstance(visit_type, VisitType), "visit_type must be of type VisitType"
+
+        # May wait on the reservation lock, so keep it off the event loop
+        registration_result = await asyncio.to_thread(
+            create_event,
+            summary=f"{booking['registration_name']}+{booking['registration_amount']}",
+            start_time=booking["start_time"],
+            end_time=booking["end_time"],
+            children_amount=booking["children_amount"],
+            phone=registration_phone,
+            commune=commune,
+            visit_type=visit_type,
+            total_guests=booking["registration_amount"],
+            chat_id=update.effective_chat.id,
+            booking_id=context.user_data.get("booking_id"),
+            user_id=update.effective_user.id,
+        )
+    except (ValueError, AssertionError) as e:
+        logger.error("An error occurred: %s", e)
         message = await update.message.reply_text(
             "Что-то пошло не так...\n\nЧтобы записаться повторно нажмите /start",
             reply_markup=ReplyKeyboardRemove(),
@@ -733,7 +936,39 @@ async def make_registration(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await store_message(update, context, message.message_id)
         return ConversationHandler.END
 
+    if registration_result:
+        # Insert into Calendar right away instead of on the next tick
+        context.job_queue.run_once(flush_outbox, 0)
+        await asyncio.to_thread(
+            user_profiles.save,
+            update.effective_user.id,
+            UserProfile(
+                commune.name,
+                visit_type.value,
+                booking["children_amount"],
+                booking["registration_name"],
+                booking["registration_amount"],
+                registration_phone,
+            ),
+        )
+        # Delete all previous messages before showing success
+        await delete_previous_messages(context)
+        await update.message.reply_text(
+            "Вы успешно зарегистрированы!\nБудем Вас ждать!\n\nЧтобы записаться повторно нажмите /start",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+        return ConversationHandler.END
+
+    message = await update.message.reply_text(
+        "Что-то пошло не так...\n\nЧтобы записаться повторно нажмите /start",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    await store_message(update, context, update.message.message_id)
+    await store_message(update, context, message.message_id)
+    return ConversationHandler.END
+
 
+@conversation_handler("CANCEL")
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancels and ends the conversation."""
     await delete_previous_messages(context)
@@ -753,8 +988,266 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 
+def _booking_label(booking: UserBooking) -> str:
+    day = booking.day
+    return (
+        f"{day.day}.{day.month:02d} {slot_label(booking.start, booking.end)}, "
+        f"{get_commune(booking.commune).settings.label}"
+    )
+
+
+def _managed_booking(context: ContextTypes.DEFAULT_TYPE) -> UserBooking:
+    return UserBooking(*context.user_data["managed_booking"])
+
+
+@conversation_handler("MY_BOOKINGS", starts_trace=True)
+async def my_bookings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    bookings = await asyncio.to_thread(
+        user_bookings.get_upcoming, update.effective_user.id
+    )
+    if not bookings:
+        await update.message.reply_text(
+            "У Вас нет предстоящих записей\n\nЧтобы записаться нажмите /start"
+        )
+        return
+
+    lines = "\n".join(_booking_label(booking) for booking in bookings)
+    await update.message.reply_text(
+        f"Ваши записи:\n{lines}\n\n"
+        f"Отменить запись: /cancel_booking\nПеренести запись: /reschedule"
+    )
+
+
+async def _ask_for_booking(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, next_state: int
+) -> int:
+    await delete_previous_messages(context)
+    bookings = await asyncio.to_thread(
+        user_bookings.get_upcoming, update.effective_user.id
+    )
+    if not bookings:
+        await update.message.reply_text(
+            "У Вас нет предстоящих записей\n\nЧтобы записаться нажмите /start",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+        return ConversationHandler.END
+
+    context.user_data["booking_choices"] = {
+        _booking_label(booking): list(booking) for booking in bookings
+    }
+    message = await update.message.reply_text(
+        "Выберите запись\n\nНажмите /cancel чтобы выйти",
+        reply_markup=ReplyKeyboardMarkup(
+            [[label] for label in context.user_data["booking_choices"]]
+        ),
+    )
+    await store_message(update, context, update.message.message_id)
+    await store_message(update, context, message.message_id)
+    return next_state
+
+
+async def _choose_booking(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Remember the booking picked from the list; False if it isn't one."""
+    await delete_previous_messages(context)
+    chosen = context.user_data.get("booking_choices", {}).get(update.message.text)
+    if chosen is None:
+        message = await update.message.reply_text(
+            "Пожалуйста выберите из списка\n\nНажмите /cancel чтобы выйти"
+        )
+        await store_message(update, context, update.message.message_id)
+        await store_message(update, context, message.message_id)
+        return False
+    context.user_data["managed_booking"] = chosen
+    return True
+
+
+@conversation_handler("CANCEL_BOOKING", starts_trace=True)
+async def cancel_booking_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await _ask_for_booking(update, context, CANCEL_CHOOSE_BOOKING)
+
+
+@conversation_handler("CANCEL_CHOOSE_BOOKING")
+async def cancel_choose_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await _choose_booking(update, context):
+        return CANCEL_CHOOSE_BOOKING
+
+    message = await update.message.reply_text(
+        f"Отменить запись {_booking_label(_managed_booking(context))}?",
+        reply_markup=ReplyKeyboardMarkup([["Да, отменить"], ["Нет"]]),
+    )
+    await store_message(update, context, update.message.message_id)
+    await store_message(update, context, message.message_id)
+    return CANCEL_CONFIRM
+
+
+@conversation_handler("CANCEL_CONFIRM")
+async def cancel_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await delete_previous_messages(context)
+    if update.message.text != "Да, отменить":
+        await update.message.reply_text(
+            "Запись сохранена", reply_markup=ReplyKeyboardRemove()
+        )
+        return ConversationHandler.END
+
+    try:
+        await asyncio.to_thread(
+            cancel_booking, update.effective_user.id, _managed_booking(context)
+        )
+    except Exception:
+        logger.exception("Failed to cancel a booking")
+        await update.message.reply_text(
+            "Не удалось отменить запись, попробуйте чуть позже",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+        return ConversationHandler.END
+
+    await update.message.reply_text(
+        "Запись отменена\n\nЧтобы записаться снова нажмите /start",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    return ConversationHandler.END
+
+
+@conversation_handler("RESCHEDULE", starts_trace=True)
+async def reschedule_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await _ask_for_booking(update, context, RESCHEDULE_CHOOSE_BOOKING)
+
+
+def _reschedule_days_keyboard(booking: UserBooking):
+    return get_reply_keyboard(
+        get_commune(booking.commune), visit_type=VisitType(booking.visit_type)
+    )
+
+
+@conversation_handler("RESCHEDULE_CHOOSE_BOOKING")
+async def reschedule_choose_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await _choose_booking(update, context):
+        return RESCHEDULE_CHOOSE_BOOKING
+
+    message = await update.message.reply_text(
+        "Выберете новую дату\n\nНажмите /cancel чтобы выйти",
+        reply_markup=ReplyKeyboardMarkup(
+            _reschedule_days_keyboard(_managed_booking(context))
+        ),
+    )
+    await store_message(update, context, update.message.message_id)
+    await store_message(update, context, message.message_id)
+    return RESCHEDULE_CHOOSE_DATE
+
+
+@conversation_handler("RESCHEDULE_CHOOSE_DATE")
+async def reschedule_choose_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await delete_previous_messages(context)
+    booking = _managed_booking(context)
+    date = parse_date_label(update.message.text or "")
+    try:
+        slots = (
+            await asyncio.to_thread(free_slots_for_move, booking, date) if date else []
+        )
+    except (OutOfTimeException, CalendarUnavailableException):
+        slots = []
+
+    if not slots:
+        message = await update.message.reply_text(
+            "На выбранный день нет свободного времени. Пожалуйста, выберите другую дату\n\nНажмите /cancel чтобы выйти",
+            reply_markup=ReplyKeyboardMarkup(_reschedule_days_keyboard(booking)),
+        )
+        await store_message(update, context, update.message.message_id)
+        await store_message(update, context, message.message_id)
+        return RESCHEDULE_CHOOSE_DATE
+
+    context.user_data["slot_choices"] = {
+        slot_label(start, end): [start, end] for start, end in slots
+    }
+    message = await update.message.reply_text(
+        f"Выберете время{_stale_note()}\n\nНажмите /cancel чтобы выйти",
+        reply_markup=ReplyKeyboardMarkup(
+            [[label] for label in context.user_data["slot_choices"]]
+        ),
+    )
+    await store_message(update, context, update.message.message_id)
+    await store_message(update, context, message.message_id)
+    return RESCHEDULE_CHOOSE_TIME
+
+
+@conversation_handler("RESCHEDULE_CHOOSE_TIME")
+async def reschedule_choose_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await delete_previous_messages(context)
+    chosen = context.user_data.get("slot_choices", {}).get(update.message.text)
+    if chosen is None:
+        message = await update.message.reply_text(
+            "Пожалуйста выберите из списка\n\nНажмите /cancel чтобы выйти"
+        )
+        await store_message(update, context, update.message.message_id)
+        await store_message(update, context, message.message_id)
+        return RESCHEDULE_CHOOSE_TIME
+
+    try:
+        moved = await asyncio.to_thread(
+            reschedule_booking,
+            update.effective_user.id,
+            _managed_booking(context),
+            *chosen,
+        )
+    except BookingStillPendingError:
+        text = (
+            "Запись ещё сохраняется в календаре, попробуйте через минуту: /reschedule"
+        )
+    except Exception:
+        logger.exception("Failed to reschedule a booking")
+        text = "Не удалось перенести запись, попробуйте чуть позже"
+    else:
+        if moved:
+            text = "Запись перенесена!\n\nВаши записи: /my_bookings"
+        else:
+            text = "Это время уже занято. Чтобы выбрать другое нажмите /reschedule"
+
+    await update.message.reply_text(text, reply_markup=ReplyKeyboardRemove())
+    return ConversationHandler.END
+
+
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if isinstance(context.error, RetryAfter):
+        TELEGRAM_RATE_LIMITED.inc()
+    logger.error("Exception while handling an update", exc_info=context.error)
+
+
 if __name__ == "__main__":
-    application = ApplicationBuilder().token(get_settings().telegram.bot_token).build()
+    settings = get_settings()
+    setup_logging(
+        settings.logging.level,
+        settings.logging.json_format,
+        parse_sample_rates(settings.logging.sample_rates),
+    )
+    if settings.metrics.enabled:
+        start_metrics_server(settings.metrics.host, settings.metrics.port)
+    if settings.tracing.enabled:
+        configure_tracing(
+            settings.tracing.sample_ratio,
+            settings.tracing.service_name,
+            settings.tracing.export_file,
+            settings.tracing.collector_url,
+        )
+
+    builder = (
+        ApplicationBuilder()
+        .token(settings.telegram.bot_token)
+        .request(
+            make_request(settings.transport, settings.transport.telegram_pool_size)
+        )
+    )
+    if settings.webhook.mode == "webhook":
+        # Updates are pushed by the webhook router instead of polled
+        builder = builder.updater(None)
+    else:
+        # getUpdates is a single long poll, it never needs a second connection
+        builder = builder.get_updates_request(make_request(settings.transport, 1))
+    backend = get_backend()
+    if backend.shared:
+        builder = builder.persistence(
+            BackendPersistence(backend, settings.state.persistence_interval_seconds)
+        )
+    application = builder.build()
 
     init_conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
@@ -791,10 +1284,74 @@ if __name__ == "__main__":
             MAKE_REGISTRATION: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, make_registration)
             ],
+            WAITLIST_CHOOSE_SLOT: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, waitlist_choose_slot)
+            ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="registration",
+        persistent=backend.shared,
+        conversation_timeout=settings.sessions.idle_timeout_seconds,
     )
 
-    application.add_handler(init_conv_handler)
+    manage_conv_handler = ConversationHandler(
+        entry_points=[
+            CommandHandler("cancel_booking", cancel_booking_start),
+            CommandHandler("reschedule", reschedule_start),
+        ],
+        states={
+            CANCEL_CHOOSE_BOOKING: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, cancel_choose_booking)
+            ],
+            CANCEL_CONFIRM: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, cancel_confirm)
+            ],
+            RESCHEDULE_CHOOSE_BOOKING: [
+                MessageHandler(
+                    filters.TEXT & ~filters.COMMAND, reschedule_choose_booking
+                )
+            ],
+            RESCHEDULE_CHOOSE_DATE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, reschedule_choose_date)
+            ],
+            RESCHEDULE_CHOOSE_TIME: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, reschedule_choose_time)
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="manage_bookings",
+        persistent=backend.shared,
+        conversation_timeout=settings.sessions.idle_timeout_seconds,
+    )
 
-    application.run_polling(poll_interval=1.0)
+    application.add_handler(init_conv_handler)
+    application.add_handler(manage_conv_handler)
+    application.add_handler(CommandHandler("my_bookings", my_bookings))
+    add_admin_handlers(application)
+    add_session_handlers(application)
+    application.add_error_handler(error_handler)
+
+    schedule_outbox(application.job_queue)
+    schedule_send_queue(application.job_queue)
+    if settings.reminders.enabled:
+        schedule_reminders(application.job_queue)
+    if settings.availability_cache.prewarm_enabled:
+        schedule_prewarm(application.job_queue)
+    if settings.hot_reload.enabled:
+        schedule_settings_reload(application.job_queue)
+    if settings.metrics.enabled:
+        schedule_heartbeat(application.job_queue)
+
+    if settings.startup.warm_up:
+        warm_up()
+
+    if settings.webhook.mode == "webhook":
+        asyncio.run(
+            run_worker(
+                application,
+                settings.webhook.worker_host,
+                settings.webhook.worker_port,
+            )
+        )
+    else:
+        application.run_polling(poll_interval=1.0)
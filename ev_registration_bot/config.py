@@ -1,19 +1,410 @@
-from dotenv import load_dotenv
-from pydantic import Field
-from pydantic_settings import BaseSettings
+import datetime
+import functools
+import logging
+import os
+import threading
+from typing import Callable, Literal
 
-load_dotenv()
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
+logger = logging.getLogger(__name__)
 
-class TelegramSettings(BaseSettings):
+# Read on every (re)load, so editing it takes effect without a restart.
+# Real environment variables still take precedence over it.
+ENV_FILE = os.environ.get("SETTINGS_ENV_FILE", ".env")
+
+
+class FrozenSettings(BaseSettings):
+    """Settings read from the environment and ENV_FILE, immutable once loaded."""
+
+    model_config = SettingsConfigDict(frozen=True, env_file=ENV_FILE, extra="ignore")
+
+
+class TelegramSettings(FrozenSettings):
     bot_token: str = Field(..., validation_alias="TELEGRAM_BOT_TOKEN")
     bot_username: str = Field(..., validation_alias="TELEGRAM_BOT_USERNAME")
+    # Telegram user ids allowed to run the admin commands, e.g. [123, 456]
+    admin_ids: frozenset[int] = Field(
+        frozenset(), validation_alias="TELEGRAM_ADMIN_IDS"
+    )
+
+
+class MetricsSettings(FrozenSettings):
+    enabled: bool = Field(False, validation_alias="METRICS_ENABLED")
+    host: str = Field("127.0.0.1", validation_alias="METRICS_HOST")
+    port: int = Field(9108, validation_alias="METRICS_PORT")
+
+
+class TracingSettings(FrozenSettings):
+    enabled: bool = Field(False, validation_alias="TRACING_ENABLED")
+    sample_ratio: float = Field(
+        0.1, ge=0, le=1, validation_alias="TRACING_SAMPLE_RATIO"
+    )
+    service_name: str = Field(
+        "ev-registration-bot", validation_alias="TRACING_SERVICE_NAME"
+    )
+    export_file: str | None = Field(None, validation_alias="TRACING_EXPORT_FILE")
+    collector_url: str | None = Field(None, validation_alias="TRACING_COLLECTOR_URL")
+
+
+class LoggingSettings(FrozenSettings):
+    level: str = Field("INFO", validation_alias="LOG_LEVEL")
+    json_format: bool = Field(True, validation_alias="LOG_JSON")
+    # e.g. "DEBUG=0.01,INFO=0.5"; levels not listed are always kept
+    sample_rates: str = Field("", validation_alias="LOG_SAMPLE_RATES")
+
+
+class BreakSettings(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    start: datetime.time
+    end: datetime.time
+
+
+class WorkingHoursSettings(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    opens_at: datetime.time = datetime.time(11)
+    closes_at: datetime.time = datetime.time(21)
+    breaks: tuple[BreakSettings, ...] = (
+        BreakSettings(start=datetime.time(15), end=datetime.time(17)),
+    )
+
+
+class Schedule(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    working_hours: WorkingHoursSettings = WorkingHoursSettings()
+    # Weekday (0 = Monday) -> hours for that day; null closes the day
+    weekday_hours: dict[int, WorkingHoursSettings | None] = {}
+    holidays: frozenset[datetime.date] = frozenset()
+    # Distance between slot starts; defaults to the visit duration
+    slot_step_minutes: int | None = Field(None, gt=0)
+
+
+class ScheduleSettings(FrozenSettings):
+    default: Schedule = Field(Schedule(), validation_alias="SCHEDULE_DEFAULT")
+
+
+class AvailabilityCacheSettings(FrozenSettings):
+    prewarm_enabled: bool = Field(True, validation_alias="PREWARM_ENABLED")
+    # Days kept warm per commune, counted like the date keyboard counts them
+    horizon_days: int = Field(3, gt=0, validation_alias="PREWARM_HORIZON_DAYS")
+    # Today and tomorrow by default
+    near_days: int = Field(2, ge=0, validation_alias="PREWARM_NEAR_DAYS")
+    near_refresh_seconds: float = Field(
+        60, gt=0, validation_alias="PREWARM_NEAR_REFRESH_SECONDS"
+    )
+    far_refresh_seconds: float = Field(
+        300, gt=0, validation_alias="PREWARM_FAR_REFRESH_SECONDS"
+    )
+    tick_seconds: float = Field(10, gt=0, validation_alias="PREWARM_TICK_SECONDS")
+    max_backoff_seconds: float = Field(
+        900, gt=0, validation_alias="PREWARM_MAX_BACKOFF_SECONDS"
+    )
+
+
+class NotificationSettings(FrozenSettings):
+    # Telegram allows about 30 messages a second to different chats
+    messages_per_second: int = Field(
+        20, gt=0, validation_alias="NOTIFY_MESSAGES_PER_SECOND"
+    )
+    tick_seconds: float = Field(1, gt=0, validation_alias="NOTIFY_TICK_SECONDS")
+
+
+class ReminderSettings(FrozenSettings):
+    enabled: bool = Field(True, validation_alias="REMINDERS_ENABLED")
+    path: str = Field("reminders.sqlite3", validation_alias="REMINDERS_PATH")
+    hours_before: float = Field(24, gt=0, validation_alias="REMINDER_HOURS_BEFORE")
+    tick_seconds: float = Field(30, gt=0, validation_alias="REMINDER_TICK_SECONDS")
+    # Reminders handed to the send queue per tick at most
+    batch_size: int = Field(200, gt=0, validation_alias="REMINDER_BATCH_SIZE")
+
+
+class ProfileSettings(FrozenSettings):
+    # Where profiles are kept while STATE_BACKEND=memory, which would lose
+    # them on every restart; a shared backend keeps them itself
+    path: str = Field("user_profiles.sqlite3", validation_alias="PROFILES_PATH")
+
+
+class OutboxSettings(FrozenSettings):
+    path: str = Field("booking_outbox.sqlite3", validation_alias="OUTBOX_PATH")
+    flush_interval_seconds: float = Field(
+        5, gt=0, validation_alias="OUTBOX_FLUSH_INTERVAL_SECONDS"
+    )
+    base_backoff_seconds: float = Field(
+        2, gt=0, validation_alias="OUTBOX_BASE_BACKOFF_SECONDS"
+    )
+    max_backoff_seconds: float = Field(
+        600, gt=0, validation_alias="OUTBOX_MAX_BACKOFF_SECONDS"
+    )
+    max_attempts: int = Field(30, gt=0, validation_alias="OUTBOX_MAX_ATTEMPTS")
+
+
+class BulkAvailabilitySettings(FrozenSettings):
+    # None: one worker process per CPU
+    max_workers: int | None = Field(None, gt=0, validation_alias="BULK_MAX_WORKERS")
+    # Days whose events are fetched at the same time
+    fetch_concurrency: int = Field(4, gt=0, validation_alias="BULK_FETCH_CONCURRENCY")
 
 
-class Settings(BaseSettings):
-    telegram: TelegramSettings = TelegramSettings()
+class CircuitBreakerSettings(FrozenSettings):
+    failure_threshold: int = Field(
+        3, gt=0, validation_alias="CIRCUIT_BREAKER_FAILURE_THRESHOLD"
+    )
+    slow_call_seconds: float = Field(
+        5, gt=0, validation_alias="CIRCUIT_BREAKER_SLOW_CALL_SECONDS"
+    )
+    open_seconds: float = Field(
+        30, gt=0, validation_alias="CIRCUIT_BREAKER_OPEN_SECONDS"
+    )
+
+
+class TransportSettings(FrozenSettings):
+    # Bot API: handlers of every in-flight chat may be sending at once
+    telegram_pool_size: int = Field(256, gt=0, validation_alias="TELEGRAM_POOL_SIZE")
+    telegram_connect_timeout: float = Field(
+        5, gt=0, validation_alias="TELEGRAM_CONNECT_TIMEOUT"
+    )
+    telegram_read_timeout: float = Field(
+        10, gt=0, validation_alias="TELEGRAM_READ_TIMEOUT"
+    )
+    telegram_write_timeout: float = Field(
+        10, gt=0, validation_alias="TELEGRAM_WRITE_TIMEOUT"
+    )
+    telegram_pool_timeout: float = Field(
+        5, gt=0, validation_alias="TELEGRAM_POOL_TIMEOUT"
+    )
+    telegram_http2: bool = Field(True, validation_alias="TELEGRAM_HTTP2")
+    # Calendar: calls run in the default executor, at most 32 threads at once
+    calendar_pool_size: int = Field(32, gt=0, validation_alias="CALENDAR_POOL_SIZE")
+    calendar_pool_connections: int = Field(
+        4, gt=0, validation_alias="CALENDAR_POOL_CONNECTIONS"
+    )
+    calendar_connect_timeout: float = Field(
+        5, gt=0, validation_alias="CALENDAR_CONNECT_TIMEOUT"
+    )
+    calendar_read_timeout: float = Field(
+        15, gt=0, validation_alias="CALENDAR_READ_TIMEOUT"
+    )
+
+
+class CommuneSettings(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    # Stable id, stored with bookings and used in metric labels
+    id: str
+    # Text of the commune's button
+    label: str
+    calendar_id: str = "primary"
+    # Directory holding the calendar's credentials.json and token.json
+    config_dir: str
+    # Guests a lecture slot can take
+    guest_limit: int = Field(gt=0)
+    # Included in visit reminders
+    address: str = ""
+    # Calendar colorId of lectures and of therapy visits
+    lecture_color: int
+    therapy_color: int = 5
+    # Replaces the default schedule for this commune
+    schedule: Schedule | None = None
+
+
+class CommunesSettings(FrozenSettings):
+    registry: tuple[CommuneSettings, ...] = Field(
+        (
+            CommuneSettings(
+                id="AMERICAN",
+                label="Север-американские",
+                config_dir="american_calendar_configs",
+                guest_limit=10,
+                lecture_color=7,
+            ),
+            CommuneSettings(
+                id="GERMAN",
+                label="Северо-Германские",
+                config_dir="german_calendar_configs",
+                guest_limit=8,
+                lecture_color=1,
+            ),
+        ),
+        min_length=1,
+        validation_alias="COMMUNES",
+    )
+
+    @model_validator(mode="after")
+    def _check_unique(self) -> "CommunesSettings":
+        for field in ("id", "label"):
+            values = [getattr(commune, field) for commune in self.registry]
+            if len(set(values)) != len(values):
+                raise ValueError(f"Commune {field}s must be unique")
+        return self
+
+
+class StateSettings(FrozenSettings):
+    # "memory" keeps everything in this process; "sqlite" shares it between
+    # workers on one host, "resp" between hosts through a Redis-protocol server
+    backend: Literal["memory", "sqlite", "resp"] = Field(
+        "memory", validation_alias="STATE_BACKEND"
+    )
+    sqlite_path: str = Field("bot_state.sqlite3", validation_alias="STATE_SQLITE_PATH")
+    resp_url: str = Field("redis://127.0.0.1:6379/0", validation_alias="STATE_RESP_URL")
+    # Longer than a booking's capacity check, Calendar call included
+    lock_ttl_seconds: float = Field(30, gt=0, validation_alias="STATE_LOCK_TTL_SECONDS")
+    lock_timeout_seconds: float = Field(
+        10, gt=0, validation_alias="STATE_LOCK_TIMEOUT_SECONDS"
+    )
+    persistence_interval_seconds: float = Field(
+        5, gt=0, validation_alias="STATE_PERSISTENCE_INTERVAL_SECONDS"
+    )
+
+
+class WebhookSettings(FrozenSettings):
+    mode: Literal["polling", "webhook"] = Field("polling", validation_alias="BOT_MODE")
+    # Where this worker receives the updates forwarded by the router
+    worker_host: str = Field("127.0.0.1", validation_alias="WEBHOOK_WORKER_HOST")
+    worker_port: int = Field(8081, validation_alias="WEBHOOK_WORKER_PORT")
+    # Router: public URL registered with Telegram and where it listens
+    public_url: str | None = Field(None, validation_alias="WEBHOOK_URL")
+    listen: str = Field("0.0.0.0", validation_alias="WEBHOOK_LISTEN")
+    port: int = Field(8080, validation_alias="WEBHOOK_PORT")
+    secret_token: str | None = Field(None, validation_alias="WEBHOOK_SECRET")
+    # Worker URLs; a chat always goes to workers[chat_id % len(workers)]
+    workers: list[str] = Field(
+        ["http://127.0.0.1:8081"], min_length=1, validation_alias="WEBHOOK_WORKERS"
+    )
+
+
+class HotReloadSettings(FrozenSettings):
+    enabled: bool = Field(True, validation_alias="SETTINGS_HOT_RELOAD")
+    watch_seconds: float = Field(5, gt=0, validation_alias="SETTINGS_WATCH_SECONDS")
+
+
+class HealthSettings(FrozenSettings):
+    heartbeat_seconds: float = Field(
+        5, gt=0, validation_alias="HEALTH_HEARTBEAT_SECONDS"
+    )
+    # Job queue behind by more than this: the process is stuck
+    max_job_lag_seconds: float = Field(
+        60, gt=0, validation_alias="HEALTH_MAX_JOB_LAG_SECONDS"
+    )
+    # A prewarmed day older than this many refresh intervals is stale
+    mirror_stale_intervals: float = Field(
+        3, gt=0, validation_alias="HEALTH_MIRROR_STALE_INTERVALS"
+    )
+    # Bot API unreachable for longer than this: not ready
+    bot_api_grace_seconds: float = Field(
+        120, gt=0, validation_alias="HEALTH_BOT_API_GRACE_SECONDS"
+    )
+
+
+class SessionSettings(FrozenSettings):
+    # Conversations idle this long are ended and their user_data dropped
+    idle_timeout_seconds: float = Field(
+        30 * 60, gt=0, validation_alias="SESSION_IDLE_TIMEOUT_SECONDS"
+    )
+    sweep_seconds: float = Field(60, gt=0, validation_alias="SESSION_SWEEP_SECONDS")
+    # Chats whose leftover messages are deleted per sweep; the rest wait
+    max_cleanups_per_sweep: int = Field(
+        100, gt=0, validation_alias="SESSION_MAX_CLEANUPS_PER_SWEEP"
+    )
+
+
+class StartupSettings(FrozenSettings):
+    # Load credentials and build the Calendar clients before taking updates,
+    # instead of on the first user's request
+    warm_up: bool = Field(False, validation_alias="STARTUP_WARM_UP")
+
+
+class Settings(BaseModel):
+    # Each section reads its own variables; the sections themselves must not
+    # be read from the environment (COMMUNES would land in ``communes``)
+    model_config = ConfigDict(frozen=True)
+
+    metrics: MetricsSettings = Field(default_factory=MetricsSettings)
+    tracing: TracingSettings = Field(default_factory=TracingSettings)
+    logging: LoggingSettings = Field(default_factory=LoggingSettings)
+    schedule: ScheduleSettings = Field(default_factory=ScheduleSettings)
+    communes: CommunesSettings = Field(default_factory=CommunesSettings)
+    availability_cache: AvailabilityCacheSettings = Field(
+        default_factory=AvailabilityCacheSettings
+    )
+    outbox: OutboxSettings = Field(default_factory=OutboxSettings)
+    notifications: NotificationSettings = Field(default_factory=NotificationSettings)
+    reminders: ReminderSettings = Field(default_factory=ReminderSettings)
+    profiles: ProfileSettings = Field(default_factory=ProfileSettings)
+    bulk_availability: BulkAvailabilitySettings = Field(
+        default_factory=BulkAvailabilitySettings
+    )
+    circuit_breaker: CircuitBreakerSettings = Field(
+        default_factory=CircuitBreakerSettings
+    )
+    transport: TransportSettings = Field(default_factory=TransportSettings)
+    hot_reload: HotReloadSettings = Field(default_factory=HotReloadSettings)
+    startup: StartupSettings = Field(default_factory=StartupSettings)
+    health: HealthSettings = Field(default_factory=HealthSettings)
+    sessions: SessionSettings = Field(default_factory=SessionSettings)
+    state: StateSettings = Field(default_factory=StateSettings)
+    webhook: WebhookSettings = Field(default_factory=WebhookSettings)
+
+    @functools.cached_property
+    def telegram(self) -> TelegramSettings:
+        # Validated on first use, so tools that never talk to Telegram (like
+        # token_recreate) run without the bot token in the environment
+        return TelegramSettings()
+
+
+_settings: Settings | None = None
+_settings_lock = threading.Lock()
+_reload_callbacks: list[Callable[[Settings, Settings], None]] = []
 
 
-# @lru_cache()
 def get_settings() -> Settings:
-    return Settings()
+    """The current settings snapshot, loaded on first use."""
+    global _settings
+    settings = _settings
+    if settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = Settings()
+            settings = _settings
+    return settings
+
+
+def on_settings_reload(
+    callback: Callable[[Settings, Settings], None],
+) -> Callable[[Settings, Settings], None]:
+    """Call ``callback(old, new)`` after every reload that changed something."""
+    _reload_callbacks.append(callback)
+    return callback
+
+
+def reload_settings() -> bool:
+    """Re-read the settings and swap the snapshot if they are valid.
+
+    Invalid settings are logged and the current snapshot is kept, so a typo
+    in the env file can't take the bot down. Returns whether it was swapped.
+    """
+    global _settings
+    try:
+        new = Settings()
+        if _settings is not None and "telegram" in _settings.__dict__:
+            # Rejected like the other sections once the process uses it
+            new.telegram
+    except ValidationError as error:
+        logger.error("Settings reload rejected: %s", error)
+        return False
+
+    with _settings_lock:
+        old, _settings = _settings, new
+    if old is None or old == new:
+        return True
+
+    logger.info("Settings reloaded")
+    for callback in _reload_callbacks:
+        try:
+            callback(old, new)
+        except Exception:
+            logger.exception("Settings reload callback %r failed", callback)
+    return True
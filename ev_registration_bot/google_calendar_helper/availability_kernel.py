@@ -0,0 +1,59 @@
+"""Slot availability over compact event arrays, run in worker processes.
+
+Only the standard library is imported here, so tasks unpickle without the
+bot's dependencies. Times are minutes since the day's midnight, packed in ``array("H")``
+bytes: candidates as (start, end) pairs, therapy visits as (start, end)
+pairs and lectures as (start, end, guests) triples.
+"""
+
+from array import array
+from bisect import bisect_left
+
+
+def pack(values: list[int]) -> bytes:
+    return array("H", values).tobytes()
+
+
+def _unpack(data: bytes, width: int) -> list[tuple[int, ...]]:
+    values = array("H")
+    values.frombytes(data)
+    return sorted(zip(*(values[i::width] for i in range(width))))
+
+
+def compute_day(
+    candidates: bytes, therapy: bytes, lectures: bytes, guest_limit: int
+) -> list[tuple[int, int, bool, int]]:
+    """(start, end, free for therapy, places left for a lecture) per candidate.
+
+    A slot is free for therapy if nothing overlaps it. Lecture places are what
+    is left at the slot's busiest moment, and none if a therapy overlaps it.
+    """
+    therapy_visits = _unpack(therapy, 2)
+    lecture_visits = _unpack(lectures, 3)
+    lecture_starts = [lecture[0] for lecture in lecture_visits]
+
+    result = []
+    for start, end in _unpack(candidates, 2):
+        blocked = any(
+            visit_start < end and start < visit_end
+            for visit_start, visit_end in therapy_visits[
+                : bisect_left(therapy_visits, (end,))
+            ]
+        )
+        overlapping = [
+            lecture
+            for lecture in lecture_visits[: bisect_left(lecture_starts, end)]
+            if start < lecture[1]
+        ]
+        if blocked:
+            result.append((start, end, False, 0))
+            continue
+
+        # Occupancy only rises at the slot start or where a lecture starts
+        peak = 0
+        for point in [start] + [s for s, _, _ in overlapping if s > start]:
+            peak = max(
+                peak, sum(guests for s, e, guests in overlapping if s <= point < e)
+            )
+        result.append((start, end, not overlapping, max(0, guest_limit - peak)))
+    return result
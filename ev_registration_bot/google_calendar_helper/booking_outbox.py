@@ -0,0 +1,274 @@
+import datetime
+import hashlib
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+from ev_registration_bot.config import get_settings
+from ev_registration_bot.google_calendar_helper import events_cache
+from ev_registration_bot.google_calendar_helper.utils import Commune, get_commune
+from ev_registration_bot.shared_state.backend import get_backend
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    event_id TEXT PRIMARY KEY,
+    commune TEXT NOT NULL,
+    day TEXT NOT NULL,
+    body TEXT NOT NULL,
+    chat_id INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+
+class PendingBooking(NamedTuple):
+    event_id: str
+    commune: Commune
+    day: datetime.date
+    body: dict
+    chat_id: int | None
+    attempts: int
+
+
+class PendingVisit(NamedTuple):
+    """A reserved booking that may not be in the calendar yet."""
+
+    event_id: str
+    start: str
+    end: str
+    summary: str
+    description: str
+
+
+# How long a cancelled booking is remembered, so a queued insert is dropped
+_CANCELLED_TTL_SECONDS = 7 * 24 * 60 * 60
+
+_connection: sqlite3.Connection | None = None
+_lock = threading.Lock()
+_reservations_loaded = False
+
+
+def make_event_id(
+    commune: Commune,
+    start_time: str,
+    end_time: str,
+    phone: str,
+    booking_id: str | None = None,
+) -> str:
+    """Deterministic Calendar event id, so retried inserts can't duplicate a booking.
+
+    ``booking_id`` identifies the conversation the booking was made in, so
+    booking the same slot again later gets a fresh id. Calendar ids use
+    base32hex characters (0-9, a-v); a hex digest fits.
+    """
+    key = "|".join((commune.name, start_time, end_time, phone, booking_id or ""))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _get_connection() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(
+            get_settings().outbox.path, check_same_thread=False, isolation_level=None
+        )
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(_SCHEMA)
+    return _connection
+
+
+def _visit_from_body(event_id: str, body: dict) -> PendingVisit:
+    return PendingVisit(
+        event_id,
+        body["start"]["dateTime"],
+        body["end"]["dateTime"],
+        body["summary"],
+        body["description"],
+    )
+
+
+def _reservations_key(commune: Commune, day: datetime.date) -> str:
+    return f"reservations:{commune.name}:{day.isoformat()}"
+
+
+def _reserve(commune: Commune, day: datetime.date, visit: PendingVisit) -> None:
+    get_backend().hset(
+        _reservations_key(commune, day),
+        visit.event_id,
+        json.dumps(visit, ensure_ascii=False).encode(),
+    )
+
+
+def _load_reservations() -> None:
+    """Publish this outbox's pending bookings as reservations, once per process.
+
+    Reservations live in the state backend, so with a shared backend every
+    worker's capacity check sees the bookings queued by the others.
+    """
+    global _reservations_loaded
+    if _reservations_loaded:
+        return
+    rows = _get_connection().execute(
+        "SELECT event_id, commune, day, body FROM outbox WHERE status = 'pending'"
+    )
+    for event_id, commune, day, body in rows:
+        _reserve(
+            get_commune(commune),
+            datetime.date.fromisoformat(day),
+            _visit_from_body(event_id, json.loads(body)),
+        )
+    _reservations_loaded = True
+
+
+def pending_visits(commune: Commune, day: datetime.date) -> list[PendingVisit]:
+    with _lock:
+        _load_reservations()
+    stored = get_backend().hgetall(_reservations_key(commune, day))
+    return [PendingVisit(*json.loads(visit)) for visit in stored.values()]
+
+
+def enqueue(
+    event_id: str,
+    commune: Commune,
+    day: datetime.date,
+    body: dict,
+    chat_id: int | None = None,
+) -> bool:
+    """Persist a booking for asynchronous insertion.
+
+    Returns False if a booking with the same id is already queued or done.
+    """
+    now = time.time()
+    with _lock:
+        cursor = _get_connection().execute(
+            "INSERT OR IGNORE INTO outbox "
+            "(event_id, commune, day, body, chat_id, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                event_id,
+                commune.name,
+                day.isoformat(),
+                json.dumps(body, ensure_ascii=False),
+                chat_id,
+                now,
+                now,
+            ),
+        )
+        if cursor.rowcount == 0:
+            return False
+        _load_reservations()
+        _reserve(commune, day, _visit_from_body(event_id, body))
+    events_cache.day_changed(commune, day)
+    return True
+
+
+def due_bookings(limit: int = 20) -> list[PendingBooking]:
+    with _lock:
+        rows = (
+            _get_connection()
+            .execute(
+                "SELECT event_id, commune, day, body, chat_id, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (time.time(), limit),
+            )
+            .fetchall()
+        )
+    return [
+        PendingBooking(
+            event_id,
+            get_commune(commune),
+            datetime.date.fromisoformat(day),
+            json.loads(body),
+            chat_id,
+            attempts,
+        )
+        for event_id, commune, day, body, chat_id, attempts in rows
+    ]
+
+
+def _forget(booking: PendingBooking) -> None:
+    get_backend().hdel(
+        _reservations_key(booking.commune, booking.day), booking.event_id
+    )
+
+
+def mark_done(booking: PendingBooking) -> None:
+    with _lock:
+        _get_connection().execute(
+            "UPDATE outbox SET status = 'done', attempts = attempts + 1 "
+            "WHERE event_id = ?",
+            (booking.event_id,),
+        )
+        _forget(booking)
+
+
+def is_pending(commune: Commune, day: datetime.date, event_id: str) -> bool:
+    """Whether a booking is queued in some worker's outbox and not in Calendar yet."""
+    with _lock:
+        _load_reservations()
+    return get_backend().hget(_reservations_key(commune, day), event_id) is not None
+
+
+def cancel(commune: Commune, day: datetime.date, event_id: str) -> bool:
+    """Release a booking's reservation and keep it from being inserted.
+
+    Works for bookings queued by any worker sharing the backend. Returns
+    whether the booking was still queued; if not, it is already in Calendar.
+    """
+    was_pending = is_pending(commune, day, event_id)
+    backend = get_backend()
+    backend.set(f"cancelled:{event_id}", b"1", _CANCELLED_TTL_SECONDS)
+    backend.hdel(_reservations_key(commune, day), event_id)
+    return was_pending
+
+
+def is_cancelled(event_id: str) -> bool:
+    return get_backend().get(f"cancelled:{event_id}") is not None
+
+
+def mark_cancelled(booking: PendingBooking) -> None:
+    with _lock:
+        _get_connection().execute(
+            "UPDATE outbox SET status = 'cancelled' WHERE event_id = ?",
+            (booking.event_id,),
+        )
+        _forget(booking)
+
+
+def mark_failed(booking: PendingBooking, error: str) -> None:
+    """Give up on a booking and release the capacity it reserved."""
+    with _lock:
+        _get_connection().execute(
+            "UPDATE outbox SET status = 'failed', attempts = attempts + 1, "
+            "last_error = ? WHERE event_id = ?",
+            (error, booking.event_id),
+        )
+        _forget(booking)
+
+
+def schedule_retry(booking: PendingBooking, error: str) -> float:
+    """Back off exponentially (with jitter) before the next attempt; returns the delay."""
+    outbox_settings = get_settings().outbox
+    delay = min(
+        outbox_settings.max_backoff_seconds,
+        outbox_settings.base_backoff_seconds * 2**booking.attempts,
+    )
+    delay *= random.uniform(0.8, 1.2)
+    with _lock:
+        _get_connection().execute(
+            "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, "
+            "last_error = ? WHERE event_id = ?",
+            (time.time() + delay, error, booking.event_id),
+        )
+    return delay
@@ -0,0 +1,217 @@
+"""Availability of many (commune, day) pairs at once, computed in worker processes.
+
+Bulk queries ("every slot of both communes for the next 30 days", like the
+/availability admin command) would run the slot loops thousands of times.
+Here each day's events are packed into minute arrays, sent to a process
+pool, and results are yielded as each day finishes:
+
+    async for day in stream_availability(get_communes(), days, 30):
+        ...
+"""
+
+import asyncio
+import concurrent.futures
+import datetime
+import logging
+import multiprocessing
+import threading
+from typing import AsyncIterator, Iterable, NamedTuple
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.config import Settings, get_settings, on_settings_reload
+from ev_registration_bot.google_calendar_helper.availability_kernel import (
+    compute_day,
+    pack,
+)
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    CalendarUnavailableException,
+    OutOfTimeException,
+    get_events_for_day,
+    served_stale_data,
+)
+from ev_registration_bot.google_calendar_helper.schedule import (
+    first_bookable_minute,
+    get_day_templates,
+    minute_of_day,
+)
+from ev_registration_bot.google_calendar_helper.utils import (
+    Commune,
+    get_commune_guest_limit,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SlotAvailability(NamedTuple):
+    start_minute: int
+    end_minute: int
+    therapy_free: bool
+    lecture_places: int
+
+
+class DayAvailability(NamedTuple):
+    commune: Commune
+    day: datetime.date
+    slots: list[SlotAvailability]
+    # Computed from the mirror because Calendar was unavailable
+    stale: bool
+
+
+class _DayTask(NamedTuple):
+    commune: Commune
+    day: datetime.date
+    candidates: bytes
+    therapy: bytes
+    lectures: bytes
+    guest_limit: int
+    stale: bool
+
+
+_pool: concurrent.futures.ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """The process pool, started on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Spawned workers don't inherit the bot's threads and sockets
+                # the way forked ones would. Each still imports the bot's main
+                # module once, as __mp_main__, before it imports the kernel
+                _pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=get_settings().bulk_availability.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+@on_settings_reload
+def _on_settings_reload(old: Settings, new: Settings) -> None:
+    if old.bulk_availability.max_workers != new.bulk_availability.max_workers:
+        shutdown_pool()
+
+
+def _prepare_day(
+    commune: Commune, day: datetime.date, duration_minutes: int
+) -> _DayTask | None:
+    """Fetch a day's events and pack them, or None if nothing can be booked."""
+    templates = get_day_templates(commune, day, duration_minutes)
+    if not templates:
+        return None
+    try:
+        therapy_visits, lecture_visits = get_events_for_day(day, commune)
+    except OutOfTimeException:
+        return None
+
+    midnight = time_utils.local_midnight(day)
+    first_minute = first_bookable_minute(day, time_utils.now())
+
+    candidates, therapy, lectures = [], [], []
+    for template in templates:
+        if template.start_minute >= first_minute:
+            candidates += (template.start_minute, template.end_minute)
+    for visit in therapy_visits:
+        therapy += (
+            minute_of_day(visit.start, midnight),
+            minute_of_day(visit.end, midnight),
+        )
+    for visit in lecture_visits:
+        lectures += (
+            minute_of_day(visit.start, midnight),
+            minute_of_day(visit.end, midnight),
+            visit.total_guests,
+        )
+    return _DayTask(
+        commune,
+        day,
+        pack(candidates),
+        pack(therapy),
+        pack(lectures),
+        get_commune_guest_limit(commune),
+        served_stale_data(),
+    )
+
+
+async def _compute(
+    task: _DayTask, pool: concurrent.futures.ProcessPoolExecutor
+) -> DayAvailability:
+    slots = await asyncio.get_running_loop().run_in_executor(
+        pool,
+        compute_day,
+        task.candidates,
+        task.therapy,
+        task.lectures,
+        task.guest_limit,
+    )
+    return DayAvailability(
+        task.commune, task.day, [SlotAvailability(*slot) for slot in slots], task.stale
+    )
+
+
+async def stream_availability(
+    communes: Iterable[Commune],
+    days: Iterable[datetime.date],
+    duration_minutes: int,
+) -> AsyncIterator[DayAvailability]:
+    """Availability of every (commune, day), in the order the days finish.
+
+    Days the commune is closed, and days Calendar can't be reached for with
+    nothing mirrored, are skipped.
+    """
+    pool = get_pool()
+    fetch_slots = asyncio.Semaphore(get_settings().bulk_availability.fetch_concurrency)
+
+    async def fetch_and_compute(commune: Commune, day: datetime.date):
+        async with fetch_slots:
+            try:
+                task = await asyncio.to_thread(
+                    _prepare_day, commune, day, duration_minutes
+                )
+            except CalendarUnavailableException as error:
+                logger.warning(
+                    "Skipping %s on %s in bulk availability: %s",
+                    commune.name,
+                    day,
+                    error,
+                )
+                return None
+        if task is None:
+            return None
+        return await _compute(task, pool)
+
+    days = list(days)
+    pending = [
+        asyncio.ensure_future(fetch_and_compute(commune, day))
+        for commune in communes
+        for day in days
+    ]
+    try:
+        for next_done in asyncio.as_completed(pending):
+            result = await next_done
+            if result is not None:
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def get_availability(
+    communes: Iterable[Commune],
+    days: Iterable[datetime.date],
+    duration_minutes: int,
+) -> list[DayAvailability]:
+    """All of stream_availability's results, sorted by commune and day."""
+    results = [
+        result async for result in stream_availability(communes, days, duration_minutes)
+    ]
+    return sorted(results, key=lambda result: (result.commune.name, result.day))
@@ -0,0 +1,131 @@
+import functools
+import json
+import logging
+import threading
+from typing import TYPE_CHECKING, Callable, NamedTuple
+
+from ev_registration_bot.config import Settings, get_settings, on_settings_reload
+from ev_registration_bot.google_calendar_helper.utils import Commune
+from ev_registration_bot.tracing import start_span
+
+# The Google client stack (httplib2, requests, discovery) takes a large part
+# of start-up; it is imported when the first service is built
+if TYPE_CHECKING:
+    from google.auth.transport.requests import AuthorizedSession
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import Resource
+
+logger = logging.getLogger(__name__)
+
+
+class SessionHttp:
+    """httplib2-compatible facade over a pooled ``AuthorizedSession``.
+
+    googleapiclient only needs ``request()`` returning ``(Response, content)``,
+    so every service built on it shares the session's keep-alive connections
+    instead of opening a fresh httplib2 connection per ``build()``.
+    """
+
+    def __init__(self, session: "AuthorizedSession", timeout: tuple[float, float]):
+        self.session = session
+        self.timeout = timeout
+
+    def request(
+        self,
+        uri,
+        method="GET",
+        body=None,
+        headers=None,
+        redirections=5,
+        connection_type=None,
+    ):
+        import httplib2
+
+        response = self.session.request(
+            method, uri, data=body, headers=headers, timeout=self.timeout
+        )
+        info = httplib2.Response({"status": str(response.status_code)})
+        info.update((key.lower(), value) for key, value in response.headers.items())
+        info.reason = response.reason
+        return info, response.content
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class _CalendarClient(NamedTuple):
+    credentials: "Credentials"
+    http: SessionHttp
+    service: "Resource"
+
+
+_clients: dict[Commune, _CalendarClient] = {}
+_lock = threading.Lock()
+
+
+@functools.cache
+def _discovery_document() -> dict:
+    """Calendar v3 discovery document, parsed once for every commune's service.
+
+    The copy bundled with googleapiclient is used, so building a service never
+    fetches it over the network.
+    """
+    from googleapiclient.discovery_cache import get_static_doc
+
+    return json.loads(get_static_doc("calendar", "v3"))
+
+
+def _make_session(credentials: "Credentials") -> "AuthorizedSession":
+    from google.auth.transport.requests import AuthorizedSession
+    from requests.adapters import HTTPAdapter
+
+    transport = get_settings().transport
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(
+        pool_connections=transport.calendar_pool_connections,
+        pool_maxsize=transport.calendar_pool_size,
+        max_retries=0,
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+def get_calendar_service(
+    commune: Commune, load_credentials: Callable[[Commune], "Credentials"]
+) -> "Resource":
+    """Calendar service of ``commune``, shared across calls and threads.
+
+    Credentials are loaded once and only re-loaded (and so refreshed) when
+    they stop being valid; the underlying connection pool is kept.
+    """
+    with _lock:
+        client = _clients.get(commune)
+        if client is not None and client.credentials.valid:
+            return client.service
+
+        credentials = load_credentials(commune)
+        if client is not None:
+            client.http.session.credentials = credentials
+            client = client._replace(credentials=credentials)
+        else:
+            transport = get_settings().transport
+            http = SessionHttp(
+                _make_session(credentials),
+                (transport.calendar_connect_timeout, transport.calendar_read_timeout),
+            )
+            from googleapiclient.discovery import build_from_document
+
+            with start_span("calendar.build", commune=commune.name):
+                service = build_from_document(_discovery_document(), http=http)
+            client = _CalendarClient(credentials, http, service)
+            logger.debug("Built Calendar service for %s", commune.name)
+        _clients[commune] = client
+        return client.service
+
+
+@on_settings_reload
+def _on_settings_reload(old: Settings, new: Settings) -> None:
+    if old.transport != new.transport:
+        # Calls in flight finish on the old pools; new calls build new ones
+        with _lock:
+            _clients.clear()
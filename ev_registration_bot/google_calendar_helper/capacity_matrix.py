@@ -0,0 +1,275 @@
+"""Free places of every slot over the booking horizon, computed with NumPy.
+
+The events of all the horizon's days are turned into per-minute occupancy
+arrays at once (``np.add.at`` on start/end deltas, then a cumulative sum),
+and each slot's peak occupancy is read by broadcasting slot starts over the
+minutes they cover. The result is a (days x slots) matrix per commune and
+slot length, rebuilt every pre-warm tick, that the date picker reads
+instead of walking the events of each day. The slot picker still computes
+a chosen day's slots from its events, so the times offered are as fresh
+as the mirror.
+"""
+
+import asyncio
+import datetime
+import logging
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+from telegram.ext import ContextTypes
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.config import get_settings
+from ev_registration_bot.google_calendar_helper import events_cache
+from ev_registration_bot.google_calendar_helper.events_cache import CachedDay
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    CalendarUnavailableException,
+    LectureSlot,
+    OutOfTimeException,
+    Slot,
+    get_events_for_day,
+    with_pending_bookings,
+)
+from ev_registration_bot.google_calendar_helper.schedule import (
+    get_bookable_days,
+    first_bookable_minute,
+    get_slot_templates,
+    minute_of_day,
+)
+from ev_registration_bot.google_calendar_helper.utils import (
+    Commune,
+    VisitType,
+    get_commune_guest_limit,
+    get_communes,
+)
+
+logger = logging.getLogger(__name__)
+
+
+_DAY_MINUTES = 24 * 60
+
+# Slot lengths the pickers offer: therapy and lectures of 1 hour, lectures of 30 min
+SLOT_LENGTHS = (30, 60)
+
+
+class CapacityMatrix(NamedTuple):
+    commune: Commune
+    duration_minutes: int
+    days: tuple[datetime.date, ...]
+    # Start minute of each column, the union of the slots of every day
+    slot_starts: np.ndarray
+    # Lecture places left per (day, slot); -1 where the slot can't be booked
+    # (closed, break, already past) and 0 where a therapy overlaps it
+    free_places: np.ndarray
+    # Whether nothing at all overlaps the slot, as a therapy needs
+    therapy_free: np.ndarray
+    built_at: float
+
+
+def compute_capacity(
+    slot_starts: np.ndarray,
+    duration_minutes: int,
+    bookable: np.ndarray,
+    therapy: np.ndarray,
+    lectures: np.ndarray,
+    guest_limit: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """(free places, therapy free) matrices for the given slots.
+
+    ``bookable`` is a (days x slots) mask. ``therapy`` rows are (day index,
+    start minute, end minute) and ``lectures`` rows add the guest count.
+    """
+    n_days = bookable.shape[0]
+    therapy_count = np.zeros((n_days, _DAY_MINUTES + 1), np.int32)
+    lecture_count = np.zeros((n_days, _DAY_MINUTES + 1), np.int32)
+    lecture_guests = np.zeros((n_days, _DAY_MINUTES + 1), np.int32)
+
+    if len(therapy):
+        np.add.at(therapy_count, (therapy[:, 0], therapy[:, 1]), 1)
+        np.add.at(therapy_count, (therapy[:, 0], therapy[:, 2]), -1)
+    if len(lectures):
+        np.add.at(lecture_count, (lectures[:, 0], lectures[:, 1]), 1)
+        np.add.at(lecture_count, (lectures[:, 0], lectures[:, 2]), -1)
+        np.add.at(lecture_guests, (lectures[:, 0], lectures[:, 1]), lectures[:, 3])
+        np.add.at(lecture_guests, (lectures[:, 0], lectures[:, 2]), -lectures[:, 3])
+
+    # (slots x minutes) indexes of the minutes each slot covers
+    minutes = slot_starts[:, None] + np.arange(duration_minutes)
+
+    def peak(deltas: np.ndarray) -> np.ndarray:
+        return np.cumsum(deltas, axis=1)[:, minutes].max(axis=2, initial=0)
+
+    therapy_busy = peak(therapy_count) > 0
+    lecture_busy = peak(lecture_count) > 0
+    free_places = np.clip(guest_limit - peak(lecture_guests), 0, None)
+    free_places[therapy_busy] = 0
+    free_places[~bookable] = -1
+    therapy_free = bookable & ~therapy_busy & ~lecture_busy
+    return free_places.astype(np.int16), therapy_free
+
+
+def _load_events(
+    commune: Commune, days: list[datetime.date]
+) -> dict[datetime.date, tuple[list[Slot], list[LectureSlot]]]:
+    """Events of each day, from the mirror where fresh enough.
+
+    Days whose events can't be had are left out rather than shown as full.
+    """
+    events = {}
+    for day in days:
+        try:
+            events[day] = get_events_for_day(day, commune)
+        except (OutOfTimeException, CalendarUnavailableException):
+            continue
+    return events
+
+
+def _add_event_rows(
+    index: int,
+    day: datetime.date,
+    therapy_visits: list[Slot],
+    lecture_visits: list[LectureSlot],
+    therapy: list[tuple[int, ...]],
+    lectures: list[tuple[int, ...]],
+) -> None:
+    """Append a day's visits, as minutes, to the rows given to compute_capacity."""
+    midnight = time_utils.local_midnight(day)
+    therapy += (
+        (
+            index,
+            minute_of_day(visit.start, midnight),
+            minute_of_day(visit.end, midnight),
+        )
+        for visit in therapy_visits
+    )
+    lectures += (
+        (
+            index,
+            minute_of_day(visit.start, midnight),
+            minute_of_day(visit.end, midnight),
+            visit.total_guests,
+        )
+        for visit in lecture_visits
+    )
+
+
+def build_capacity_matrix(
+    commune: Commune,
+    events: dict[datetime.date, tuple[list[Slot], list[LectureSlot]]],
+    duration_minutes: int,
+    now: datetime.datetime,
+) -> CapacityMatrix:
+    known_days, templates_by_day, therapy, lectures = [], [], [], []
+    for index, (day, (therapy_visits, lecture_visits)) in enumerate(events.items()):
+        known_days.append(day)
+        templates_by_day.append(
+            get_slot_templates(commune, day.weekday(), duration_minutes)
+        )
+        _add_event_rows(index, day, therapy_visits, lecture_visits, therapy, lectures)
+
+    slot_starts = np.array(
+        sorted({t.start_minute for templates in templates_by_day for t in templates}),
+        dtype=np.int32,
+    )
+    column = {int(start): i for i, start in enumerate(slot_starts)}
+    bookable = np.zeros((len(known_days), len(slot_starts)), bool)
+    for row, (day, templates) in enumerate(zip(known_days, templates_by_day)):
+        first_minute = first_bookable_minute(day, now)
+        for template in templates:
+            if template.start_minute >= first_minute:
+                bookable[row, column[template.start_minute]] = True
+
+    free_places, therapy_free = compute_capacity(
+        slot_starts,
+        duration_minutes,
+        bookable,
+        np.array(therapy, dtype=np.int32).reshape(-1, 3),
+        np.array(lectures, dtype=np.int32).reshape(-1, 4),
+        get_commune_guest_limit(commune),
+    )
+    return CapacityMatrix(
+        commune,
+        duration_minutes,
+        tuple(known_days),
+        slot_starts,
+        free_places,
+        therapy_free,
+        time.time(),
+    )
+
+
+_matrices: dict[tuple[Commune, int], CapacityMatrix] = {}
+_matrices_lock = threading.Lock()
+
+
+def get_capacity_matrix(
+    commune: Commune, duration_minutes: int
+) -> CapacityMatrix | None:
+    """The last matrix built for ``commune`` and slot length, if still recent."""
+    matrix = _matrices.get((commune, duration_minutes))
+    max_age = 2 * get_settings().availability_cache.tick_seconds
+    if matrix is None or time.time() - matrix.built_at > max_age:
+        return None
+    return matrix
+
+
+@events_cache.on_day_changed
+def _on_day_changed(commune: Commune, day: datetime.date, cached: CachedDay) -> None:
+    # Recompute just that day's row, so a cancelled or moved booking frees
+    # its slot before the next refresh
+    therapy_visits, lecture_visits = with_pending_bookings(
+        day, commune, cached.therapy_visits, cached.lecture_visits
+    )
+    therapy, lectures = [], []
+    _add_event_rows(0, day, therapy_visits, lecture_visits, therapy, lectures)
+    for duration_minutes in SLOT_LENGTHS:
+        matrix = _matrices.get((commune, duration_minutes))
+        if matrix is None or day not in matrix.days:
+            continue
+        row = matrix.days.index(day)
+        free_places, therapy_free = compute_capacity(
+            matrix.slot_starts,
+            duration_minutes,
+            matrix.free_places[row : row + 1] >= 0,
+            np.array(therapy, dtype=np.int32).reshape(-1, 3),
+            np.array(lectures, dtype=np.int32).reshape(-1, 4),
+            get_commune_guest_limit(commune),
+        )
+        matrix.free_places[row] = free_places[0]
+        matrix.therapy_free[row] = therapy_free[0]
+
+
+def refresh_capacity_matrices(now: datetime.datetime) -> None:
+    horizon_days = get_settings().availability_cache.horizon_days
+    for commune in get_communes():
+        events = _load_events(commune, get_bookable_days(commune, now, horizon_days))
+        for duration_minutes in SLOT_LENGTHS:
+            matrix = build_capacity_matrix(commune, events, duration_minutes, now)
+            with _matrices_lock:
+                _matrices[(commune, duration_minutes)] = matrix
+
+
+async def refresh_capacity(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Rebuild every matrix from the events mirror the pre-warm job keeps fresh."""
+    try:
+        await asyncio.to_thread(refresh_capacity_matrices, time_utils.now())
+    except Exception:
+        logger.exception("Failed to refresh capacity matrices")
+
+
+def day_has_room(
+    commune: Commune, day: datetime.date, visit_type: VisitType
+) -> bool | None:
+    """Whether ``day`` has a slot left for ``visit_type``; None if not known."""
+    if visit_type == VisitType.THERAPY:
+        matrix = get_capacity_matrix(commune, 60)
+    else:
+        matrix = get_capacity_matrix(commune, 30)
+    if matrix is None or day not in matrix.days:
+        return None
+    row = matrix.days.index(day)
+    if visit_type == VisitType.THERAPY:
+        return bool(matrix.therapy_free[row].any())
+    return bool((matrix.free_places[row] > 0).any())
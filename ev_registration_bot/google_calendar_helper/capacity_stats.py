@@ -0,0 +1,130 @@
+"""Per-day occupancy of each commune, kept up to date as bookings change.
+
+A day's figures are recomputed from that day's events only, whenever the
+mirror stores it (a sync) or a booking is queued for it, so reading them
+for a week is a dictionary lookup per day.
+"""
+
+import asyncio
+import datetime
+import time
+from typing import NamedTuple
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.google_calendar_helper import events_cache
+from ev_registration_bot.google_calendar_helper.events_cache import CachedDay
+from ev_registration_bot.google_calendar_helper.google_calendar_create import (
+    lecture_places_left,
+)
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    CalendarUnavailableException,
+    LectureSlot,
+    OutOfTimeException,
+    Slot,
+    get_events_for_day,
+    with_pending_bookings,
+)
+from ev_registration_bot.google_calendar_helper.schedule import (
+    get_bookable_days,
+    get_day_templates,
+    minute_of_day,
+)
+from ev_registration_bot.google_calendar_helper.utils import (
+    Commune,
+    get_commune_guest_limit,
+    get_communes,
+)
+
+
+class DayCapacity(NamedTuple):
+    therapy_bookings: int
+    lecture_bookings: int
+    lecture_guests: int
+    # Most lecture guests at the same time, to compare with guest_limit
+    peak_guests: int
+    guest_limit: int
+    # Hour slots with nothing booked, still open for a therapy
+    free_hours: int
+    updated_at: float
+
+
+_stats: dict[tuple[Commune, datetime.date], DayCapacity] = {}
+
+
+def compute_day_capacity(
+    commune: Commune,
+    day: datetime.date,
+    therapy_visits: list[Slot],
+    lecture_visits: list[LectureSlot],
+) -> DayCapacity:
+    midnight = time_utils.local_midnight(day)
+    busy = [
+        (minute_of_day(visit.start, midnight), minute_of_day(visit.end, midnight))
+        for visit in [*therapy_visits, *lecture_visits]
+    ]
+    guest_limit = get_commune_guest_limit(commune)
+    # The whole day as one slot, leaving therapies out: what is left of the
+    # limit at the busiest moment is what create_event would check against
+    peak_guests = guest_limit - lecture_places_left(
+        time_utils.iso_at(day, 0),
+        time_utils.iso_at(day + datetime.timedelta(days=1), 0),
+        guest_limit,
+        [],
+        lecture_visits,
+    )
+    free_hours = sum(
+        not any(start < t.end_minute and t.start_minute < end for start, end in busy)
+        for t in get_day_templates(commune, day, 60)
+    )
+    return DayCapacity(
+        therapy_bookings=len(therapy_visits),
+        lecture_bookings=len(lecture_visits),
+        lecture_guests=sum(visit.total_guests for visit in lecture_visits),
+        peak_guests=peak_guests,
+        guest_limit=guest_limit,
+        free_hours=free_hours,
+        updated_at=time.time(),
+    )
+
+
+@events_cache.on_day_changed
+def _on_day_changed(commune: Commune, day: datetime.date, cached: CachedDay) -> None:
+    therapy_visits, lecture_visits = with_pending_bookings(
+        day, commune, cached.therapy_visits, cached.lecture_visits
+    )
+    _stats[(commune, day)] = compute_day_capacity(
+        commune, day, therapy_visits, lecture_visits
+    )
+
+
+def _load_day(commune: Commune, day: datetime.date) -> DayCapacity | None:
+    try:
+        therapy_visits, lecture_visits = get_events_for_day(day, commune)
+    except (OutOfTimeException, CalendarUnavailableException):
+        return None
+    stats = compute_day_capacity(commune, day, therapy_visits, lecture_visits)
+    _stats[(commune, day)] = stats
+    return stats
+
+
+async def get_capacity(
+    now: datetime.datetime, days: int = 7
+) -> dict[Commune, list[tuple[datetime.date, DayCapacity | None]]]:
+    """Figures for the next ``days`` open days of every commune.
+
+    Days not seen since startup are loaded once; None if that failed.
+    """
+    result = {}
+    for commune in get_communes():
+        result[commune] = []
+        for day in get_bookable_days(commune, now, days):
+            stats = _stats.get((commune, day))
+            if stats is None:
+                stats = await asyncio.to_thread(_load_day, commune, day)
+            result[commune].append((day, stats))
+    return result
+
+
+def drop_days_before(day: datetime.date) -> None:
+    for key in [key for key in _stats if key[1] < day]:
+        del _stats[key]
@@ -0,0 +1,178 @@
+import enum
+import logging
+import threading
+import time
+from typing import Callable, TypeVar
+
+from googleapiclient.errors import HttpError
+
+from ev_registration_bot.config import Settings, get_settings, on_settings_reload
+from ev_registration_bot.google_calendar_helper.utils import Commune
+from ev_registration_bot.metrics import CIRCUIT_BREAKER_STATE
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class BreakerState(enum.Enum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Calendar while the commune's breaker is open."""
+
+
+class CircuitBreaker:
+    """Stop calling a failing calendar until a single probe call succeeds again.
+
+    ``failure_threshold`` consecutive failures open the breaker; a call slower
+    than ``slow_call_seconds`` counts as a failure even if it succeeded. After
+    ``open_seconds`` one probe is let through (half-open): success closes the
+    breaker, failure opens it for another ``open_seconds``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        slow_call_seconds: float,
+        open_seconds: float,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self._state = BreakerState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> BreakerState:
+        with self._lock:
+            if (
+                self._state == BreakerState.OPEN
+                and time.monotonic() - self._opened_at >= self.open_seconds
+            ):
+                self._set_state(BreakerState.HALF_OPEN)
+            return self._state
+
+    def _set_state(self, state: BreakerState) -> None:
+        if state != self._state:
+            logger.warning(
+                "Calendar circuit for %s: %s -> %s",
+                self.name,
+                self._state.name,
+                state.name,
+            )
+        self._state = state
+        CIRCUIT_BREAKER_STATE.set(state.value, self.name)
+
+    def allow_request(self) -> bool:
+        state = self.state
+        with self._lock:
+            if state == BreakerState.CLOSED:
+                return True
+            if state == BreakerState.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self, duration: float) -> None:
+        if duration > self.slow_call_seconds:
+            self.record_failure()
+            return
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self._set_state(BreakerState.CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if (
+                self._probe_in_flight
+                or self._state == BreakerState.HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                self._probe_in_flight = False
+                self._opened_at = time.monotonic()
+                self._set_state(BreakerState.OPEN)
+
+
+_breakers: dict[Commune, CircuitBreaker] = {}
+
+
+def get_breaker(commune: Commune) -> CircuitBreaker:
+    breaker = _breakers.get(commune)
+    if breaker is None:
+        breaker_settings = get_settings().circuit_breaker
+        breaker = _breakers.setdefault(
+            commune,
+            CircuitBreaker(
+                commune.name,
+                breaker_settings.failure_threshold,
+                breaker_settings.slow_call_seconds,
+                breaker_settings.open_seconds,
+            ),
+        )
+    return breaker
+
+
+@on_settings_reload
+def _on_settings_reload(old: Settings, new: Settings) -> None:
+    # Keep the breakers (and whether Calendar is down), only retune them
+    breaker_settings = new.circuit_breaker
+    for breaker in _breakers.values():
+        breaker.failure_threshold = breaker_settings.failure_threshold
+        breaker.slow_call_seconds = breaker_settings.slow_call_seconds
+        breaker.open_seconds = breaker_settings.open_seconds
+
+
+def is_quota_error(error: HttpError) -> bool:
+    """Whether Calendar rejected the call because of rate limits or quota."""
+    if error.resp.status == 429:
+        return True
+    if error.resp.status != 403:
+        return False
+    reasons = {
+        detail.get("reason")
+        for detail in (error.error_details or [])
+        if isinstance(detail, dict)
+    }
+    return bool(
+        reasons & {"rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded"}
+    )
+
+
+def _is_outage(error: Exception) -> bool:
+    # A 4xx other than quota means our request was wrong, not that Google is down
+    if isinstance(error, HttpError):
+        return error.resp.status >= 500 or is_quota_error(error)
+    return True
+
+
+def guarded_call(commune: Commune, func: Callable[..., T], *args, **kwargs) -> T:
+    """Run a Calendar call through the commune's breaker.
+
+    Raises CircuitOpenError without calling ``func`` while the breaker is open.
+    """
+    breaker = get_breaker(commune)
+    if not breaker.allow_request():
+        raise CircuitOpenError(f"Calendar circuit for {commune.name} is open")
+
+    started = time.monotonic()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as error:
+        if _is_outage(error):
+            breaker.record_failure()
+        else:
+            breaker.record_success(time.monotonic() - started)
+        raise
+    breaker.record_success(time.monotonic() - started)
+    return result
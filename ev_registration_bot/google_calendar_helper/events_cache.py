@@ -0,0 +1,254 @@
+import datetime
+import json
+import logging
+import math
+import time
+import uuid
+from typing import TYPE_CHECKING, Callable, NamedTuple
+
+from ev_registration_bot.config import get_settings
+from ev_registration_bot.google_calendar_helper.utils import Commune
+from ev_registration_bot.metrics import record_cache_lookup
+from ev_registration_bot.shared_state.backend import get_backend
+
+logger = logging.getLogger(__name__)
+
+if TYPE_CHECKING:
+    from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+        LectureSlot,
+        Slot,
+    )
+
+# Shared copies outlive their refresh interval so they can still be served
+# while Calendar is down
+_SHARED_TTL_SECONDS = 24 * 60 * 60
+
+
+class CachedDay(NamedTuple):
+    therapy_visits: list["Slot"]
+    lecture_visits: list["LectureSlot"]
+    # Wall-clock time, so workers sharing the mirror agree on its age
+    fetched_at: float
+    # Generation of the day when it was fetched; see generation()
+    generation: str | None = None
+
+
+# Local mirror of the bookings of every fetched (commune, day)
+_days: dict[tuple[Commune, datetime.date], CachedDay] = {}
+
+# Generations of the days this worker changed, used when the backend isn't
+# shared; see generation()
+_local_generations: dict[tuple[Commune, datetime.date], str] = {}
+
+_day_listeners: list[Callable[[Commune, datetime.date, CachedDay], None]] = []
+
+
+def on_day_changed(
+    callback: Callable[[Commune, datetime.date, CachedDay], None],
+) -> Callable[[Commune, datetime.date, CachedDay], None]:
+    """Register ``callback(commune, day, cached)``, called when a mirrored day changes."""
+    _day_listeners.append(callback)
+    return callback
+
+
+def _notify(commune: Commune, day: datetime.date, cached: CachedDay) -> None:
+    for callback in _day_listeners:
+        try:
+            callback(commune, day, cached)
+        except Exception:
+            logger.exception("Day change callback %s failed", callback)
+
+
+def day_changed(commune: Commune, day: datetime.date) -> None:
+    """Tell listeners about a change the mirror doesn't show, like a queued booking."""
+    cached = _days.get((commune, day))
+    if cached is not None:
+        _notify(commune, day, cached)
+
+
+def _shared_key(commune: Commune, day: datetime.date) -> str:
+    return f"events:{commune.name}:{day.isoformat()}"
+
+
+def _generation_key(commune: Commune, day: datetime.date) -> str:
+    return f"events-generation:{commune.name}:{day.isoformat()}"
+
+
+def generation(commune: Commune, day: datetime.date) -> str | None:
+    """Current generation of a day, changed by every booking, cancel and move.
+
+    Copies fetched under an older generation miss a change some worker made
+    since, so no worker trusts them however recent they are. Without a
+    shared backend the generation is kept in this process: a fetch running
+    in a thread while a booking lands must not be mirrored as fresh either.
+    """
+    backend = get_backend()
+    if not backend.shared:
+        return _local_generations.get((commune, day))
+    value = backend.get(_generation_key(commune, day))
+    return None if value is None else value.decode()
+
+
+def _bump_generation(commune: Commune, day: datetime.date) -> str:
+    value = uuid.uuid4().hex
+    backend = get_backend()
+    if not backend.shared:
+        _local_generations[(commune, day)] = value
+        return value
+    backend.set(_generation_key(commune, day), value.encode(), _SHARED_TTL_SECONDS)
+    return value
+
+
+def _encode(cached: CachedDay) -> bytes:
+    return json.dumps(
+        {
+            "therapy": [visit.model_dump() for visit in cached.therapy_visits],
+            "lecture": [visit.model_dump() for visit in cached.lecture_visits],
+            "fetched_at": cached.fetched_at,
+            "generation": cached.generation,
+        },
+        ensure_ascii=False,
+    ).encode()
+
+
+def _decode(data: bytes) -> CachedDay:
+    from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+        LectureSlot,
+        Slot,
+    )
+
+    stored = json.loads(data)
+    return CachedDay(
+        [Slot.model_construct(**visit) for visit in stored["therapy"]],
+        [LectureSlot.model_construct(**visit) for visit in stored["lecture"]],
+        stored["fetched_at"],
+        stored.get("generation"),
+    )
+
+
+def _age(cached: CachedDay, current_generation: str | None) -> float:
+    if cached.generation != current_generation:
+        # Superseded by a change made since it was fetched
+        return math.inf
+    return time.time() - cached.fetched_at
+
+
+def _lookup(
+    commune: Commune, day: datetime.date, max_age: float
+) -> tuple[CachedDay | None, str | None]:
+    """The best copy of the day, and the day's current generation."""
+    key = (commune, day)
+    cached = _days.get(key)
+    current_generation = generation(commune, day)
+    backend = get_backend()
+    if not backend.shared:
+        return cached, current_generation
+
+    if cached is not None and _age(cached, current_generation) <= max_age:
+        return cached, current_generation
+
+    # Another worker may have fetched the day more recently
+    data = backend.get(_shared_key(commune, day))
+    if data is not None:
+        shared = _decode(data)
+        if shared.generation == current_generation and (
+            cached is None
+            or cached.generation != current_generation
+            or shared.fetched_at > cached.fetched_at
+        ):
+            _days[key] = cached = shared
+            _notify(commune, day, shared)
+    return cached, current_generation
+
+
+def refresh_interval(day: datetime.date, today: datetime.date) -> float:
+    """How often ``day`` should be re-fetched: near days change the most."""
+    cache_settings = get_settings().availability_cache
+    if (day - today).days < cache_settings.near_days:
+        return cache_settings.near_refresh_seconds
+    return cache_settings.far_refresh_seconds
+
+
+def get_day(commune: Commune, day: datetime.date, max_age: float) -> CachedDay | None:
+    """The mirrored day if it is at most ``max_age`` old.
+
+    A copy superseded by another worker's change counts as infinitely old,
+    so only ``max_age=math.inf`` (the outage fallback) still returns it.
+    """
+    cached, current_generation = _lookup(commune, day, max_age)
+    if cached is not None and _age(cached, current_generation) > max_age:
+        cached = None
+    record_cache_lookup("events", cached is not None)
+    return cached
+
+
+def get_age(commune: Commune, day: datetime.date, max_age: float = 0) -> float | None:
+    """Age of the mirrored day; shared copies are only checked past ``max_age``."""
+    cached, current_generation = _lookup(commune, day, max_age)
+    if cached is None:
+        return None
+    return _age(cached, current_generation)
+
+
+def put_day(
+    commune: Commune,
+    day: datetime.date,
+    therapy_visits: list["Slot"],
+    lecture_visits: list["LectureSlot"],
+    generation: str | None = None,
+    fetched_at: float | None = None,
+) -> None:
+    """Mirror a day fetched from Calendar.
+
+    ``generation`` is the day's generation() from before the fetch started,
+    so a change made while it ran leaves the copy superseded. ``fetched_at``
+    defaults to now.
+    """
+    cached = CachedDay(
+        therapy_visits,
+        lecture_visits,
+        time.time() if fetched_at is None else fetched_at,
+        generation,
+    )
+    _days[(commune, day)] = cached
+    _notify(commune, day, cached)
+    backend = get_backend()
+    if backend.shared:
+        backend.set(_shared_key(commune, day), _encode(cached), _SHARED_TTL_SECONDS)
+
+
+def update_day(commune: Commune, day: datetime.date, changed: CachedDay) -> None:
+    """Mirror a change this worker made to a day, superseding other copies.
+
+    ``changed`` is the copy as read with the change applied, and keeps its
+    ``fetched_at``: the rest of the day is no more recent than it was. A
+    copy that was already superseded may lack another worker's change, so
+    the day is dropped instead.
+    """
+    if changed.generation != generation(commune, day):
+        invalidate_day(commune, day)
+        return
+    put_day(
+        commune,
+        day,
+        changed.therapy_visits,
+        changed.lecture_visits,
+        _bump_generation(commune, day),
+        changed.fetched_at,
+    )
+
+
+def invalidate_day(commune: Commune, day: datetime.date) -> None:
+    """Drop the mirrored day after it changed in Calendar."""
+    _bump_generation(commune, day)
+    _days.pop((commune, day), None)
+    backend = get_backend()
+    if backend.shared:
+        backend.delete(_shared_key(commune, day))
+
+
+def drop_days_before(day: datetime.date) -> None:
+    for key in [key for key in _days if key[1] < day]:
+        del _days[key]
+    for key in [key for key in _local_generations if key[1] < day]:
+        del _local_generations[key]
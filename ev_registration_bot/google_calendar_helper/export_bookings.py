@@ -0,0 +1,349 @@
+"""Export the bookings made through the bot as CSV or Parquet.
+
+Events are streamed page by page and written as they are parsed, so memory
+stays flat however long the range. Days the events mirror refreshed within
+their refresh interval are read from it instead of Calendar, unless
+``--source calendar`` is given.
+
+    python -m ev_registration_bot.google_calendar_helper.export_bookings \\
+        --from 2024-06-01 --to 2024-06-30 --format csv --output june.csv
+"""
+
+import argparse
+import csv
+import datetime
+import re
+import sys
+from typing import IO, Iterable, Iterator, NamedTuple
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.google_calendar_helper import events_cache
+from ev_registration_bot.google_calendar_helper.calendar_service import (
+    get_calendar_service,
+)
+from ev_registration_bot.google_calendar_helper.circuit_breaker import guarded_call
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    extract_total_guests,
+    get_creds,
+)
+from ev_registration_bot.google_calendar_helper.utils import (
+    Commune,
+    find_communes,
+    get_communes,
+)
+from ev_registration_bot.metrics import observe_calendar_call
+
+# Every description the bot writes ends with this line
+BOT_MARKER = "Telegram-bot"
+
+# Rows per Parquet row group; bounds what is held in memory
+_PARQUET_BATCH_ROWS = 1000
+
+_VISIT_TYPES = {"Терапия": "therapy", "Лекция": "lecture"}
+_VISIT_TYPE_RE = re.compile(r"Тип посещения: (\w+)")
+_CHILDREN_RE = re.compile(r"Кол-во детей: (\d+)")
+_PHONE_RE = re.compile(r"Тел\.: ([^\n]+)")
+
+
+class ExportedBooking(NamedTuple):
+    commune: str
+    event_id: str | None
+    start: str
+    end: str
+    visit_type: str | None
+    name: str
+    guests: int | None
+    children: int | None
+    phone: str | None
+    # Guests of the whole lecture group, as written by the bot
+    total_guests: int
+
+
+COLUMNS = ExportedBooking._fields
+
+
+def parse_booking(
+    commune: Commune,
+    event_id: str | None,
+    start: str,
+    end: str,
+    summary: str,
+    description: str,
+) -> ExportedBooking | None:
+    """The booking an event stands for, or None if the bot didn't create it."""
+    if BOT_MARKER not in description:
+        return None
+
+    # The bot writes "<name>+<number of guests>" as the summary
+    name, _, guests = summary.rpartition("+")
+    if not name or not guests.strip().isdigit():
+        name, guests = summary, None
+    visit_type = _VISIT_TYPE_RE.search(description)
+    children = _CHILDREN_RE.search(description)
+    phone = _PHONE_RE.search(description)
+    return ExportedBooking(
+        commune=commune.name,
+        event_id=event_id,
+        start=start,
+        end=end,
+        visit_type=_VISIT_TYPES.get(visit_type.group(1)) if visit_type else None,
+        name=name.strip(),
+        guests=int(guests) if guests is not None else None,
+        children=int(children.group(1)) if children else None,
+        phone=phone.group(1).strip() if phone else None,
+        total_guests=extract_total_guests(description),
+    )
+
+
+def _list_page(
+    commune: Commune, time_min: str, time_max: str, page_token: str | None
+) -> dict:
+    service = get_calendar_service(commune, get_creds)
+    with observe_calendar_call("events.list", commune.name):
+        return (
+            service.events()
+            .list(
+                calendarId=commune.settings.calendar_id,
+                timeMin=time_min,
+                timeMax=time_max,
+                q=BOT_MARKER,
+                singleEvents=True,
+                orderBy="startTime",
+                maxResults=250,
+                pageToken=page_token,
+            )
+            .execute()
+        )
+
+
+def iter_calendar_events(
+    commune: Commune, first_day: datetime.date, last_day: datetime.date
+) -> Iterator[dict]:
+    """Calendar events from ``first_day`` to ``last_day`` inclusive, one page at a time."""
+    time_min = time_utils.local_midnight(first_day)
+    time_max = time_utils.local_midnight(last_day + datetime.timedelta(days=1))
+    page_token = None
+    while True:
+        page = guarded_call(
+            commune,
+            _list_page,
+            commune,
+            time_min.isoformat(),
+            time_max.isoformat(),
+            page_token,
+        )
+        yield from page.get("items", [])
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def _from_calendar(
+    commune: Commune, first_day: datetime.date, last_day: datetime.date
+) -> Iterator[ExportedBooking]:
+    for event in iter_calendar_events(commune, first_day, last_day):
+        booking = parse_booking(
+            commune,
+            event.get("id"),
+            event["start"].get("dateTime", event["start"].get("date")),
+            event["end"].get("dateTime", event["end"].get("date")),
+            event.get("summary", ""),
+            event.get("description", ""),
+        )
+        if booking is not None:
+            yield booking
+
+
+def _from_mirror(
+    commune: Commune, day: datetime.date, today: datetime.date
+) -> Iterator[ExportedBooking] | None:
+    # Only as old as the pre-warm job lets the mirror get; older days, and
+    # past days it no longer refreshes, come from Calendar
+    cached = events_cache.get_day(
+        commune, day, events_cache.refresh_interval(day, today)
+    )
+    if cached is None:
+        return None
+    visits = sorted(
+        [*cached.therapy_visits, *cached.lecture_visits], key=lambda v: v.start
+    )
+    # Days mirrored before descriptions were kept can't tell bot bookings apart
+    if any(visit.description is None for visit in visits):
+        return None
+    return (
+        booking
+        for visit in visits
+        if (
+            booking := parse_booking(
+                commune,
+                visit.event_id,
+                visit.start,
+                visit.end,
+                visit.name,
+                visit.description or "",
+            )
+        )
+        is not None
+    )
+
+
+def iter_bookings(
+    communes: Iterable[Commune],
+    first_day: datetime.date,
+    last_day: datetime.date,
+    use_mirror: bool = True,
+) -> Iterator[ExportedBooking]:
+    """Bot bookings of ``communes`` over the range, by commune then by start.
+
+    With ``use_mirror``, recently mirrored days are read locally and only the
+    runs of days in between are fetched from Calendar.
+    """
+    today = time_utils.today()
+    for commune in communes:
+        if not use_mirror:
+            yield from _from_calendar(commune, first_day, last_day)
+            continue
+
+        missing_from = None
+        day = first_day
+        while day <= last_day:
+            mirrored = _from_mirror(commune, day, today)
+            if mirrored is None:
+                missing_from = missing_from or day
+            else:
+                if missing_from is not None:
+                    yield from _from_calendar(
+                        commune, missing_from, day - datetime.timedelta(days=1)
+                    )
+                    missing_from = None
+                yield from mirrored
+            day += datetime.timedelta(days=1)
+        if missing_from is not None:
+            yield from _from_calendar(commune, missing_from, last_day)
+
+
+def write_csv(bookings: Iterable[ExportedBooking], output: IO[str]) -> int:
+    writer = csv.writer(output)
+    writer.writerow(COLUMNS)
+    count = 0
+    for booking in bookings:
+        writer.writerow(booking)
+        count += 1
+    return count
+
+
+def write_parquet(bookings: Iterable[ExportedBooking], output: IO[bytes]) -> int:
+    """Write row groups of a bounded size; needs the optional pyarrow package."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as error:
+        raise RuntimeError("Parquet export needs the pyarrow package") from error
+
+    schema = pa.schema(
+        [
+            ("commune", pa.string()),
+            ("event_id", pa.string()),
+            ("start", pa.string()),
+            ("end", pa.string()),
+            ("visit_type", pa.string()),
+            ("name", pa.string()),
+            ("guests", pa.int32()),
+            ("children", pa.int32()),
+            ("phone", pa.string()),
+            ("total_guests", pa.int32()),
+        ]
+    )
+    count = 0
+    with pq.ParquetWriter(output, schema) as writer:
+        batch = []
+        for booking in bookings:
+            batch.append(booking._asdict())
+            if len(batch) == _PARQUET_BATCH_ROWS:
+                writer.write_table(pa.Table.from_pylist(batch, schema))
+                count += len(batch)
+                batch.clear()
+        if batch or not count:
+            writer.write_table(pa.Table.from_pylist(batch, schema))
+            count += len(batch)
+    return count
+
+
+def export_bookings(
+    output: IO,
+    export_format: str,
+    first_day: datetime.date,
+    last_day: datetime.date,
+    communes: Iterable[Commune] | None = None,
+    use_mirror: bool = True,
+) -> int:
+    """Write the bookings to ``output`` (text for CSV, binary for Parquet)."""
+    bookings = iter_bookings(
+        get_communes() if communes is None else communes,
+        first_day,
+        last_day,
+        use_mirror,
+    )
+    if export_format == "parquet":
+        return write_parquet(bookings, output)
+    return write_csv(bookings, output)
+
+
+parser = argparse.ArgumentParser(description="Export bookings made through the bot")
+parser.add_argument(
+    "--from",
+    dest="first_day",
+    type=datetime.date.fromisoformat,
+    required=True,
+    help="First day, e.g. 2024-06-01",
+)
+parser.add_argument(
+    "--to",
+    dest="last_day",
+    type=datetime.date.fromisoformat,
+    required=True,
+    help="Last day, included",
+)
+parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+parser.add_argument(
+    "--output", "-o", help="File to write; standard output if not given"
+)
+parser.add_argument(
+    "--commune",
+    "-c",
+    action="append",
+    help="Id of a commune to export, e.g. german; every commune if not given",
+)
+parser.add_argument(
+    "--source",
+    choices=("auto", "calendar"),
+    default="auto",
+    help="auto reads mirrored days locally, calendar always asks Calendar",
+)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    communes = None
+    if args.commune:
+        try:
+            communes = find_communes(args.commune)
+        except ValueError as error:
+            print(error)
+            exit(1)
+
+    mode = "wb" if args.format == "parquet" else "w"
+    if args.output:
+        output = open(args.output, mode, newline="" if mode == "w" else None)
+    else:
+        output = sys.stdout.buffer if mode == "wb" else sys.stdout
+    with output:
+        count = export_bookings(
+            output,
+            args.format,
+            args.first_day,
+            args.last_day,
+            communes,
+            args.source == "auto",
+        )
+    print(f"Exported {count} bookings", file=sys.stderr)
@@ -1,36 +1,71 @@
+import datetime
 import logging
 import os.path
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
 from ev_registration_bot.google_calendar_helper.utils import (
     Commune,
     VisitType,
     get_visit_type_color,
     get_commune_guest_limit,
 )
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+from ev_registration_bot.google_calendar_helper import booking_outbox
+from ev_registration_bot.google_calendar_helper.booking_outbox import (
+    PendingBooking,
+    make_event_id,
+)
+from ev_registration_bot.google_calendar_helper.calendar_service import (
+    get_calendar_service,
+)
+from ev_registration_bot.google_calendar_helper.circuit_breaker import guarded_call
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    CalendarUnavailableException,
+    LectureSlot,
+    OutOfTimeException,
+    Slot,
+    get_events_for_day,
+    record_token_result,
 )
+from ev_registration_bot.google_calendar_helper import reminders, user_bookings
+from ev_registration_bot.google_calendar_helper.user_bookings import (
+    USER_ID_PROPERTY,
+    UserBooking,
+)
+from ev_registration_bot.shared_state.backend import LockTimeout, get_backend
+from ev_registration_bot.metrics import TOKEN_REFRESHES, observe_calendar_call
+from ev_registration_bot.tracing import set_span_attribute, start_span, traced
+
 logger = logging.getLogger(__name__)
 
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
 
+@traced("calendar.get_credentials")
 def get_credentials(commune: Commune):
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
     creds = None
-    if os.path.exists(f"{commune.value}/token.json"):
-        creds = Credentials.from_authorized_user_file(f"{commune.value}/token.json")
+    token_path = os.path.join(commune.settings.config_dir, "token.json")
+    if os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path)
 
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            try:
+                creds.refresh(Request())
+            except Exception as error:
+                TOKEN_REFRESHES.inc(commune.name, "error")
+                record_token_result(commune, error)
+                raise
+            TOKEN_REFRESHES.inc(commune.name, "ok")
         else:
-            raise ValueError("Invalid credentials")
+            error = ValueError("Invalid credentials")
+            record_token_result(commune, error)
+            raise error
 
+    record_token_result(commune, None, creds.expiry)
     return creds
 
 
@@ -52,6 +87,74 @@ def make_description_in_calendar(
     return text
 
 
+def _overlaps(start: str, end: str, visit_start: str, visit_end: str) -> bool:
+    return visit_start < end and start < visit_end
+
+
+def lecture_places_left(
+    start_time: str,
+    end_time: str,
+    guest_limit: int,
+    therapy_visits: list[Slot],
+    lecture_visits: list[LectureSlot],
+) -> int:
+    """Lecture guests that still fit in a slot; none if a therapy overlaps it.
+
+    Negative if the slot is already overbooked.
+    """
+    if any(
+        _overlaps(start_time, end_time, therapy.start, therapy.end)
+        for therapy in therapy_visits
+    ):
+        return 0
+
+    overlapping = [
+        lecture
+        for lecture in lecture_visits
+        if _overlaps(start_time, end_time, lecture.start, lecture.end)
+    ]
+    # Occupancy only changes when a lecture starts, so the peak is at one of them
+    points = {start_time}
+    points.update(
+        lecture.start for lecture in overlapping if lecture.start > start_time
+    )
+    peak = max(
+        sum(
+            lecture.total_guests
+            for lecture in overlapping
+            if lecture.start <= point < lecture.end
+        )
+        for point in points
+    )
+    return guest_limit - peak
+
+
+def has_capacity(
+    start_time: str,
+    end_time: str,
+    visit_type: VisitType,
+    total_guests: int,
+    guest_limit: int,
+    therapy_visits: list[Slot],
+    lecture_visits: list[LectureSlot],
+) -> bool:
+    """Whether a booking still fits next to the visits already in the calendar."""
+    if any(
+        _overlaps(start_time, end_time, therapy.start, therapy.end)
+        for therapy in therapy_visits
+    ):
+        return False
+    if visit_type == VisitType.THERAPY:
+        return not any(
+            _overlaps(start_time, end_time, lecture.start, lecture.end)
+            for lecture in lecture_visits
+        )
+    return total_guests <= lecture_places_left(
+        start_time, end_time, guest_limit, therapy_visits, lecture_visits
+    )
+
+
+@traced("calendar.create_event")
 def create_event(
     summary: str,
     start_time: str,
@@ -61,35 +164,167 @@ def create_event(
     commune: Commune,
     visit_type: VisitType,
     total_guests: int | None = None,
+    chat_id: int | None = None,
+    booking_id: str | None = None,
+    user_id: int | None = None,
 ) -> bool:
-    creds = get_credentials(commune)
-    service = build("calendar", "v3", credentials=creds)
+    """Reserve capacity for a booking and queue it for insertion into Calendar.
+
+    Returns True as soon as the booking is reserved locally; the outbox worker
+    inserts it with retries under a deterministic event id.
+    """
+    set_span_attribute("commune", commune.name)
+    set_span_attribute("visit_type", visit_type.value)
 
     # Check guest limit for lectures
+    guest_limit = get_commune_guest_limit(commune)
     if visit_type == VisitType.LECTURE and total_guests:
-        guest_limit = get_commune_guest_limit(commune)
         if total_guests > guest_limit:
-            logger.error(f"Total guests {total_guests} exceeds limit {guest_limit}")
+            logger.error("Total guests %s exceeds limit %s", total_guests, guest_limit)
             return False
 
+    day = datetime.date.fromisoformat(start_time.split("T")[0])
+    event_id = make_event_id(commune, start_time, end_time, phone, booking_id)
+    event = {
+        "id": event_id,
+        "summary": summary,
+        "start": {"dateTime": start_time},
+        "end": {"dateTime": end_time},
+        "timeZone": "Europe/Moscow",
+        "description": make_description_in_calendar(
+            children_amount,
+            phone,
+            visit_type,
+            total_guests,
+        ),
+        "colorId": str(get_visit_type_color(visit_type, commune)),
+    }
+    if user_id is not None:
+        # Lets the user's bookings be found without scanning the calendar
+        event["extendedProperties"] = {
+            "private": {USER_ID_PROPERTY: str(user_id), "bookingId": booking_id or ""}
+        }
+
+    # Per (commune, day), so it also holds across workers sharing a backend
+    reservation_lock = get_backend().lock(
+        f"reservation:{commune.name}:{day.isoformat()}"
+    )
     try:
-        event = {
-            "summary": summary,
-            "start": {"dateTime": start_time},
-            "end": {"dateTime": end_time},
-            "timeZone": "Europe/Moscow",
-            "description": make_description_in_calendar(
-                children_amount,
-                phone,
+        with reservation_lock:
+            try:
+                therapy_visits, lecture_visits = get_events_for_day(day, commune)
+            except OutOfTimeException:
+                logger.warning("Booking %s is for a day that is already over", event_id)
+                return False
+            except CalendarUnavailableException:
+                # Calendar is down and nothing is mirrored for the day, so
+                # there is nothing to check the booking's capacity against
+                logger.warning("Calendar unavailable for booking %s", event_id)
+                return False
+
+            # A resubmitted booking must not compete with its own reservation
+            therapy_visits = [v for v in therapy_visits if v.event_id != event_id]
+            lecture_visits = [v for v in lecture_visits if v.event_id != event_id]
+            if not has_capacity(
+                start_time,
+                end_time,
                 visit_type,
-                total_guests,
-            ),
-            "colorId": str(get_visit_type_color(visit_type, commune)),
-        }
-        event = service.events().insert(calendarId="primary", body=event).execute()
-        logger.info("Event created with ID: %s" % (event.get("id")))
-        return True
+                total_guests or 0,
+                guest_limit,
+                therapy_visits,
+                lecture_visits,
+            ):
+                logger.warning("No capacity left for booking %s", event_id)
+                return False
 
-    except HttpError as error:
-        logger.error(f"An error occurred: {error}")
+            if not booking_outbox.enqueue(event_id, commune, day, event, chat_id):
+                logger.info("Booking %s is already queued", event_id)
+            elif user_id is not None:
+                user_bookings.add(
+                    user_id,
+                    UserBooking(
+                        event_id,
+                        commune.name,
+                        start_time,
+                        end_time,
+                        visit_type.value,
+                        total_guests or 0,
+                        summary,
+                    ),
+                )
+                reminders.schedule(
+                    event_id,
+                    chat_id if chat_id is not None else user_id,
+                    commune,
+                    start_time,
+                )
+
+    except LockTimeout:
+        logger.warning("Timed out waiting to reserve booking %s", event_id)
         return False
+
+    logger.info("Booking %s reserved", event_id)
+    return True
+
+
+@traced("calendar.insert_event")
+def insert_event(booking: PendingBooking) -> None:
+    """Insert a queued booking into Calendar.
+
+    Raises HttpError on failure, or CircuitOpenError while Calendar is down.
+    """
+    commune = booking.commune
+    set_span_attribute("commune", commune.name)
+    guarded_call(commune, _insert_event, commune, booking.body)
+    logger.info("Event created with ID: %s", booking.event_id)
+
+
+def _insert_event(commune: Commune, body: dict) -> None:
+    service = get_calendar_service(commune, get_credentials)
+    with start_span(
+        "calendar.events.insert", commune=commune.name
+    ), observe_calendar_call("events.insert", commune.name):
+        service.events().insert(
+            calendarId=commune.settings.calendar_id, body=body
+        ).execute()
+
+
+@traced("calendar.delete_event")
+def delete_event(commune: Commune, event_id: str) -> None:
+    """Delete an event; one that is already gone counts as deleted."""
+    set_span_attribute("commune", commune.name)
+    try:
+        guarded_call(commune, _delete_event, commune, event_id)
+    except HttpError as error:
+        if error.resp.status not in (404, 410):
+            raise
+    logger.info("Event deleted with ID: %s", event_id)
+
+
+def _delete_event(commune: Commune, event_id: str) -> None:
+    service = get_calendar_service(commune, get_credentials)
+    with start_span(
+        "calendar.events.delete", commune=commune.name
+    ), observe_calendar_call("events.delete", commune.name):
+        service.events().delete(
+            calendarId=commune.settings.calendar_id, eventId=event_id
+        ).execute()
+
+
+@traced("calendar.move_event")
+def move_event(commune: Commune, event_id: str, start_time: str, end_time: str) -> None:
+    set_span_attribute("commune", commune.name)
+    guarded_call(commune, _move_event, commune, event_id, start_time, end_time)
+    logger.info("Event %s moved to %s", event_id, start_time)
+
+
+def _move_event(commune: Commune, event_id: str, start_time: str, end_time: str):
+    service = get_calendar_service(commune, get_credentials)
+    with start_span(
+        "calendar.events.patch", commune=commune.name
+    ), observe_calendar_call("events.patch", commune.name):
+        service.events().patch(
+            calendarId=commune.settings.calendar_id,
+            eventId=event_id,
+            body={"start": {"dateTime": start_time}, "end": {"dateTime": end_time}},
+        ).execute()
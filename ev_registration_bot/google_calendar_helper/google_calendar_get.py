@@ -1,40 +1,72 @@
+import contextvars
 import datetime
-import enum
+import math
 import logging
 import os.path
-from pprint import pprint
-
-import pytz
-from google.auth.external_account_authorized_user import Credentials
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from pydantic import BaseModel, Field
+from typing import TYPE_CHECKING, NamedTuple
 
-from ev_registration_bot.google_calendar_helper.utils import Commune, VisitType
+from pydantic import BaseModel, Field
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+from ev_registration_bot import time_utils
+from ev_registration_bot.google_calendar_helper import booking_outbox, events_cache
+from ev_registration_bot.google_calendar_helper.calendar_service import (
+    get_calendar_service,
+)
+from ev_registration_bot.google_calendar_helper.circuit_breaker import guarded_call
+from ev_registration_bot.google_calendar_helper.schedule import (
+    first_bookable_minute,
+    get_candidate_slots,
+    get_working_hours,
+    is_past_closing,
+    minute_of_day,
+)
+from ev_registration_bot.google_calendar_helper.utils import (
+    Commune,
+    VisitType,
+    get_communes,
 )
+from ev_registration_bot.metrics import TOKEN_REFRESHES, observe_calendar_call
+from ev_registration_bot.tracing import set_span_attribute, start_span, traced
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
 logger = logging.getLogger(__name__)
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
-moscow_tz = pytz.timezone("Europe/Moscow")
+
+# Private extended property holding the Telegram id of the user who booked
+USER_ID_PROPERTY = "telegramUserId"
 
 
 class OutOfTimeException(Exception):
     pass
 
 
+class CalendarUnavailableException(Exception):
+    """Calendar can't be reached and the mirror has nothing for that day."""
+
+
+_served_stale: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "served_stale", default=False
+)
+
+
+def served_stale_data() -> bool:
+    """Whether the last get_events_for_day in this context fell back to the mirror."""
+    return _served_stale.get()
+
+
 class Slot(BaseModel):
     start: str
     end: str
     name: str = Field(..., max_length=100)
     description: str = Field(None, max_length=500)
+    event_id: str | None = None
+    # Telegram id of the user who booked it through the bot
+    user_id: int | None = None
 
     def __eq__(self, other):
         if isinstance(other, Slot):
@@ -47,7 +79,9 @@ class LectureSlot(BaseModel):
     end: str
     name: str = Field(..., max_length=100)
     description: str = Field(None, max_length=500)
-    total_guests: int = Field(0, ge=0, le=10)
+    total_guests: int = Field(0, ge=0)
+    event_id: str | None = None
+    user_id: int | None = None
 
     def __eq__(self, other):
         if isinstance(other, LectureSlot):
@@ -55,26 +89,75 @@ class LectureSlot(BaseModel):
         return NotImplemented
 
 
-now = datetime.datetime.now(moscow_tz)
+class TokenResult(NamedTuple):
+    # Why the credentials failed to load; None if they loaded
+    error: str | None
+    # When the loaded access token expires, seconds since the epoch
+    expires_at: float | None = None
 
 
-def get_creds(commune: Commune) -> Credentials:
-    creds = None
-    logger.info(f"Getting credentials for {commune.value}")
-    logger.info(f"Path to token: {commune.value}/token.json")
-    if os.path.exists(f"{commune.value}/token.json"):
-        creds = Credentials.from_authorized_user_file(
-            f"{commune.value}/token.json", SCOPES
+# The last attempt to load each commune's credentials, absent until one is made
+_token_results: dict[Commune, TokenResult] = {}
+
+
+def record_token_result(
+    commune: Commune,
+    error: Exception | None,
+    expiry: datetime.datetime | None = None,
+) -> None:
+    """``expiry`` of the loaded credentials is naive UTC, as google-auth keeps it."""
+    if error is not None:
+        _token_results[commune] = TokenResult(f"{type(error).__name__}: {error}")
+    elif expiry is None:
+        _token_results[commune] = TokenResult(None)
+    else:
+        _token_results[commune] = TokenResult(
+            None, expiry.replace(tzinfo=datetime.timezone.utc).timestamp()
         )
+
+
+def token_result(commune: Commune) -> TokenResult | None:
+    return _token_results.get(commune)
+
+
+@traced("calendar.get_creds")
+def get_creds(commune: Commune) -> "Credentials":
+    # google.auth pulls in requests; only load it once Calendar is used
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
+    creds = None
+    token_path = os.path.join(commune.settings.config_dir, "token.json")
+    logger.debug("Loading credentials from %s", token_path)
+    if os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            try:
+                creds.refresh(Request())
+            except Exception as error:
+                TOKEN_REFRESHES.inc(commune.name, "error")
+                record_token_result(commune, error)
+                raise
+            TOKEN_REFRESHES.inc(commune.name, "ok")
         else:
-            raise ValueError("Invalid credentials")
+            error = ValueError("Invalid credentials")
+            record_token_result(commune, error)
+            raise error
 
+    record_token_result(commune, None, creds.expiry)
     return creds
 
 
+def warm_up() -> None:
+    """Load every commune's credentials and build its Calendar service."""
+    for commune in get_communes():
+        try:
+            get_calendar_service(commune, get_creds)
+        except Exception:
+            logger.exception("Failed to warm up the Calendar client of %s", commune)
+
+
 def extract_total_guests(description: str) -> int:
     """Extract total guests from event description."""
     try:
@@ -85,118 +168,196 @@ def extract_total_guests(description: str) -> int:
             return int(guests_str)
         return 0
     except (ValueError, IndexError):
-        logger.error(f"Failed to extract total guests from description: {description}")
+        logger.error("Failed to extract total guests from description: %s", description)
         return 0
 
 
-def get_events_for_day(
-    day: datetime.datetime,
-    commune: Commune,
-) -> tuple[list[Slot], list[LectureSlot]]:
-    """Get all events for a specific day, separated by type."""
-    now = datetime.datetime.now(moscow_tz)
-
-    if day == now.date():
-        if now.hour >= 21:
-            raise OutOfTimeException("Out of time for today")
-        start_time = now
-    else:
-        start_time = moscow_tz.localize(
-            datetime.datetime(
-                day.year,
-                day.month,
-                day.day,
-                11,
-                0,
-                0,
-                0,
-            )
-        )
-
-    end_time = moscow_tz.localize(
-        datetime.datetime(
-            day.year,
-            day.month,
-            day.day,
-            21,
-            0,
-            0,
-            0,
-        )
-    )
-
-    creds = get_creds(commune)
-    service = build("calendar", "v3", credentials=creds)
-
-    try:
-        events_result = (
+def _list_events(commune: Commune, time_min: str, time_max: str) -> dict:
+    service = get_calendar_service(commune, get_creds)
+    with start_span(
+        "calendar.events.list", commune=commune.name
+    ), observe_calendar_call("events.list", commune.name):
+        return (
             service.events()
             .list(
-                calendarId="primary",
-                timeMin=start_time.isoformat(),
-                timeMax=end_time.isoformat(),
+                calendarId=commune.settings.calendar_id,
+                timeMin=time_min,
+                timeMax=time_max,
                 singleEvents=True,
                 orderBy="startTime",
             )
             .execute()
         )
 
-        events = events_result.get("items", [])
-        therapy_visits = []
-        lecture_visits = []
-
-        for event in events:
-            start = event["start"].get("dateTime", event["start"].get("date"))
-            end = event["end"].get("dateTime", event["end"].get("date"))
-            description = event.get("description", "")
-
-            if "Тип посещения: Терапия" in description:
-                therapy_visits.append(Slot(start=start, end=end, name=event["summary"]))
-            elif "Тип посещения: Лекция" in description:
-                total_guests = extract_total_guests(description)
-                lecture_visits.append(
-                    LectureSlot(
-                        start=start,
-                        end=end,
-                        name=event["summary"],
-                        total_guests=total_guests,
-                    )
+
+def _booked_by(event: dict) -> int | None:
+    user_id = (
+        event.get("extendedProperties", {}).get("private", {}).get(USER_ID_PROPERTY)
+    )
+    return int(user_id) if user_id and user_id.isdigit() else None
+
+
+@traced("calendar.fetch_events_for_day")
+def fetch_events_for_day(
+    day: datetime.date,
+    commune: Commune,
+) -> tuple[list[Slot], list[LectureSlot]]:
+    """Fetch the whole working day from Calendar and store it in the events cache.
+
+    Raises HttpError, or CircuitOpenError while Calendar is considered down,
+    so callers can tell an empty day from a failed fetch.
+    """
+    set_span_attribute("commune", commune.name)
+    set_span_attribute("day", day.isoformat())
+    # Read before fetching, so a booking made meanwhile supersedes this copy
+    generation = events_cache.generation(commune, day)
+    working_hours = get_working_hours(commune, day)
+    if working_hours is None:
+        events_cache.put_day(commune, day, [], [], generation)
+        return [], []
+
+    start_time = time_utils.at_minute(day, time_utils.minutes(working_hours.opens_at))
+    end_time = time_utils.at_minute(day, time_utils.minutes(working_hours.closes_at))
+
+    events_result = guarded_call(
+        commune, _list_events, commune, start_time.isoformat(), end_time.isoformat()
+    )
+
+    events = events_result.get("items", [])
+    therapy_visits = []
+    lecture_visits = []
+
+    for event in events:
+        start = event["start"].get("dateTime", event["start"].get("date"))
+        end = event["end"].get("dateTime", event["end"].get("date"))
+        description = event.get("description", "")
+
+        if "Тип посещения: Терапия" in description:
+            therapy_visits.append(
+                Slot(
+                    start=start,
+                    end=end,
+                    name=event["summary"],
+                    description=description[:500],
+                    event_id=event.get("id"),
+                    user_id=_booked_by(event),
+                )
+            )
+        elif "Тип посещения: Лекция" in description:
+            total_guests = extract_total_guests(description)
+            lecture_visits.append(
+                LectureSlot(
+                    start=start,
+                    end=end,
+                    name=event["summary"],
+                    description=description[:500],
+                    total_guests=total_guests,
+                    event_id=event.get("id"),
+                    user_id=_booked_by(event),
                 )
+            )
+
+    events_cache.put_day(commune, day, therapy_visits, lecture_visits, generation)
+    return therapy_visits, lecture_visits
+
 
+def with_pending_bookings(
+    day: datetime.date,
+    commune: Commune,
+    therapy_visits: list[Slot],
+    lecture_visits: list[LectureSlot],
+) -> tuple[list[Slot], list[LectureSlot]]:
+    """Add bookings still waiting in the outbox, so their capacity stays reserved."""
+    pending = booking_outbox.pending_visits(commune, day)
+    if not pending:
         return therapy_visits, lecture_visits
-    except HttpError as error:
-        logger.error(f"An error occurred while fetching events: {error}")
-        return [], []
 
+    known_ids = {visit.event_id for visit in therapy_visits}
+    known_ids.update(visit.event_id for visit in lecture_visits)
+    therapy_visits = list(therapy_visits)
+    lecture_visits = list(lecture_visits)
+    for visit in pending:
+        if visit.event_id in known_ids:
+            continue
+        if "Тип посещения: Терапия" in visit.description:
+            therapy_visits.append(
+                Slot(
+                    start=visit.start,
+                    end=visit.end,
+                    name=visit.summary,
+                    description=visit.description[:500],
+                    event_id=visit.event_id,
+                )
+            )
+        else:
+            lecture_visits.append(
+                LectureSlot(
+                    start=visit.start,
+                    end=visit.end,
+                    name=visit.summary,
+                    description=visit.description[:500],
+                    total_guests=extract_total_guests(visit.description),
+                    event_id=visit.event_id,
+                )
+            )
+    return therapy_visits, lecture_visits
+
+
+@traced("calendar.get_events_for_day")
+def get_events_for_day(
+    day: datetime.date,
+    commune: Commune,
+) -> tuple[list[Slot], list[LectureSlot]]:
+    """Get all events for a specific day, separated by type.
+
+    Served from the events cache while it is fresh enough for that day,
+    which the pre-warming job keeps it for the dates users can pick. If the
+    fetch fails, falls back to whatever the mirror has, however old, and
+    flags it through served_stale_data(); with nothing mirrored it raises
+    CalendarUnavailableException.
+    """
+    _served_stale.set(False)
+    now = time_utils.now()
+    today = now.date()
+
+    if day == today:
+        working_hours = get_working_hours(commune, day)
+        if working_hours is None or is_past_closing(working_hours, now):
+            raise OutOfTimeException("Out of time for today")
+
+    # Accept one missed pre-warm refresh before paying for a fetch
+    max_age = 2 * events_cache.refresh_interval(day, today)
+    cached = events_cache.get_day(commune, day, max_age)
+    if cached is not None:
+        return with_pending_bookings(
+            day, commune, cached.therapy_visits, cached.lecture_visits
+        )
 
+    try:
+        therapy_visits, lecture_visits = fetch_events_for_day(day, commune)
+    except Exception as error:
+        # Besides HttpError, CircuitOpenError and transport errors this covers
+        # credentials that fail to load or refresh: none of them may pass for
+        # an empty day, or every slot would look free
+        logger.error("An error occurred while fetching events: %r", error)
+        stale = events_cache.get_day(commune, day, math.inf)
+        if stale is None:
+            raise CalendarUnavailableException(str(error)) from error
+        _served_stale.set(True)
+        therapy_visits, lecture_visits = stale.therapy_visits, stale.lecture_visits
+    return with_pending_bookings(day, commune, therapy_visits, lecture_visits)
+
+
+@traced("slots.get_free_slots_for_a_day")
 def get_free_slots_for_a_day(
-    day: datetime.datetime,
+    day: datetime.date,
     commune: Commune,
 ) -> list[Slot]:
     """Get free slots for therapy visits."""
-    hours = [
-        moscow_tz.localize(
-            datetime.datetime(
-                day.year,
-                day.month,
-                day.day,
-                i,
-                0,
-                0,
-                0,
-            )
-        )
-        for i in range(11, 21)
-    ]
-
+    set_span_attribute("commune", commune.name)
     free_hour_slots = [
-        Slot(
-            start=hour.isoformat(),
-            end=(hour + datetime.timedelta(hours=1)).isoformat(),
-            name="Free",
-        )
-        for hour in hours
-        if hour.hour != 15 and hour.hour != 16
+        Slot.model_construct(start=start, end=end, name="Free")
+        for start, end in get_candidate_slots(day, commune, 60)
     ]
 
     therapy_visits, lecture_visits = get_events_for_day(day, commune)
@@ -227,46 +388,33 @@ def get_free_slots_for_a_day(
         if not has_therapy and not has_lecture:
             free_slots.append(free_slot)
 
-    now = datetime.datetime.now(moscow_tz)
-    if day == now.date():
-        free_slots = [slot for slot in free_slots if slot.start >= now.isoformat()]
-    else:
-        free_slots = [slot for slot in free_slots if slot.start >= "11:00:00"]
+    first_minute = first_bookable_minute(day, time_utils.now())
+    if first_minute:
+        free_slots = [
+            slot
+            for slot in free_slots
+            if time_utils.iso_minute(slot.start) >= first_minute
+        ]
 
     return free_slots
 
 
+@traced("slots.get_lecture_free_slots_for_a_day")
 def get_lecture_free_slots_for_a_day(
-    day: datetime.datetime,
+    day: datetime.date,
     commune: Commune,
 ) -> list[LectureSlot]:
     """Get free 1-hour slots for lectures."""
-    hours = [
-        moscow_tz.localize(
-            datetime.datetime(
-                day.year,
-                day.month,
-                day.day,
-                i,
-                0,
-                0,
-                0,
-            )
-        )
-        for i in range(11, 21)
-    ]
+    set_span_attribute("commune", commune.name)
     free_hour_slots = [
-        LectureSlot(
-            start=hour.isoformat(),
-            end=(hour + datetime.timedelta(hours=1)).isoformat(),
-            name="Free lecture",
-            total_guests=0,
+        LectureSlot.model_construct(
+            start=start, end=end, name="Free lecture", total_guests=0
         )
-        for hour in hours
-        if hour.hour != 15 and hour.hour != 16
+        for start, end in get_candidate_slots(day, commune, 60)
     ]
 
     therapy_visits, lecture_visits = get_events_for_day(day, commune)
+    midnight = time_utils.local_midnight(day)
 
     available_slots = []
     for free_slot in free_hour_slots:
@@ -306,45 +454,33 @@ def get_lecture_free_slots_for_a_day(
                     time_slots[slot_key] = lecture.total_guests
 
             # For each half hour within the hour slot, sum up all overlapping guests
-            total_guests = 0
-            slot_start = datetime.datetime.fromisoformat(free_slot.start)
-            slot_end = datetime.datetime.fromisoformat(free_slot.end)
+            slot_start = minute_of_day(free_slot.start, midnight)
+            slot_middle = slot_start + 30
+            slot_end = minute_of_day(free_slot.end, midnight)
+            spans = [
+                (minute_of_day(start, midnight), minute_of_day(end, midnight), guests)
+                for (start, end), guests in time_slots.items()
+            ]
 
             # Check first half hour
             first_half_guests = sum(
                 guests
-                for (start, end), guests in time_slots.items()
+                for start, end, guests in spans
                 if (
-                    datetime.datetime.fromisoformat(start)
-                    <= slot_start
-                    < datetime.datetime.fromisoformat(end)
-                    or slot_start
-                    < datetime.datetime.fromisoformat(end)
-                    <= slot_start + datetime.timedelta(minutes=30)
-                    or (
-                        datetime.datetime.fromisoformat(start) <= slot_start
-                        and datetime.datetime.fromisoformat(end)
-                        >= slot_start + datetime.timedelta(minutes=30)
-                    )
+                    start <= slot_start < end
+                    or slot_start < end <= slot_middle
+                    or (start <= slot_start and end >= slot_middle)
                 )
             )
 
             # Check second half hour
             second_half_guests = sum(
                 guests
-                for (start, end), guests in time_slots.items()
+                for start, end, guests in spans
                 if (
-                    datetime.datetime.fromisoformat(start)
-                    <= slot_start + datetime.timedelta(minutes=30)
-                    < datetime.datetime.fromisoformat(end)
-                    or slot_start + datetime.timedelta(minutes=30)
-                    < datetime.datetime.fromisoformat(end)
-                    <= slot_end
-                    or (
-                        datetime.datetime.fromisoformat(start)
-                        <= slot_start + datetime.timedelta(minutes=30)
-                        and datetime.datetime.fromisoformat(end) >= slot_end
-                    )
+                    start <= slot_middle < end
+                    or slot_middle < end <= slot_end
+                    or (start <= slot_middle and end >= slot_end)
                 )
             )
 
@@ -354,61 +490,31 @@ def get_lecture_free_slots_for_a_day(
 
         available_slots.append(free_slot)
 
-    now = datetime.datetime.now(moscow_tz)
-    if day == now.date():
+    first_minute = first_bookable_minute(day, time_utils.now())
+    if first_minute:
         available_slots = [
-            slot for slot in available_slots if slot.start >= now.isoformat()
+            slot
+            for slot in available_slots
+            if time_utils.iso_minute(slot.start) >= first_minute
         ]
-    else:
-        available_slots = [slot for slot in available_slots if slot.start >= "11:00:00"]
 
     return available_slots
 
 
+@traced("slots.get_lecture_free_half_an_hour_slots_for_a_day")
 def get_lecture_free_half_an_hour_slots_for_a_day(
-    day: datetime.datetime,
+    day: datetime.date,
     commune: Commune,
 ) -> list[LectureSlot]:
     """Get free 30-minute slots for lectures."""
-    hours = [
-        moscow_tz.localize(
-            datetime.datetime(
-                day.year,
-                day.month,
-                day.day,
-                i,
-                0,
-                0,
-                0,
-            )
+    set_span_attribute("commune", commune.name)
+    free_slots = [
+        LectureSlot.model_construct(
+            start=start, end=end, name="Free lecture", total_guests=0
         )
-        for i in range(11, 21)
+        for start, end in get_candidate_slots(day, commune, 30)
     ]
 
-    # Create slots for both XX:00 and XX:30
-    free_slots = []
-    for hour in hours:
-        if hour.hour != 15 and hour.hour != 16:
-            # Add slot for the first half hour (XX:00-XX:30)
-            free_slots.append(
-                LectureSlot(
-                    start=hour.isoformat(),
-                    end=(hour + datetime.timedelta(minutes=30)).isoformat(),
-                    name="Free lecture",
-                    total_guests=0,
-                )
-            )
-            # Add slot for the second half hour (XX:30-XX+1:00)
-            half_hour = hour + datetime.timedelta(minutes=30)
-            free_slots.append(
-                LectureSlot(
-                    start=half_hour.isoformat(),
-                    end=(half_hour + datetime.timedelta(minutes=30)).isoformat(),
-                    name="Free lecture",
-                    total_guests=0,
-                )
-            )
-
     therapy_visits, lecture_visits = get_events_for_day(day, commune)
 
     available_slots = []
@@ -445,12 +551,12 @@ def get_lecture_free_half_an_hour_slots_for_a_day(
         free_slot.total_guests = total_guests
         available_slots.append(free_slot)
 
-    now = datetime.datetime.now(moscow_tz)
-    if day == now.date():
+    first_minute = first_bookable_minute(day, time_utils.now())
+    if first_minute:
         available_slots = [
-            slot for slot in available_slots if slot.start >= now.isoformat()
+            slot
+            for slot in available_slots
+            if time_utils.iso_minute(slot.start) >= first_minute
         ]
-    else:
-        available_slots = [slot for slot in available_slots if slot.start >= "11:00:00"]
 
     return available_slots
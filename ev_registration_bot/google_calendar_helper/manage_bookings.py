@@ -0,0 +1,202 @@
+"""Cancelling and moving a user's bookings.
+
+Both update the events mirror as soon as Calendar has the change, so the
+freed capacity can be booked right away instead of after the next sync.
+"""
+
+import contextlib
+import datetime
+import logging
+import math
+from typing import Iterator
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.google_calendar_helper import (
+    booking_outbox,
+    events_cache,
+    reminders,
+    user_bookings,
+)
+from ev_registration_bot.google_calendar_helper.google_calendar_create import (
+    delete_event,
+    has_capacity,
+    move_event,
+)
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    get_events_for_day,
+)
+from ev_registration_bot.google_calendar_helper.schedule import get_candidate_slots
+from ev_registration_bot.google_calendar_helper.user_bookings import UserBooking
+from ev_registration_bot.google_calendar_helper.utils import (
+    Commune,
+    VisitType,
+    get_commune,
+    get_commune_guest_limit,
+)
+from ev_registration_bot.shared_state.backend import get_backend
+from ev_registration_bot.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+
+class BookingStillPendingError(Exception):
+    """The booking is still queued for Calendar and can't be moved yet."""
+
+
+def _reservation_lock(commune: Commune, day: datetime.date):
+    # The same lock create_event checks capacity under
+    return get_backend().lock(f"reservation:{commune.name}:{day.isoformat()}")
+
+
+@contextlib.contextmanager
+def _reservation_locks(commune: Commune, *days: datetime.date) -> Iterator[None]:
+    """Hold the reservation locks of several days.
+
+    Taken earliest day first, so two moves between the same days in
+    opposite directions can't each hold one lock and wait for the other.
+    """
+    with contextlib.ExitStack() as stack:
+        for day in sorted(set(days)):
+            stack.enter_context(_reservation_lock(commune, day))
+        yield
+
+
+def _take_from_mirror(commune: Commune, day: datetime.date, event_id: str):
+    """Remove a visit from the mirrored day; returns it, or None if not mirrored."""
+    cached = events_cache.get_day(commune, day, math.inf)
+    if cached is None:
+        return None
+    taken = [
+        visit
+        for visit in [*cached.therapy_visits, *cached.lecture_visits]
+        if visit.event_id == event_id
+    ]
+    events_cache.update_day(
+        commune,
+        day,
+        cached._replace(
+            therapy_visits=[
+                visit for visit in cached.therapy_visits if visit.event_id != event_id
+            ],
+            lecture_visits=[
+                visit for visit in cached.lecture_visits if visit.event_id != event_id
+            ],
+        ),
+    )
+    return taken[0] if taken else None
+
+
+def _put_in_mirror(commune: Commune, day: datetime.date, visit) -> None:
+    cached = events_cache.get_day(commune, day, math.inf)
+    if cached is None:
+        return
+    if hasattr(visit, "total_guests"):
+        changed = cached._replace(lecture_visits=[*cached.lecture_visits, visit])
+    else:
+        changed = cached._replace(therapy_visits=[*cached.therapy_visits, visit])
+    events_cache.update_day(commune, day, changed)
+
+
+def _other_visits(commune: Commune, day: datetime.date, event_id: str):
+    therapy_visits, lecture_visits = get_events_for_day(day, commune)
+    return (
+        [visit for visit in therapy_visits if visit.event_id != event_id],
+        [visit for visit in lecture_visits if visit.event_id != event_id],
+    )
+
+
+@traced("bookings.cancel")
+def cancel_booking(user_id: int, booking: UserBooking) -> None:
+    """Cancel a booking, whether it is still queued or already in Calendar.
+
+    Raises HttpError or CircuitOpenError if Calendar can't delete it.
+    """
+    commune = get_commune(booking.commune)
+    with _reservation_lock(commune, booking.day):
+        if not booking_outbox.cancel(commune, booking.day, booking.event_id):
+            delete_event(commune, booking.event_id)
+        _take_from_mirror(commune, booking.day, booking.event_id)
+    user_bookings.remove(user_id, booking.event_id)
+    reminders.cancel(booking.event_id)
+    logger.info("Booking %s cancelled", booking.event_id)
+
+
+def free_slots_for_move(
+    booking: UserBooking, day: datetime.date
+) -> list[tuple[str, str]]:
+    """ISO (start, end) of the slots of ``day`` the booking could move to.
+
+    Raises OutOfTimeException or CalendarUnavailableException like
+    get_events_for_day.
+    """
+    commune = get_commune(booking.commune)
+    duration = datetime.datetime.fromisoformat(
+        booking.end
+    ) - datetime.datetime.fromisoformat(booking.start)
+    therapy_visits, lecture_visits = _other_visits(commune, day, booking.event_id)
+    now = time_utils.now().isoformat()
+    guest_limit = get_commune_guest_limit(commune)
+    return [
+        (start, end)
+        for start, end in get_candidate_slots(
+            day, commune, int(duration.total_seconds() // 60)
+        )
+        if start >= now
+        and has_capacity(
+            start,
+            end,
+            VisitType(booking.visit_type),
+            booking.guests,
+            guest_limit,
+            therapy_visits,
+            lecture_visits,
+        )
+    ]
+
+
+@traced("bookings.reschedule")
+def reschedule_booking(
+    user_id: int, booking: UserBooking, start_time: str, end_time: str
+) -> bool:
+    """Move a booking; False if the new slot has no room left.
+
+    Raises BookingStillPendingError if the booking isn't in Calendar yet, and
+    HttpError or CircuitOpenError if Calendar can't move it.
+    """
+    commune = get_commune(booking.commune)
+    if booking_outbox.is_pending(commune, booking.day, booking.event_id):
+        raise BookingStillPendingError(booking.event_id)
+
+    moved = booking._replace(start=start_time, end=end_time)
+    # The old day loses the booking as the new one gains it
+    with _reservation_locks(commune, booking.day, moved.day):
+        therapy_visits, lecture_visits = _other_visits(
+            commune, moved.day, booking.event_id
+        )
+        if not has_capacity(
+            start_time,
+            end_time,
+            VisitType(booking.visit_type),
+            booking.guests,
+            get_commune_guest_limit(commune),
+            therapy_visits,
+            lecture_visits,
+        ):
+            return False
+        move_event(commune, booking.event_id, start_time, end_time)
+
+        visit = _take_from_mirror(commune, booking.day, booking.event_id)
+        if visit is None:
+            # Nothing to move over: fetch the new day again rather than
+            # offer its capacity without this booking
+            events_cache.invalidate_day(commune, moved.day)
+        else:
+            _put_in_mirror(
+                commune,
+                moved.day,
+                visit.model_copy(update={"start": start_time, "end": end_time}),
+            )
+    user_bookings.add(user_id, moved)
+    reminders.schedule(booking.event_id, user_id, commune, start_time)
+    logger.info("Booking %s moved to %s", booking.event_id, start_time)
+    return True
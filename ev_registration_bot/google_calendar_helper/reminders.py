@@ -0,0 +1,261 @@
+"""Reminders sent REMINDER_HOURS_BEFORE each visit.
+
+Reminders are kept in a SQLite file next to the outbox, so they survive
+restarts, and in an in-memory heap ordered by send time, so a tick only
+looks at the reminders that are due. Rescheduled and cancelled reminders
+leave stale heap entries behind; they are recognised against the file and
+skipped when popped.
+
+A reminder is marked sent only once the send queue has delivered it, so
+one still queued when the bot stops is sent after the restart.
+
+The events mirror is the source of truth: whenever it reports a day, that
+day's reminders are reconciled with its visits, which also recreates
+reminders lost with the file for every visit booked through the bot.
+"""
+
+import datetime
+import functools
+import heapq
+import logging
+import sqlite3
+import threading
+
+from telegram.ext import ContextTypes, JobQueue
+
+from ev_registration_bot import send_queue
+from ev_registration_bot import time_utils
+from ev_registration_bot.config import get_settings
+from ev_registration_bot.google_calendar_helper import events_cache
+from ev_registration_bot.google_calendar_helper.events_cache import CachedDay
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    with_pending_bookings,
+)
+from ev_registration_bot.google_calendar_helper.utils import Commune, get_commune
+from ev_registration_bot.shared_state.backend import get_backend
+
+logger = logging.getLogger(__name__)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reminders (
+    event_id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    commune TEXT NOT NULL,
+    day TEXT NOT NULL,
+    start TEXT NOT NULL,
+    send_at REAL NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS reminders_day ON reminders (commune, day);
+"""
+
+# Workers sharing a backend may each hold a reminder; the first to claim it
+# sends it. The claim only has to outlast the send queue, so a reminder
+# claimed by a worker that stopped before sending it is sent by another.
+_CLAIM_TTL_SECONDS = 10 * 60
+# The reminder is long over by the time its sent mark expires
+_SENT_TTL_SECONDS = 2 * 24 * 60 * 60
+
+_connection: sqlite3.Connection | None = None
+_lock = threading.Lock()
+# (when to check, event_id), possibly stale, see _due
+_heap: list[tuple[float, str]] = []
+_heap_loaded = False
+
+
+def _get_connection() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(
+            get_settings().reminders.path, check_same_thread=False, isolation_level=None
+        )
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(_SCHEMA)
+    return _connection
+
+
+def _load_heap() -> None:
+    """Fill the heap from the file, once per process; call with _lock held."""
+    global _heap, _heap_loaded
+    if _heap_loaded:
+        return
+    # Sorted rows already form a heap
+    _heap = (
+        _get_connection()
+        .execute(
+            "SELECT send_at, event_id FROM reminders WHERE sent = 0 ORDER BY send_at"
+        )
+        .fetchall()
+    )
+    _heap_loaded = True
+
+
+def _send_at(start: str) -> float:
+    hours_before = get_settings().reminders.hours_before
+    return datetime.datetime.fromisoformat(start).timestamp() - hours_before * 3600
+
+
+def _upsert(event_id: str, chat_id: int, commune: Commune, start: str) -> None:
+    """Call with _lock held."""
+    send_at = _send_at(start)
+    _get_connection().execute(
+        "INSERT INTO reminders (event_id, chat_id, commune, day, start, send_at) "
+        "VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (event_id) DO UPDATE SET chat_id = excluded.chat_id, "
+        "commune = excluded.commune, day = excluded.day, start = excluded.start, "
+        "send_at = excluded.send_at, sent = 0",
+        (event_id, chat_id, commune.name, start[:10], start, send_at),
+    )
+    if _heap_loaded:
+        heapq.heappush(_heap, (send_at, event_id))
+
+
+def schedule(event_id: str, chat_id: int, commune: Commune, start: str) -> None:
+    """Remind ``chat_id`` of a visit, unless it is too close to need one.
+
+    A visit moved that close loses the reminder of its old time.
+    """
+    if not get_settings().reminders.enabled:
+        return
+    if _send_at(start) <= time_utils.timestamp():
+        cancel(event_id)
+        return
+    with _lock:
+        _upsert(event_id, chat_id, commune, start)
+
+
+def cancel(event_id: str) -> None:
+    with _lock:
+        _get_connection().execute(
+            "DELETE FROM reminders WHERE event_id = ?", (event_id,)
+        )
+
+
+@events_cache.on_day_changed
+def _on_day_changed(commune: Commune, day: datetime.date, cached: CachedDay) -> None:
+    if not get_settings().reminders.enabled:
+        return
+    therapy_visits, lecture_visits = with_pending_bookings(
+        day, commune, cached.therapy_visits, cached.lecture_visits
+    )
+    visits = {visit.event_id: visit for visit in [*therapy_visits, *lecture_visits]}
+    now = time_utils.timestamp()
+    with _lock:
+        connection = _get_connection()
+        stored = {
+            event_id: (chat_id, start)
+            for event_id, chat_id, start in connection.execute(
+                "SELECT event_id, chat_id, start FROM reminders "
+                "WHERE commune = ? AND day = ?",
+                (commune.name, day.isoformat()),
+            )
+        }
+        gone = [(event_id,) for event_id in stored if event_id not in visits]
+        if gone:
+            connection.executemany("DELETE FROM reminders WHERE event_id = ?", gone)
+        for event_id, visit in visits.items():
+            chat_id, start = stored.get(event_id, (visit.user_id, None))
+            # Unchanged, or not booked through the bot
+            if start == visit.start or chat_id is None:
+                continue
+            if _send_at(visit.start) > now:
+                _upsert(event_id, chat_id, commune, visit.start)
+
+
+def _due(now: float, limit: int) -> list[tuple[str, int, str, str]]:
+    """Pop up to ``limit`` due reminders as (event_id, chat_id, commune, start).
+
+    A reminder rescheduled to later is no longer due when its old entry
+    pops; one already sent is gone from the unsent rows.
+    """
+    due = []
+    with _lock:
+        _load_heap()
+        connection = _get_connection()
+        while _heap and _heap[0][0] <= now and len(due) < limit:
+            _, event_id = heapq.heappop(_heap)
+            row = connection.execute(
+                "SELECT chat_id, commune, start FROM reminders "
+                "WHERE event_id = ? AND send_at <= ? AND sent = 0",
+                (event_id, now),
+            ).fetchone()
+            if row is not None:
+                due.append((event_id, *row))
+        # Visits that are over no longer need their rows
+        today = datetime.datetime.fromtimestamp(now, time_utils.MOSCOW_TZ).date()
+        connection.execute("DELETE FROM reminders WHERE day < ?", (today.isoformat(),))
+    return due
+
+
+def _check_again(event_id: str, at: float) -> None:
+    with _lock:
+        if _heap_loaded:
+            heapq.heappush(_heap, (at, event_id))
+
+
+def _sent_key(event_id: str, start: str) -> str:
+    return f"reminder-sent:{event_id}:{start}"
+
+
+def _mark_sent(event_id: str, start: str) -> None:
+    get_backend().set(_sent_key(event_id, start), b"1", _SENT_TTL_SECONDS)
+    with _lock:
+        _get_connection().execute(
+            "UPDATE reminders SET sent = 1 WHERE event_id = ? AND start = ?",
+            (event_id, start),
+        )
+
+
+def _reminder_text(commune: Commune, start: str) -> str:
+    moment = datetime.datetime.fromisoformat(start)
+    text = (
+        f"Напоминаем о Вашей записи {moment.day}.{moment.month:02d} "
+        f"в {moment.hour:02d}:{moment.minute:02d} ({commune.settings.label})"
+    )
+    if commune.settings.address:
+        text += f"\n\nАдрес: {commune.settings.address}"
+    return text + "\n\nПосмотреть или изменить записи: /my_bookings"
+
+
+async def send_reminders(context: ContextTypes.DEFAULT_TYPE) -> None:
+    now = time_utils.timestamp()
+    backend = get_backend()
+    for event_id, chat_id, commune_name, start in _due(
+        now, get_settings().reminders.batch_size
+    ):
+        if datetime.datetime.fromisoformat(start).timestamp() <= now:
+            # Due while the bot was down and the visit has started since
+            continue
+        if backend.get(_sent_key(event_id, start)) is not None:
+            # Sent already, maybe by another worker
+            _mark_sent(event_id, start)
+            continue
+        try:
+            text = _reminder_text(get_commune(commune_name), start)
+        except KeyError:
+            logger.warning(
+                "Reminder %s is for a commune no longer configured", event_id
+            )
+            continue
+        # Looked at again once the claim lapses, in case the send fails or
+        # dies with its worker; a sent reminder is skipped then
+        _check_again(event_id, now + _CLAIM_TTL_SECONDS)
+        if backend.acquire(f"reminder:{event_id}:{start}", _CLAIM_TTL_SECONDS) is None:
+            # Being sent, by this worker or another
+            continue
+        send_queue.enqueue(
+            chat_id,
+            text,
+            "reminder",
+            functools.partial(_mark_sent, event_id, start),
+        )
+
+
+def schedule_reminders(job_queue: JobQueue) -> None:
+    job_queue.run_repeating(
+        send_reminders,
+        interval=get_settings().reminders.tick_seconds,
+        first=0,
+        name="send_reminders",
+    )
@@ -0,0 +1,176 @@
+import datetime
+from typing import NamedTuple
+
+from ev_registration_bot.config import (
+    Schedule,
+    Settings,
+    WorkingHoursSettings,
+    get_settings,
+    on_settings_reload,
+)
+from ev_registration_bot.google_calendar_helper.utils import Commune
+from ev_registration_bot.metrics import record_cache_lookup
+from ev_registration_bot.time_utils import (
+    MINUTES_PER_DAY,
+    MOSCOW_TZ,
+    minutes,
+    utc_offset,
+)
+
+
+class SlotTemplate(NamedTuple):
+    """A bookable slot of a working day, independent of the date."""
+
+    start_minute: int
+    end_minute: int
+    # "T11:00:00", ready to be glued to a date and a UTC offset
+    start_suffix: str
+    end_suffix: str
+
+
+_templates: dict[tuple[Commune, int, int], tuple[SlotTemplate, ...]] = {}
+
+
+def minute_of_day(value: str, midnight: datetime.datetime) -> int:
+    """Minutes from ``midnight`` to the ISO time ``value``, clamped to that day."""
+    moment = datetime.datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=MOSCOW_TZ)
+    minute = (moment - midnight).total_seconds() // 60
+    return int(min(max(minute, 0), MINUTES_PER_DAY))
+
+
+def _suffix(minute: int) -> str:
+    return f"T{minute // 60:02d}:{minute % 60:02d}:00"
+
+
+def get_schedule(commune: Commune) -> Schedule:
+    return commune.settings.schedule or get_settings().schedule.default
+
+
+def get_working_hours(
+    commune: Commune, day: datetime.date
+) -> WorkingHoursSettings | None:
+    """Working hours of ``commune`` on ``day``, or None if it is closed."""
+    schedule = get_schedule(commune)
+    if day in schedule.holidays:
+        return None
+    return schedule.weekday_hours.get(day.weekday(), schedule.working_hours)
+
+
+def is_past_closing(
+    working_hours: WorkingHoursSettings, now: datetime.datetime
+) -> bool:
+    """Whether ``now`` is too late in the day to still book with ``working_hours``."""
+    return minutes(now.time()) >= minutes(working_hours.closes_at)
+
+
+def first_bookable_minute(day: datetime.date, now: datetime.datetime) -> int:
+    """Minute of day from which slots of ``day`` can still be booked at ``now``.
+
+    Rounded up: a slot starting at 15:00 has begun by 15:00:30.
+    """
+    if day != now.date():
+        return 0
+    if now.second or now.microsecond:
+        return minutes(now.time()) + 1
+    return minutes(now.time())
+
+
+def get_bookable_days(
+    commune: Commune | None,
+    now: datetime.datetime,
+    count: int,
+    lookahead_days: int = 14,
+) -> list[datetime.date]:
+    """The next ``count`` days with working hours, starting today if still open.
+
+    Looks ``lookahead_days`` ahead at most, so a long run of holidays can't
+    loop forever. Without a commune every day counts as bookable.
+    """
+    today = now.date()
+    days = []
+    for offset in range(lookahead_days):
+        day = today + datetime.timedelta(days=offset)
+        if commune is not None:
+            working_hours = get_working_hours(commune, day)
+            if working_hours is None:
+                continue
+            if day == today and is_past_closing(working_hours, now):
+                continue
+        days.append(day)
+        if len(days) == count:
+            break
+    return days
+
+
+def _build_templates(
+    schedule: Schedule, weekday: int, duration_minutes: int
+) -> tuple[SlotTemplate, ...]:
+    hours = schedule.weekday_hours.get(weekday, schedule.working_hours)
+    if hours is None:
+        return ()
+
+    step = schedule.slot_step_minutes or duration_minutes
+    breaks = [(minutes(b.start), minutes(b.end)) for b in hours.breaks]
+    closes_at = minutes(hours.closes_at)
+
+    templates = []
+    start = minutes(hours.opens_at)
+    while start + duration_minutes <= closes_at:
+        end = start + duration_minutes
+        if not any(
+            start < break_end and break_start < end for break_start, break_end in breaks
+        ):
+            templates.append(SlotTemplate(start, end, _suffix(start), _suffix(end)))
+        start += step
+    return tuple(templates)
+
+
+def get_slot_templates(
+    commune: Commune, weekday: int, duration_minutes: int
+) -> tuple[SlotTemplate, ...]:
+    """Slot templates for a weekday, computed once per (commune, weekday, duration)."""
+    key = (commune, weekday, duration_minutes)
+    templates = _templates.get(key)
+    record_cache_lookup("slot_templates", templates is not None)
+    if templates is None:
+        templates = _build_templates(get_schedule(commune), weekday, duration_minutes)
+        _templates[key] = templates
+    return templates
+
+
+def clear_slot_templates() -> None:
+    _templates.clear()
+
+
+@on_settings_reload
+def _on_settings_reload(old: Settings, new: Settings) -> None:
+    if old.schedule != new.schedule or old.communes != new.communes:
+        clear_slot_templates()
+
+
+def get_day_templates(
+    commune: Commune, day: datetime.date, duration_minutes: int
+) -> tuple[SlotTemplate, ...]:
+    """Slot templates of ``day``; none on the commune's holidays."""
+    if day in get_schedule(commune).holidays:
+        return ()
+    return get_slot_templates(commune, day.weekday(), duration_minutes)
+
+
+def get_candidate_slots(
+    day: datetime.date, commune: Commune, duration_minutes: int
+) -> list[tuple[str, str]]:
+    """ISO (start, end) pairs of every slot of ``day`` before looking at bookings."""
+    templates = get_day_templates(commune, day, duration_minutes)
+    if not templates:
+        return []
+
+    # Moscow has no DST, so one offset per day covers every slot
+    offset = utc_offset(day)
+    date = day.isoformat()
+    return [
+        (f"{date}{t.start_suffix}{offset}", f"{date}{t.end_suffix}{offset}")
+        for t in templates
+    ]
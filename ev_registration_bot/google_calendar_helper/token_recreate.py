@@ -1,102 +1,229 @@
-import datetime
-import os.path
+"""Check and refresh the Google Calendar tokens of every configured commune.
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-import argparse
-from enum import Enum
+    python -m ev_registration_bot.google_calendar_helper.token_recreate \\
+        [check|refresh|login] [--commune ID ...] [--max-latency SECONDS]
 
-# If modifying these scopes, delete the file token.json.
-SCOPES = ["https://www.googleapis.com/auth/calendar"]
+``check`` (the default) loads each token, refreshes it in memory if it has
+expired and times one Calendar call; nothing is written, so it is safe as a
+cron pre-check next to the running bot. ``refresh`` also writes the
+refreshed tokens back. ``login`` runs the browser consent flow for
+communes whose token can't be refreshed, one at a time.
 
+Communes are checked concurrently. A JSON report goes to stdout and the
+exit status is 1 if any commune is not ok.
 
-class CommuneType(Enum):
-    """Enum containing the different communes."""
+Tokens are written to a temporary file and renamed over ``token.json``, so
+the bot never reads a half-written token. The bot keeps its credentials in
+memory and only re-reads the file once they stop being valid; Google
+refresh tokens stay valid when a new access token is issued, so refreshing
+from here never invalidates the bot's copy.
+"""
 
-    GERMAN = "german"
-    AMERICAN = "american"
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import TYPE_CHECKING, NamedTuple
 
+from googleapiclient.errors import HttpError
 
-parser = argparse.ArgumentParser(
-    description="Recreate a token file for the Google Calendar API"
+from ev_registration_bot.google_calendar_helper.calendar_service import (
+    get_calendar_service,
 )
-parser.add_argument(
-    "--commune",
-    "-c",
-    help="The commune for which to recreate the token file",
-    type=str,
+from ev_registration_bot.google_calendar_helper.circuit_breaker import is_quota_error
+from ev_registration_bot.google_calendar_helper.google_calendar_get import SCOPES
+from ev_registration_bot.google_calendar_helper.utils import (
+    Commune,
+    find_communes,
+    get_communes,
 )
 
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
-def main(commune: CommuneType):
-    """Shows basic usage of the Google Calendar API.
-    Prints the start and name of the next 10 events on the user's calendar.
-    """
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists(f"{commune.value}_calendar_configs/token.json"):
-        creds = Credentials.from_authorized_user_file(
-            f"{commune.value}_calendar_configs/token.json", SCOPES
-        )
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                f"{commune.value}_calendar_configs/credentials.json", SCOPES
-            )
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open(f"{commune.value}_calendar_configs/token.json", "w") as token:
-            token.write(creds.to_json())
+OK = "ok"
+SLOW = "slow"
+QUOTA_EXCEEDED = "quota_exceeded"
+TOKEN_INVALID = "token_invalid"
+CALENDAR_ERROR = "calendar_error"
+
+
+class TokenStatus(NamedTuple):
+    commune: str
+    status: str
+    # Whether a new access token was obtained during this run
+    refreshed: bool = False
+    # Whether token.json was rewritten
+    written: bool = False
+    # Seconds until the access token expires
+    expires_in: float | None = None
+    # Duration of the test Calendar call
+    latency: float | None = None
+    error: str | None = None
 
+
+def _token_path(commune: Commune) -> str:
+    return os.path.join(commune.settings.config_dir, "token.json")
+
+
+def write_token(path: str, creds: "Credentials") -> None:
+    """Replace ``path`` with ``creds`` in one rename."""
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(prefix=".token-", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as temp_file:
+            temp_file.write(creds.to_json())
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _load_token(commune: Commune, force_refresh: bool) -> tuple["Credentials", bool]:
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
+    token_path = _token_path(commune)
+    if not os.path.exists(token_path):
+        raise ValueError(f"{token_path} does not exist")
+    creds = Credentials.from_authorized_user_file(token_path, SCOPES)
+    if creds.valid and not force_refresh:
+        return creds, False
+    if not creds.refresh_token:
+        raise ValueError("Invalid credentials")
+    creds.refresh(Request())
+    return creds, True
+
+
+def _expires_in(creds: "Credentials") -> float | None:
+    if creds.expiry is None:
+        return None
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+    return round((creds.expiry - now).total_seconds())
+
+
+def check_commune(commune: Commune, write: bool, max_latency: float) -> TokenStatus:
     try:
-        service = build("calendar", "v3", credentials=creds)
-
-        # Call the Calendar API
-        # now = datetime.datetime.utcnow().isoformat() + "Z"  # 'Z' indicates UTC time
-        now = datetime.datetime.now(datetime.UTC).isoformat()
-        print("Getting the upcoming 10 events")
-        events_result = (
-            service.events()
-            .list(
-                calendarId="primary",
-                timeMin=now,
-                maxResults=10,
-                singleEvents=True,
-                orderBy="startTime",
+        creds, refreshed = _load_token(commune, force_refresh=write)
+    except Exception as error:
+        return TokenStatus(commune.name, TOKEN_INVALID, error=str(error))
+
+    written = False
+    if write:
+        write_token(_token_path(commune), creds)
+        written = True
+    status = TokenStatus(
+        commune.name, OK, refreshed, written, expires_in=_expires_in(creds)
+    )
+
+    service = get_calendar_service(commune, lambda _: creds)
+    started_at = time.perf_counter()
+    try:
+        service.events().list(
+            calendarId=commune.settings.calendar_id,
+            timeMin=datetime.datetime.now(datetime.UTC).isoformat(),
+            maxResults=1,
+            singleEvents=True,
+        ).execute()
+    except HttpError as error:
+        return status._replace(
+            status=QUOTA_EXCEEDED if is_quota_error(error) else CALENDAR_ERROR,
+            latency=round(time.perf_counter() - started_at, 3),
+            error=str(error),
+        )
+    except Exception as error:
+        return status._replace(status=CALENDAR_ERROR, error=str(error))
+
+    latency = round(time.perf_counter() - started_at, 3)
+    return status._replace(
+        status=OK if latency <= max_latency else SLOW, latency=latency
+    )
+
+
+def check_communes(
+    communes: list[Commune], write: bool, max_latency: float
+) -> list[TokenStatus]:
+    if not communes:
+        # ThreadPoolExecutor refuses max_workers=0
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(communes)) as pool:
+        return list(
+            pool.map(
+                lambda commune: check_commune(commune, write, max_latency), communes
             )
-            .execute()
         )
-        events = events_result.get("items", [])
 
-        if not events:
-            print("No upcoming events found.")
-            return
 
-        # Prints the start and name of the next 10 events
-        for event in events:
-            start = event["start"].get("dateTime", event["start"].get("date"))
-            print(start, event["summary"])
+def login(commune: Commune) -> None:
+    """Run the consent flow in a browser and save the new token."""
+    from google_auth_oauthlib.flow import InstalledAppFlow
 
-    except HttpError as error:
-        print(f"An error occurred: {error}")
+    flow = InstalledAppFlow.from_client_secrets_file(
+        os.path.join(commune.settings.config_dir, "credentials.json"), SCOPES
+    )
+    write_token(_token_path(commune), flow.run_local_server(port=0))
+
+
+parser = argparse.ArgumentParser(
+    description="Check and refresh the Google Calendar tokens of every commune"
+)
+parser.add_argument(
+    "action",
+    nargs="?",
+    choices=["check", "refresh", "login"],
+    default="check",
+    help="check tokens without writing, refresh and save them, "
+    "or log in again where they can't be refreshed",
+)
+parser.add_argument(
+    "--commune",
+    "-c",
+    action="append",
+    help="Only this commune id, e.g. german; may be repeated",
+)
+parser.add_argument(
+    "--max-latency",
+    type=float,
+    default=2.0,
+    help="Calendar call duration in seconds above which a commune is reported slow",
+)
 
 
 if __name__ == "__main__":
     args = parser.parse_args()
-    if args.commune == CommuneType.AMERICAN.value:
-        main(CommuneType.AMERICAN)
-        exit(0)
-    elif args.commune == CommuneType.GERMAN.value:
-        main(CommuneType.GERMAN)
-        exit(0)
-    else:
-        print("Invalid commune. Please choose 'german' or 'american'.")
-        exit(1)
+    communes = list(get_communes())
+    if args.commune:
+        try:
+            communes = find_communes(args.commune)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            exit(2)
+    if not communes:
+        print("No communes configured, see COMMUNES", file=sys.stderr)
+        exit(2)
+
+    if args.action == "login":
+        # The consent flow needs a person at a browser, so one commune at a time
+        for commune in communes:
+            if check_commune(commune, False, args.max_latency).status == TOKEN_INVALID:
+                print(f"Logging in for {commune.name}", file=sys.stderr)
+                login(commune)
+
+    statuses = check_communes(communes, args.action == "refresh", args.max_latency)
+    print(
+        json.dumps(
+            {
+                "ok": all(status.status == OK for status in statuses),
+                "communes": [status._asdict() for status in statuses],
+            },
+            indent=2,
+        )
+    )
+    exit(0 if all(status.status == OK for status in statuses) else 1)
@@ -0,0 +1,133 @@
+"""Index of each Telegram user's bookings.
+
+Every booking is recorded in a state backend hash per user when it is made,
+and its event carries the user id as a private extended property. If the
+index has nothing for a user it is rebuilt once from Calendar with a query
+on that property, never by scanning the calendars.
+"""
+
+import datetime
+import json
+import logging
+from typing import NamedTuple
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.google_calendar_helper.calendar_service import (
+    get_calendar_service,
+)
+from ev_registration_bot.google_calendar_helper.circuit_breaker import guarded_call
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    USER_ID_PROPERTY,
+    extract_total_guests,
+    get_creds,
+)
+from ev_registration_bot.google_calendar_helper.utils import (
+    Commune,
+    VisitType,
+    get_communes,
+)
+from ev_registration_bot.metrics import observe_calendar_call
+from ev_registration_bot.shared_state.backend import get_backend
+
+logger = logging.getLogger(__name__)
+
+
+# How long a rebuilt index is trusted before Calendar is asked again
+_REBUILT_TTL_SECONDS = 24 * 60 * 60
+
+
+class UserBooking(NamedTuple):
+    event_id: str
+    # Commune id, see get_commune
+    commune: str
+    start: str
+    end: str
+    # VisitType value
+    visit_type: str
+    guests: int
+    summary: str
+
+    @property
+    def day(self) -> datetime.date:
+        return datetime.date.fromisoformat(self.start[:10])
+
+
+def _index_key(user_id: int) -> str:
+    return f"user_bookings:{user_id}"
+
+
+def add(user_id: int, booking: UserBooking) -> None:
+    get_backend().hset(
+        _index_key(user_id),
+        booking.event_id,
+        json.dumps(booking, ensure_ascii=False).encode(),
+    )
+
+
+def remove(user_id: int, event_id: str) -> None:
+    get_backend().hdel(_index_key(user_id), event_id)
+
+
+def _list_user_events(commune: Commune, user_id: int, time_min: str) -> dict:
+    service = get_calendar_service(commune, get_creds)
+    with observe_calendar_call("events.list", commune.name):
+        return (
+            service.events()
+            .list(
+                calendarId=commune.settings.calendar_id,
+                timeMin=time_min,
+                privateExtendedProperty=f"{USER_ID_PROPERTY}={user_id}",
+                singleEvents=True,
+                orderBy="startTime",
+            )
+            .execute()
+        )
+
+
+def _rebuild(user_id: int, now: datetime.datetime) -> None:
+    """Fill the index from Calendar, e.g. after the state backend was lost."""
+    for commune in get_communes():
+        result = guarded_call(
+            commune, _list_user_events, commune, user_id, now.isoformat()
+        )
+        for event in result.get("items", []):
+            description = event.get("description", "")
+            if "Тип посещения: Терапия" in description:
+                visit_type = VisitType.THERAPY
+            else:
+                visit_type = VisitType.LECTURE
+            add(
+                user_id,
+                UserBooking(
+                    event["id"],
+                    commune.name,
+                    event["start"].get("dateTime", event["start"].get("date")),
+                    event["end"].get("dateTime", event["end"].get("date")),
+                    visit_type.value,
+                    extract_total_guests(description),
+                    event.get("summary", ""),
+                ),
+            )
+    get_backend().set(f"user_bookings_rebuilt:{user_id}", b"1", _REBUILT_TTL_SECONDS)
+
+
+def get_upcoming(user_id: int) -> list[UserBooking]:
+    """The user's bookings that haven't started yet, soonest first."""
+    now = time_utils.now()
+    backend = get_backend()
+    stored = backend.hgetall(_index_key(user_id))
+    if not stored and backend.get(f"user_bookings_rebuilt:{user_id}") is None:
+        try:
+            _rebuild(user_id, now)
+        except Exception:
+            logger.exception("Failed to rebuild the bookings of user %s", user_id)
+        stored = backend.hgetall(_index_key(user_id))
+
+    upcoming = []
+    for event_id, data in stored.items():
+        booking = UserBooking(*json.loads(data))
+        if datetime.datetime.fromisoformat(booking.start) <= now:
+            remove(user_id, event_id)
+        else:
+            upcoming.append(booking)
+    return sorted(upcoming, key=lambda booking: booking.start)
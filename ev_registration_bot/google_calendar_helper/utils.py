@@ -1,10 +1,9 @@
 import enum
-from typing import Literal
 import logging
+from typing import NamedTuple
+
+from ev_registration_bot.config import CommuneSettings, CommunesSettings, get_settings
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 
@@ -13,27 +12,119 @@ class VisitType(enum.Enum):
     LECTURE = "lecture"
 
 
-class Commune(enum.Enum):
-    AMERICAN = "american_calendar_configs"
-    GERMAN = "german_calendar_configs"
+class Commune:
+    """A commune's calendar, known by its configured id (``name``).
+
+    Compared and hashed by id, so caches keyed by a commune survive a
+    settings reload that changes its limits, colours or schedule.
+    """
+
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Commune) and other.name == self.name
+
+    def __hash__(self) -> int:
+        return hash(self.name)
+
+    def __repr__(self) -> str:
+        return f"Commune({self.name!r})"
+
+    @property
+    def settings(self) -> CommuneSettings:
+        """Current settings of the commune; KeyError if it is no longer configured."""
+        return _get_index().by_id[self.name]
+
+
+class _Index(NamedTuple):
+    source: CommunesSettings
+    by_id: dict[str, CommuneSettings]
+    by_label: dict[str, Commune]
+    communes: tuple[Commune, ...]
+
+
+_communes: dict[str, Commune] = {}
+_index: _Index | None = None
+
+
+def get_commune(name: str) -> Commune:
+    """The commune with id ``name``, whether or not it is still configured."""
+    commune = _communes.get(name)
+    if commune is None:
+        commune = _communes.setdefault(name, Commune(name))
+    return commune
+
+
+def _get_index() -> _Index:
+    # Rebuilt once per settings snapshot, so lookups stay O(1) after a reload
+    global _index
+    source = get_settings().communes
+    index = _index
+    if index is None or index.source is not source:
+        communes = tuple(get_commune(entry.id) for entry in source.registry)
+        index = _Index(
+            source,
+            {entry.id: entry for entry in source.registry},
+            {entry.label: get_commune(entry.id) for entry in source.registry},
+            communes,
+        )
+        _index = index
+    return index
+
+
+def get_communes() -> tuple[Commune, ...]:
+    """Configured communes, in the order their buttons are shown."""
+    return _get_index().communes
+
+
+def find_communes(ids: list[str]) -> list[Commune]:
+    """Configured communes by id, as given on a command line.
+
+    An id matches exactly, or else case-insensitively if that is unambiguous,
+    so ``german`` finds ``GERMAN``. Raises ValueError naming the ids that
+    match nothing and the configured ones.
+    """
+    communes = get_communes()
+    by_id = {commune.name: commune for commune in communes}
+    by_folded_id: dict[str, list[Commune]] = {}
+    for commune in communes:
+        by_folded_id.setdefault(commune.name.casefold(), []).append(commune)
+
+    found, unknown = [], []
+    for commune_id in ids:
+        commune = by_id.get(commune_id)
+        if commune is None:
+            matches = by_folded_id.get(commune_id.casefold(), [])
+            commune = matches[0] if len(matches) == 1 else None
+        if commune is None:
+            unknown.append(commune_id)
+        else:
+            found.append(commune)
+    if unknown:
+        choices = ", ".join(f"'{commune.name}'" for commune in communes)
+        raise ValueError(
+            f"Invalid commune {', '.join(unknown)}. Please choose from {choices}."
+        )
+    return found
+
+
+def get_commune_by_label(label: str) -> Commune | None:
+    return _get_index().by_label.get(label)
 
 
 def get_visit_type_color(
     visit_type: VisitType,
     commune: Commune,
-) -> Literal[5] | Literal[7] | Literal[1]:
-    logger.info(f"visit_type: {visit_type.name}")
+) -> int:
     if visit_type.name == VisitType.THERAPY.name:
-        return 5
-
-    if commune.name == Commune.AMERICAN.name:
-        return 7
+        return commune.settings.therapy_color
 
-    return 1
+    return commune.settings.lecture_color
 
 
 def get_commune_guest_limit(commune: Commune) -> int:
     """Get the maximum number of guests allowed for a lecture in a commune."""
-    if commune.name == Commune.AMERICAN.name:
-        return 10  # American commune can have up to 10 guests
-    return 8  # German commune can have up to 8 guests
+    return commune.settings.guest_limit
@@ -0,0 +1,201 @@
+"""Waitlists for full lecture slots.
+
+A user who finds every lecture slot of a day full can wait for one. Each
+(commune, day) keeps its waiting slots in one state backend value, packed
+as (start minute, end minute, count) headers followed by the chat ids in
+arrival order. When the mirror reports a change to a day, only that day's
+waiting slots are checked, and as many waiters as there are free places
+are told, first come first served, through the send queue.
+
+A place offered to a waiter is held for them for a while: until the offer
+lapses it no longer counts as free, so the next change to the day doesn't
+offer the same place to the next waiter. A waiter who books in time holds
+their place twice until then, which only delays the next offer. The lapse
+times of the offers are kept per (commune, day) next to the waitlists.
+"""
+
+import datetime
+import logging
+import struct
+
+from ev_registration_bot import send_queue
+from ev_registration_bot import time_utils
+from ev_registration_bot.google_calendar_helper import events_cache
+from ev_registration_bot.google_calendar_helper.events_cache import CachedDay
+from ev_registration_bot.google_calendar_helper.google_calendar_create import (
+    lecture_places_left,
+)
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    with_pending_bookings,
+)
+from ev_registration_bot.google_calendar_helper.utils import (
+    Commune,
+    get_commune_guest_limit,
+)
+from ev_registration_bot.shared_state.backend import LockTimeout, get_backend
+
+logger = logging.getLogger(__name__)
+
+
+_SLOT_HEADER = struct.Struct("<HHH")
+_CHAT_ID = struct.Struct("<q")
+# (start minute, end minute, when the offer lapses)
+_OFFER = struct.Struct("<HHd")
+
+# How long an offered place stays set aside for the waiter who was told
+_OFFER_HOLD_SECONDS = 30 * 60
+
+# A waitlist is useless once its day is over
+_TTL_AFTER_DAY_SECONDS = 24 * 60 * 60
+
+Waitlists = dict[tuple[int, int], list[int]]
+# Slot -> when each of the offers made for it lapses
+Offers = dict[tuple[int, int], list[float]]
+
+
+def encode(waitlists: Waitlists) -> bytes:
+    parts = []
+    for (start_minute, end_minute), chat_ids in waitlists.items():
+        if chat_ids:
+            parts.append(_SLOT_HEADER.pack(start_minute, end_minute, len(chat_ids)))
+            parts.extend(_CHAT_ID.pack(chat_id) for chat_id in chat_ids)
+    return b"".join(parts)
+
+
+def decode(data: bytes) -> Waitlists:
+    waitlists = {}
+    offset = 0
+    while offset < len(data):
+        start_minute, end_minute, count = _SLOT_HEADER.unpack_from(data, offset)
+        offset += _SLOT_HEADER.size
+        waitlists[(start_minute, end_minute)] = [
+            _CHAT_ID.unpack_from(data, offset + i * _CHAT_ID.size)[0]
+            for i in range(count)
+        ]
+        offset += count * _CHAT_ID.size
+    return waitlists
+
+
+def _key(commune: Commune, day: datetime.date) -> str:
+    return f"waitlist:{commune.name}:{day.isoformat()}"
+
+
+def _offers_key(commune: Commune, day: datetime.date) -> str:
+    return f"waitlist-offers:{commune.name}:{day.isoformat()}"
+
+
+def _lock(commune: Commune, day: datetime.date):
+    return get_backend().lock(f"waitlist:{commune.name}:{day.isoformat()}")
+
+
+def _store(commune: Commune, day: datetime.date, waitlists: Waitlists) -> None:
+    backend = get_backend()
+    if not any(waitlists.values()):
+        backend.delete(_key(commune, day))
+        return
+    day_end = time_utils.local_midnight(day + datetime.timedelta(days=1))
+    ttl = day_end.timestamp() - time_utils.timestamp()
+    backend.set(
+        _key(commune, day), encode(waitlists), max(1, ttl) + _TTL_AFTER_DAY_SECONDS
+    )
+
+
+def get_waitlists(commune: Commune, day: datetime.date) -> Waitlists:
+    data = get_backend().get(_key(commune, day))
+    return decode(data) if data else {}
+
+
+def get_offers(commune: Commune, day: datetime.date, now: float) -> Offers:
+    """The offers still holding a place at ``now``."""
+    data = get_backend().get(_offers_key(commune, day)) or b""
+    offers = {}
+    for start_minute, end_minute, lapses_at in _OFFER.iter_unpack(data):
+        if lapses_at > now:
+            offers.setdefault((start_minute, end_minute), []).append(lapses_at)
+    return offers
+
+
+def _store_offers(commune: Commune, day: datetime.date, offers: Offers) -> None:
+    backend = get_backend()
+    data = b"".join(
+        _OFFER.pack(start_minute, end_minute, lapses_at)
+        for (start_minute, end_minute), lapse_times in offers.items()
+        for lapses_at in lapse_times
+    )
+    if not data:
+        backend.delete(_offers_key(commune, day))
+        return
+    # Every offer has lapsed by the time the value expires
+    backend.set(_offers_key(commune, day), data, _OFFER_HOLD_SECONDS)
+
+
+def join(
+    commune: Commune,
+    day: datetime.date,
+    start_minute: int,
+    end_minute: int,
+    chat_id: int,
+) -> int:
+    """Put a chat at the end of a slot's waitlist; returns its place in line."""
+    with _lock(commune, day):
+        waitlists = get_waitlists(commune, day)
+        chat_ids = waitlists.setdefault((start_minute, end_minute), [])
+        if chat_id not in chat_ids:
+            chat_ids.append(chat_id)
+        _store(commune, day, waitlists)
+    return chat_ids.index(chat_id) + 1
+
+
+def _notify(
+    commune: Commune, day: datetime.date, start_minute: int, end_minute: int, chat_id
+) -> None:
+    send_queue.enqueue(
+        chat_id,
+        f"Освободилось место на лекцию {day.day}.{day.month:02d} "
+        f"{start_minute // 60:02d}:{start_minute % 60:02d}-"
+        f"{end_minute // 60:02d}:{end_minute % 60:02d} "
+        f"({commune.settings.label}).\n\nЧтобы записаться нажмите /start",
+        "waitlist",
+    )
+
+
+@events_cache.on_day_changed
+def _on_day_changed(commune: Commune, day: datetime.date, cached: CachedDay) -> None:
+    waitlists = get_waitlists(commune, day)
+    if not waitlists:
+        return
+
+    therapy_visits, lecture_visits = with_pending_bookings(
+        day, commune, cached.therapy_visits, cached.lecture_visits
+    )
+    guest_limit = get_commune_guest_limit(commune)
+    try:
+        with _lock(commune, day):
+            # Re-read under the lock, another worker may have promoted some
+            waitlists = get_waitlists(commune, day)
+            now = time_utils.timestamp()
+            offers = get_offers(commune, day, now)
+            promoted = []
+            for (start_minute, end_minute), chat_ids in waitlists.items():
+                offered = offers.setdefault((start_minute, end_minute), [])
+                # Places already offered are held for their waiters
+                places = lecture_places_left(
+                    time_utils.iso_at(day, start_minute),
+                    time_utils.iso_at(day, end_minute),
+                    guest_limit,
+                    therapy_visits,
+                    lecture_visits,
+                ) - len(offered)
+                while places > 0 and chat_ids:
+                    promoted.append((start_minute, end_minute, chat_ids.pop(0)))
+                    offered.append(now + _OFFER_HOLD_SECONDS)
+                    places -= 1
+            if promoted:
+                _store(commune, day, waitlists)
+                _store_offers(commune, day, offers)
+    except LockTimeout:
+        logger.warning("Waitlist of %s %s is busy, checking it later", commune, day)
+        return
+
+    for start_minute, end_minute, chat_id in promoted:
+        _notify(commune, day, start_minute, end_minute, chat_id)
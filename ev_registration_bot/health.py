@@ -0,0 +1,178 @@
+"""``/healthz`` and ``/readyz`` on the metrics server.
+
+Every check reads state the bot already keeps (loaded credentials, circuit
+breakers, the events mirror, the last Bot API call, a job queue heartbeat),
+so probes cost no outbound calls however often they come.
+
+``/healthz`` fails only when the process is stuck, so the orchestrator
+restarts it. ``/readyz`` fails when the bot can't take bookings; checks
+that only degrade service (Calendar down, stale mirror) are reported
+without failing it.
+"""
+
+import json
+import math
+import time
+from typing import Callable, NamedTuple
+
+from telegram.ext import ContextTypes, JobQueue
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.config import get_settings
+from ev_registration_bot.google_calendar_helper import events_cache
+from ev_registration_bot.google_calendar_helper.circuit_breaker import (
+    BreakerState,
+    get_breaker,
+)
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    token_result,
+)
+from ev_registration_bot.google_calendar_helper.schedule import get_bookable_days
+from ev_registration_bot.google_calendar_helper.utils import get_communes
+from ev_registration_bot.metrics import add_route
+from ev_registration_bot.telegram_request import bot_api_status
+
+OK = "ok"
+DEGRADED = "degraded"
+FAIL = "fail"
+
+
+class CheckResult(NamedTuple):
+    status: str
+    detail: str = ""
+
+
+_started_at = time.monotonic()
+_last_heartbeat: float | None = None
+
+
+async def heartbeat(context: ContextTypes.DEFAULT_TYPE) -> None:
+    global _last_heartbeat
+    _last_heartbeat = time.monotonic()
+
+
+def schedule_heartbeat(job_queue: JobQueue) -> None:
+    job_queue.run_repeating(
+        heartbeat,
+        interval=get_settings().health.heartbeat_seconds,
+        first=0,
+        name="health_heartbeat",
+    )
+
+
+def check_job_queue() -> CheckResult:
+    health = get_settings().health
+    if _last_heartbeat is None:
+        if time.monotonic() - _started_at > health.max_job_lag_seconds:
+            return CheckResult(FAIL, "job queue never ran")
+        return CheckResult(DEGRADED, "starting")
+    lag = time.monotonic() - _last_heartbeat - health.heartbeat_seconds
+    if lag > health.max_job_lag_seconds:
+        return CheckResult(FAIL, f"lagging {lag:.0f}s")
+    return CheckResult(OK, f"lag {max(lag, 0):.1f}s")
+
+
+def check_tokens() -> CheckResult:
+    errors = []
+    not_loaded = []
+    expiries = []
+    now = time.time()
+    for commune in get_communes():
+        result = token_result(commune)
+        if result is None:
+            not_loaded.append(commune.name)
+        elif result.error is not None:
+            errors.append(f"{commune.name}: {result.error}")
+        elif result.expires_at is not None:
+            # An expired token is refreshed by the next Calendar call
+            expiries.append(
+                f"{commune.name} expires in {result.expires_at - now:.0f}s"
+                if result.expires_at > now
+                else f"{commune.name} expired"
+            )
+    if errors:
+        return CheckResult(FAIL, "; ".join(errors))
+    if not_loaded:
+        # Unknown until Calendar is first called, e.g. by the prewarm
+        return CheckResult(DEGRADED, f"not loaded yet: {', '.join(not_loaded)}")
+    return CheckResult(OK, "; ".join(expiries))
+
+
+def check_circuit_breakers() -> CheckResult:
+    open_communes = [
+        commune.name
+        for commune in get_communes()
+        if get_breaker(commune).state != BreakerState.CLOSED
+    ]
+    if open_communes:
+        return CheckResult(
+            DEGRADED, f"Calendar unavailable for {', '.join(open_communes)}"
+        )
+    return CheckResult(OK)
+
+
+def check_mirror() -> CheckResult:
+    cache_settings = get_settings().availability_cache
+    if not cache_settings.prewarm_enabled:
+        return CheckResult(OK, "prewarm disabled")
+    stale_intervals = get_settings().health.mirror_stale_intervals
+    now = time_utils.now()
+    stale = []
+    for commune in get_communes():
+        for day in get_bookable_days(commune, now, cache_settings.horizon_days):
+            # Shared copies are only read for days this worker never fetched
+            age = events_cache.get_age(commune, day, math.inf)
+            limit = stale_intervals * events_cache.refresh_interval(day, now.date())
+            if age is None or age > limit:
+                stale.append(f"{commune.name} {day.isoformat()}")
+    if stale:
+        return CheckResult(DEGRADED, f"stale: {', '.join(stale)}")
+    return CheckResult(OK)
+
+
+def check_bot_api() -> CheckResult:
+    status = bot_api_status()
+    if status.failed_at is None or (
+        status.reached_at is not None and status.reached_at > status.failed_at
+    ):
+        return CheckResult(OK)
+    unreachable_for = time.monotonic() - (status.reached_at or _started_at)
+    if unreachable_for > get_settings().health.bot_api_grace_seconds:
+        return CheckResult(FAIL, f"unreachable for {unreachable_for:.0f}s")
+    return CheckResult(DEGRADED, "last call failed")
+
+
+_LIVENESS_CHECKS: dict[str, Callable[[], CheckResult]] = {
+    "job_queue": check_job_queue,
+}
+_READINESS_CHECKS: dict[str, Callable[[], CheckResult]] = {
+    **_LIVENESS_CHECKS,
+    "tokens": check_tokens,
+    "circuit_breakers": check_circuit_breakers,
+    "mirror": check_mirror,
+    "bot_api": check_bot_api,
+}
+
+
+def _report(checks: dict[str, Callable[[], CheckResult]]) -> tuple[int, str, bytes]:
+    results = {}
+    for name, check in checks.items():
+        try:
+            results[name] = check()
+        except Exception as error:
+            results[name] = CheckResult(FAIL, f"check failed: {error}")
+    statuses = {result.status for result in results.values()}
+    status = FAIL if FAIL in statuses else DEGRADED if DEGRADED in statuses else OK
+    body = {
+        "status": status,
+        "checks": {name: result._asdict() for name, result in results.items()},
+    }
+    return (
+        503 if status == FAIL else 200,
+        "application/json",
+        json.dumps(body, ensure_ascii=False).encode(),
+    )
+
+
+add_route("/healthz", lambda: _report(_LIVENESS_CHECKS))
+add_route("/readyz", lambda: _report(_READINESS_CHECKS))
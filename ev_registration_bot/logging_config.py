@@ -0,0 +1,172 @@
+import atexit
+import contextlib
+import contextvars
+import datetime
+import enum
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+chat_id_var: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    "chat_id", default=None
+)
+booking_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "booking_id", default=None
+)
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+@contextlib.contextmanager
+def log_context(chat_id: int | None = None, booking_id: str | None = None):
+    """Attach correlation ids to every record logged inside the block."""
+    chat_token = chat_id_var.set(chat_id)
+    booking_token = booking_id_var.set(booking_id)
+    try:
+        yield
+    finally:
+        booking_id_var.reset(booking_token)
+        chat_id_var.reset(chat_token)
+
+
+class CorrelationFilter(logging.Filter):
+    """Stamp records with the correlation ids of the emitting context.
+
+    Runs in the caller's thread, before the record crosses the queue, because
+    that's the only place the ContextVars can be read.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.chat_id = chat_id_var.get()
+        record.booking_id = booking_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a configurable share of records per level; unlisted levels are kept."""
+
+    def __init__(self, rates: dict[int, float]):
+        super().__init__()
+        self._rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self._rates.get(record.levelno)
+        return rate is None or rate >= 1 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        chat_id = getattr(record, "chat_id", None)
+        if chat_id is not None:
+            entry["chat_id"] = chat_id
+        booking_id = getattr(record, "booking_id", None)
+        if booking_id is not None:
+            entry["booking_id"] = booking_id
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_IMMUTABLE_ARGS = (
+    str,
+    bytes,
+    int,
+    float,
+    bool,
+    type(None),
+    enum.Enum,
+    datetime.date,
+    datetime.time,
+    datetime.timedelta,
+)
+
+
+def _is_immutable(value: object) -> bool:
+    if isinstance(value, tuple):
+        return all(_is_immutable(item) for item in value)
+    return isinstance(value, _IMMUTABLE_ARGS)
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """Leave message formatting to the listener thread where it's safe.
+
+    The stock ``prepare`` formats every message in the caller's thread; the
+    queue never leaves the process, so records whose arguments can't change
+    are enqueued as they are. Any other argument (a dict, a list, a model)
+    could be mutated before the listener gets to it, so those records are
+    still formatted here.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if isinstance(args, dict):
+            args = tuple(args.values())
+        if args and not _is_immutable(args):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def parse_sample_rates(spec: str) -> dict[int, float]:
+    """Parse ``"DEBUG=0.01,INFO=0.5"`` into ``{logging.DEBUG: 0.01, ...}``."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        level, rate = item.split("=", 1)
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+def setup_logging(
+    level: str = "INFO",
+    json_format: bool = True,
+    sample_rates: dict[int, float] | None = None,
+) -> None:
+    """Configure the root logger once for the whole process.
+
+    Records pass the sampling and correlation filters in the emitting thread,
+    then a ``QueueListener`` thread formats and writes them, so the event loop
+    never waits on stderr.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    queue_handler = _LazyQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rates or {}))
+    queue_handler.addFilter(CorrelationFilter())
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if json_format:
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(
+            logging.Formatter(
+                "%(asctime)s - %(name)s - %(levelname)s - "
+                "[chat=%(chat_id)s booking=%(booking_id)s] %(message)s"
+            )
+        )
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # httpx logs every Bot API request at INFO, including each getUpdates poll
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, stream_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,345 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+_registry: list["_Metric"] = []
+
+
+def _escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: tuple[str, ...], labels: tuple[str, ...]) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape_label_value(value)}"'
+        for name, value in zip(labelnames, labels)
+    )
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonic counter, one value per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Gauge(_Metric):
+    """Gauge that is either set explicitly or read from a callback on scrape."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        callback: Callable[[], float] | None = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._callback = callback
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def samples(self) -> list[str]:
+        if self._callback is not None:
+            return [f"{self.name} {self._callback()}"]
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram. Observing is a bisect plus two additions."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._buckets = buckets
+        self._sum_index = len(buckets) + 1
+        # labels -> [count per bucket..., count for +Inf, sum]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (self._sum_index + 1)
+            series[index] += 1
+            series[self._sum_index] += value
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = [
+                (labels, series[: self._sum_index], series[self._sum_index])
+                for labels, series in self._values.items()
+            ]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self._buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(
+                    self.labelnames + ("le",), labels + (le,)
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            series_labels = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{series_labels} {total}")
+            lines.append(f"{self.name}_count{series_labels} {cumulative}")
+        return lines
+
+
+_active_conversations: set[int] = set()
+
+HANDLER_LATENCY = Histogram(
+    "ev_bot_handler_latency_seconds",
+    "Time spent in a conversation handler, by conversation state.",
+    ("state",),
+)
+CALENDAR_API_CALLS = Counter(
+    "ev_bot_calendar_api_calls_total",
+    "Google Calendar API calls by method, commune and outcome.",
+    ("method", "commune", "status"),
+)
+CALENDAR_API_LATENCY = Histogram(
+    "ev_bot_calendar_api_latency_seconds",
+    "Google Calendar API call latency by method and commune.",
+    ("method", "commune"),
+)
+CACHE_REQUESTS = Counter(
+    "ev_bot_cache_requests_total",
+    "Cache lookups by cache name and result (hit or miss).",
+    ("cache", "result"),
+)
+TOKEN_REFRESHES = Counter(
+    "ev_bot_token_refreshes_total",
+    "Google OAuth token refreshes by commune and outcome.",
+    ("commune", "result"),
+)
+TELEGRAM_RATE_LIMITED = Counter(
+    "ev_bot_telegram_rate_limited_total",
+    "Bot API requests rejected with 429 Too Many Requests.",
+)
+NOTIFICATIONS_SENT = Counter(
+    "ev_bot_notifications_total",
+    "Queued notifications by kind and outcome (sent, blocked or error).",
+    ("kind", "result"),
+)
+CIRCUIT_BREAKER_STATE = Gauge(
+    "ev_bot_calendar_circuit_state",
+    "Calendar circuit breaker state: 0 closed, 1 half-open, 2 open.",
+    ("commune",),
+)
+IN_FLIGHT_CONVERSATIONS = Gauge(
+    "ev_bot_in_flight_conversations",
+    "Chats currently inside the registration conversation.",
+    callback=lambda: len(_active_conversations),
+)
+SESSIONS = Gauge(
+    "ev_bot_sessions",
+    "Users with user_data held in memory.",
+)
+SESSION_BYTES = Gauge(
+    "ev_bot_session_bytes",
+    "Size of the user_data held in memory, as JSON, estimated at the last sweep.",
+)
+SESSIONS_EXPIRED = Counter(
+    "ev_bot_sessions_expired_total",
+    "Idle sessions whose user_data was dropped.",
+)
+
+
+def conversation_ended(chat_id: int) -> None:
+    _active_conversations.discard(chat_id)
+
+
+def render_metrics() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+class observe_calendar_call:
+    """Time a Calendar API call and count it by outcome.
+
+    Usage::
+
+        with observe_calendar_call("events.list", commune.name):
+            service.events().list(...).execute()
+    """
+
+    __slots__ = ("method", "commune", "started")
+
+    def __init__(self, method: str, commune: str):
+        self.method = method
+        self.commune = commune
+
+    def __enter__(self) -> "observe_calendar_call":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        CALENDAR_API_LATENCY.observe(
+            time.perf_counter() - self.started, self.method, self.commune
+        )
+        if exc is None:
+            status = "ok"
+        else:
+            status = str(getattr(getattr(exc, "resp", None), "status", "error"))
+        CALENDAR_API_CALLS.inc(self.method, self.commune, status)
+
+
+def instrumented(state: str):
+    """Record handler latency under ``state`` and track in-flight conversations.
+
+    A chat counts as in flight from the first handler that keeps the
+    conversation going until a handler returns ``ConversationHandler.END``.
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            started = time.perf_counter()
+            try:
+                result = await handler(update, context)
+            finally:
+                HANDLER_LATENCY.observe(time.perf_counter() - started, state)
+
+            chat = update.effective_chat
+            if chat is not None:
+                # ConversationHandler.END == -1
+                if result == -1:
+                    conversation_ended(chat.id)
+                else:
+                    _active_conversations.add(chat.id)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        route = _routes.get(self.path.split("?", 1)[0])
+        if route is None:
+            self.send_error(404)
+            return
+        status, content_type, body = route()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        # Scrapes happen every few seconds, keep them out of the bot log
+        pass
+
+
+def _metrics_route() -> tuple[int, str, bytes]:
+    return 200, "text/plain; version=0.0.4; charset=utf-8", render_metrics().encode()
+
+
+_routes: dict[str, Callable[[], tuple[int, str, bytes]]] = {
+    "/metrics": _metrics_route,
+}
+
+
+def add_route(path: str, route: Callable[[], tuple[int, str, bytes]]) -> None:
+    """Serve ``route()``'s (status, content type, body) at ``path``."""
+    _routes[path] = route
+
+
+def start_metrics_server(host: str, port: int) -> ThreadingHTTPServer:
+    """Serve ``/metrics`` from a daemon thread so scrapes never touch the event loop."""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    )
+    thread.start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,81 @@
+"""Parsing the buttons users answer with, and rendering their labels.
+
+Patterns are compiled once, fixed buttons are looked up in tables, and
+labels are cached per (start, end, places): the same few dozen slots are
+rendered and parsed again for every user who looks at a day.
+"""
+
+import datetime
+import functools
+import re
+from typing import NamedTuple
+
+from ev_registration_bot.google_calendar_helper.utils import VisitType
+
+_DATE_LABEL = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+_SLOT_LABEL = re.compile(r"(\d\d:\d\d)-(\d\d:\d\d)(?: \((\d+) мест\))?")
+
+VISIT_TYPE_LABELS = {
+    "Терапия (индивидуально, 1 час)": VisitType.THERAPY,
+    "Лекция (с другими гостями, 30 мин. или 1 час)": VisitType.LECTURE,
+}
+
+# Lecture duration buttons, in minutes
+DURATION_LABELS = {"30 минут": 30, "1 час": 60}
+
+YES_NO_LABELS = {"Да": True, "Нет": False}
+
+
+class SlotChoice(NamedTuple):
+    # HH:MM
+    start: str
+    end: str
+    # Places left, shown on lecture slots only
+    places: int | None
+
+    @property
+    def start_minute(self) -> int:
+        return int(self.start[:2]) * 60 + int(self.start[3:])
+
+    @property
+    def end_minute(self) -> int:
+        return int(self.end[:2]) * 60 + int(self.end[3:])
+
+
+@functools.lru_cache(maxsize=64)
+def format_date_label(day: datetime.date) -> str:
+    return f"{day.day}.{day.month:02d}.{day.year}"
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_date_label(text: str) -> datetime.date | None:
+    match = _DATE_LABEL.fullmatch(text)
+    if match is None:
+        return None
+    day, month, year = match.groups()
+    try:
+        return datetime.date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def clock_time(value: str) -> str:
+    """HH:MM of an ISO datetime like 2024-06-01T13:30:00+03:00."""
+    return value[11:16]
+
+
+@functools.lru_cache(maxsize=4096)
+def slot_label(start: str, end: str, places: int | None = None) -> str:
+    label = f"{clock_time(start)}-{clock_time(end)}"
+    if places is not None:
+        label = f"{label} ({places} мест)"
+    return label
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_slot_label(text: str) -> SlotChoice | None:
+    match = _SLOT_LABEL.fullmatch(text)
+    if match is None:
+        return None
+    start, end, places = match.groups()
+    return SlotChoice(start, end, int(places) if places is not None else None)
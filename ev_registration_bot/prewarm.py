@@ -0,0 +1,122 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from googleapiclient.errors import HttpError
+from telegram.ext import ContextTypes, JobQueue
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.config import get_settings
+from ev_registration_bot.google_calendar_helper import capacity_stats, events_cache
+from ev_registration_bot.google_calendar_helper.capacity_matrix import (
+    refresh_capacity,
+)
+from ev_registration_bot.google_calendar_helper.circuit_breaker import (
+    CircuitOpenError,
+    is_quota_error,
+)
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    fetch_events_for_day,
+)
+from ev_registration_bot.google_calendar_helper.schedule import get_bookable_days
+from ev_registration_bot.google_calendar_helper.utils import get_communes
+from ev_registration_bot.shared_state.backend import get_backend
+
+logger = logging.getLogger(__name__)
+
+
+_backoff_seconds: float = 0.0
+_paused_until: float = 0.0
+
+
+def _on_quota_error() -> None:
+    global _backoff_seconds, _paused_until
+    cache_settings = get_settings().availability_cache
+    _backoff_seconds = min(
+        cache_settings.max_backoff_seconds,
+        max(cache_settings.tick_seconds, _backoff_seconds * 2),
+    )
+    _paused_until = time.monotonic() + _backoff_seconds
+    logger.warning(
+        "Calendar quota exceeded, pausing pre-warm for %.0fs", _backoff_seconds
+    )
+
+
+def _on_success() -> None:
+    global _backoff_seconds
+    _backoff_seconds /= 2
+
+
+async def prewarm_availability(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Re-fetch every day of the booking horizon whose mirror is due a refresh.
+
+    Runs every few seconds but only calls Calendar for days older than their
+    refresh interval, so today and tomorrow are refreshed more often than
+    the rest of the horizon.
+    """
+    if time.monotonic() < _paused_until:
+        return
+
+    cache_settings = get_settings().availability_cache
+    backend = get_backend()
+    # One worker per tick warms the shared mirror; the lease just expires
+    if (
+        backend.shared
+        and backend.acquire("prewarm", cache_settings.tick_seconds) is None
+    ):
+        return
+
+    now = time_utils.now()
+    today = now.date()
+
+    for commune in get_communes():
+        for day in get_bookable_days(commune, now, cache_settings.horizon_days):
+            interval = events_cache.refresh_interval(day, today)
+            age = events_cache.get_age(commune, day, interval)
+            if age is not None and age < interval:
+                continue
+            try:
+                await asyncio.to_thread(fetch_events_for_day, day, commune)
+            except CircuitOpenError:
+                # The mirror keeps serving this commune until Calendar is back
+                break
+            except HttpError as error:
+                if is_quota_error(error):
+                    _on_quota_error()
+                    return
+                logger.error("Failed to pre-warm %s %s: %s", commune.name, day, error)
+            except Exception:
+                logger.exception("Failed to pre-warm %s %s", commune.name, day)
+            else:
+                _on_success()
+
+
+async def roll_horizon(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Forget yesterday at midnight and warm the day that just entered the horizon."""
+    today = time_utils.today()
+    events_cache.drop_days_before(today)
+    capacity_stats.drop_days_before(today)
+    await prewarm_availability(context)
+
+
+def schedule_prewarm(job_queue: JobQueue) -> None:
+    cache_settings = get_settings().availability_cache
+    job_queue.run_repeating(
+        prewarm_availability,
+        interval=cache_settings.tick_seconds,
+        first=0,
+        name="prewarm_availability",
+    )
+    # Every worker keeps its own matrices, built from the shared mirror
+    job_queue.run_repeating(
+        refresh_capacity,
+        interval=cache_settings.tick_seconds,
+        first=cache_settings.tick_seconds / 2,
+        name="refresh_capacity",
+    )
+    job_queue.run_daily(
+        roll_horizon,
+        time=datetime.time(0, 0, tzinfo=time_utils.MOSCOW_TZ),
+        name="roll_availability_horizon",
+    )
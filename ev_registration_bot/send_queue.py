@@ -0,0 +1,106 @@
+"""Notifications sent on the bot's own initiative, at a bounded rate.
+
+Anything may queue a message, from any thread; a repeating job sends at
+most NOTIFY_MESSAGES_PER_SECOND of them and backs off when Telegram answers
+429, so a burst of notifications can't get the bot rate limited.
+"""
+
+import collections
+import logging
+import time
+from typing import Callable, NamedTuple
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+from telegram.ext import ContextTypes, JobQueue
+
+from ev_registration_bot.config import get_settings
+from ev_registration_bot.metrics import NOTIFICATIONS_SENT, TELEGRAM_RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+
+class Notification(NamedTuple):
+    chat_id: int
+    text: str
+    # For metrics, e.g. "waitlist"
+    kind: str
+    # Called once Telegram took the message or the user turned out to have
+    # blocked the bot; the queue itself only lives in memory
+    on_sent: Callable[[], None] | None = None
+
+
+# deque appends and pops are thread-safe
+_queue: collections.deque[Notification] = collections.deque()
+_paused_until: float = 0.0
+
+
+def enqueue(
+    chat_id: int,
+    text: str,
+    kind: str,
+    on_sent: Callable[[], None] | None = None,
+) -> None:
+    _queue.append(Notification(chat_id, text, kind, on_sent))
+
+
+def _sent(notification: Notification) -> None:
+    if notification.on_sent is None:
+        return
+    try:
+        notification.on_sent()
+    except Exception:
+        logger.exception("Callback of notification to %s failed", notification.chat_id)
+
+
+def queued() -> int:
+    return len(_queue)
+
+
+async def drain_send_queue(context: ContextTypes.DEFAULT_TYPE) -> None:
+    global _paused_until
+    if time.monotonic() < _paused_until:
+        return
+
+    notification_settings = get_settings().notifications
+    budget = max(
+        1,
+        int(
+            notification_settings.messages_per_second
+            * notification_settings.tick_seconds
+        ),
+    )
+    for _ in range(budget):
+        try:
+            notification = _queue.popleft()
+        except IndexError:
+            return
+        try:
+            await context.bot.send_message(notification.chat_id, notification.text)
+        except RetryAfter as error:
+            TELEGRAM_RATE_LIMITED.inc()
+            _queue.appendleft(notification)
+            retry_after = error.retry_after
+            if isinstance(retry_after, (int, float)):
+                _paused_until = time.monotonic() + retry_after
+            else:
+                _paused_until = time.monotonic() + retry_after.total_seconds()
+            return
+        except Forbidden:
+            # The user blocked the bot; sending again wouldn't reach them either
+            NOTIFICATIONS_SENT.inc(notification.kind, "blocked")
+            _sent(notification)
+        except TelegramError:
+            logger.exception("Failed to notify chat %s", notification.chat_id)
+            NOTIFICATIONS_SENT.inc(notification.kind, "error")
+        else:
+            NOTIFICATIONS_SENT.inc(notification.kind, "sent")
+            _sent(notification)
+
+
+def schedule_send_queue(job_queue: JobQueue) -> None:
+    job_queue.run_repeating(
+        drain_send_queue,
+        interval=get_settings().notifications.tick_seconds,
+        first=0,
+        name="drain_send_queue",
+    )
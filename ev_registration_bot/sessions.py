@@ -0,0 +1,149 @@
+"""Expiry of the per-user state of idle users.
+
+PTB keeps ``user_data`` for every user who ever wrote to the bot, and the
+booking flow leaves ``message_ids``/``chat_id`` in it for prompts still on
+the user's screen. Every update marks its user as active; a sweep job
+drops the ``user_data`` of users idle for longer than the session timeout
+(which the conversations also use as their ``conversation_timeout``) and
+deletes their leftover messages a batch at a time.
+
+Users are kept oldest-first, so a sweep only looks at the users it
+expires.
+"""
+
+import json
+import logging
+import random
+from collections import OrderedDict, deque
+
+from telegram import Bot, Update
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.config import get_settings
+from ev_registration_bot.metrics import (
+    SESSION_BYTES,
+    SESSIONS,
+    SESSIONS_EXPIRED,
+    conversation_ended,
+)
+
+logger = logging.getLogger(__name__)
+
+# Telegram deletes at most 100 messages per deleteMessages call
+_DELETE_BATCH = 100
+
+# Sessions serialized per sweep to estimate the size of all of them
+_SIZE_SAMPLE = 200
+
+# User id -> when their last update arrived, least recently active first
+_last_seen: OrderedDict[int, float] = OrderedDict()
+# (chat id, message ids) of expired sessions, still to be deleted
+_cleanups: deque[tuple[int, list[int]]] = deque()
+
+
+def touch(user_id: int, now: float) -> None:
+    _last_seen[user_id] = now
+    _last_seen.move_to_end(user_id)
+
+
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user is not None:
+        touch(update.effective_user.id, time_utils.timestamp())
+
+
+def _drop_user_data(application: Application, user_id: int) -> None:
+    application.drop_user_data(user_id)
+    if application.persistence is None:
+        # drop_user_data also queues the id for the persistence, and without
+        # one that set is never drained (PTB 21.x, Application.drop_user_data)
+        application._user_ids_to_be_deleted_in_persistence.discard(user_id)
+
+
+def expire_idle(application: Application, now: float, idle_seconds: float) -> int:
+    """Drop the user_data of users idle for ``idle_seconds``; returns how many."""
+    expired = 0
+    while _last_seen:
+        user_id, last_seen = next(iter(_last_seen.items()))
+        if now - last_seen < idle_seconds:
+            break
+        del _last_seen[user_id]
+        user_data = application.user_data.get(user_id)
+        if user_data is None:
+            continue
+        chat_id = user_data.get("chat_id") or user_id
+        if user_data.get("message_ids"):
+            _cleanups.append((chat_id, list(user_data["message_ids"])))
+        _drop_user_data(application, user_id)
+        conversation_ended(chat_id)
+        expired += 1
+    return expired
+
+
+def session_sizes(application: Application, now: float) -> tuple[int, int]:
+    """(sessions, bytes as JSON) held in memory.
+
+    The size is extrapolated from at most _SIZE_SAMPLE random sessions, so
+    a sweep serializes the same amount however many users there are.
+    Users whose data was loaded from persistence but who haven't written
+    since are tracked from now on, so they expire too.
+    """
+    user_data = application.user_data
+    for user_id in user_data.keys() - _last_seen.keys():
+        touch(user_id, now)
+    if not user_data:
+        return 0, 0
+    sample = random.sample(list(user_data), min(len(user_data), _SIZE_SAMPLE))
+    size = sum(
+        len(json.dumps(user_data[user_id], ensure_ascii=False, default=str))
+        for user_id in sample
+    )
+    return len(user_data), size * len(user_data) // len(sample)
+
+
+async def delete_leftovers(bot: Bot, limit: int) -> None:
+    """Delete the leftover messages of up to ``limit`` expired sessions."""
+    for _ in range(min(limit, len(_cleanups))):
+        chat_id, message_ids = _cleanups.popleft()
+        for start in range(0, len(message_ids), _DELETE_BATCH):
+            try:
+                await bot.delete_messages(
+                    chat_id, message_ids[start : start + _DELETE_BATCH]
+                )
+            except RetryAfter:
+                _cleanups.appendleft((chat_id, message_ids[start:]))
+                return
+            except TelegramError as error:
+                # Messages older than 48 hours can no longer be deleted
+                logger.debug("Failed to delete messages in %s: %s", chat_id, error)
+
+
+async def sweep_sessions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    settings = get_settings().sessions
+    now = time_utils.timestamp()
+    # One sweep later than the conversation timeout, so the conversation has
+    # ended before its user_data goes
+    expired = expire_idle(
+        context.application,
+        now,
+        settings.idle_timeout_seconds + settings.sweep_seconds,
+    )
+    if expired:
+        SESSIONS_EXPIRED.inc(amount=expired)
+        logger.debug("Expired %d idle sessions", expired)
+    sessions, size = session_sizes(context.application, now)
+    SESSIONS.set(sessions)
+    SESSION_BYTES.set(size)
+    await delete_leftovers(context.bot, settings.max_cleanups_per_sweep)
+
+
+def add_session_handlers(application: Application) -> None:
+    # Group -1 runs before the conversations and doesn't stop them
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
+    application.job_queue.run_repeating(
+        sweep_sessions,
+        interval=get_settings().sessions.sweep_seconds,
+        first=get_settings().sessions.sweep_seconds,
+        name="sweep_sessions",
+    )
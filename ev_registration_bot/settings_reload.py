@@ -0,0 +1,55 @@
+import logging
+import os
+import signal
+
+from telegram.ext import ContextTypes, JobQueue
+
+from ev_registration_bot.config import ENV_FILE, get_settings, reload_settings
+
+logger = logging.getLogger(__name__)
+
+_reload_requested = False
+_env_file_mtime: int | None = None
+
+
+def _get_env_file_mtime() -> int | None:
+    try:
+        return os.stat(ENV_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _request_reload(signum, frame) -> None:
+    # Only flag it: the reload itself runs in the job, outside the signal handler
+    global _reload_requested
+    _reload_requested = True
+
+
+async def check_settings(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Reload the settings after SIGHUP or when the env file changed."""
+    global _reload_requested, _env_file_mtime
+    mtime = _get_env_file_mtime()
+    if not _reload_requested and mtime == _env_file_mtime:
+        return
+    _reload_requested = False
+    _env_file_mtime = mtime
+    reload_settings()
+
+
+def schedule_settings_reload(job_queue: JobQueue) -> None:
+    """Watch for settings changes.
+
+    Logging, metrics, tracing and the Bot API transport are set up once at
+    start-up and still need a restart; everything read through
+    get_settings() picks the new snapshot up on its next call.
+    """
+    global _env_file_mtime
+    _env_file_mtime = _get_env_file_mtime()
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, _request_reload)
+    job_queue.run_repeating(
+        check_settings,
+        interval=get_settings().hot_reload.watch_seconds,
+        first=get_settings().hot_reload.watch_seconds,
+        name="reload_settings",
+    )
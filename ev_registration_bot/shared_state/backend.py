@@ -0,0 +1,179 @@
+import contextlib
+import threading
+import time
+import uuid
+from typing import Iterator
+
+from ev_registration_bot.config import get_settings
+
+
+class LockTimeout(TimeoutError):
+    """A named lock could not be acquired in time."""
+
+
+class StateBackend:
+    """Key-value store, hashes and named locks shared by the bot's workers.
+
+    Values are bytes. Locks are leases: they expire after ``ttl`` seconds so
+    a crashed worker can't hold one forever, and are released with the token
+    they were acquired with, so a worker can't release someone else's lease.
+    """
+
+    # Whether other processes can see what this backend stores
+    shared = True
+
+    def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def hset(self, key: str, field: str, value: bytes) -> None:
+        raise NotImplementedError
+
+    def hget(self, key: str, field: str) -> bytes | None:
+        raise NotImplementedError
+
+    def hdel(self, key: str, field: str) -> None:
+        raise NotImplementedError
+
+    def hgetall(self, key: str) -> dict[str, bytes]:
+        raise NotImplementedError
+
+    def acquire(self, name: str, ttl: float) -> str | None:
+        """Take the lease ``name``; returns its token, or None if it is held."""
+        raise NotImplementedError
+
+    def release(self, name: str, token: str) -> None:
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def lock(
+        self, name: str, ttl: float | None = None, timeout: float | None = None
+    ) -> Iterator[None]:
+        """Hold the lease ``name`` for the duration of the block."""
+        state_settings = get_settings().state
+        ttl = ttl or state_settings.lock_ttl_seconds
+        deadline = time.monotonic() + (timeout or state_settings.lock_timeout_seconds)
+        delay = 0.005
+        while (token := self.acquire(name, ttl)) is None:
+            if time.monotonic() >= deadline:
+                raise LockTimeout(f"Could not acquire lock {name}")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        try:
+            yield
+        finally:
+            self.release(name, token)
+
+
+class MemoryBackend(StateBackend):
+    """Single-process backend: plain dicts and thread locks."""
+
+    shared = False
+
+    def __init__(self):
+        self._values: dict[str, tuple[bytes, float | None]] = {}
+        self._hashes: dict[str, dict[str, bytes]] = {}
+        self._leases: dict[str, tuple[str, float]] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._values.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        self._values[key] = (value, expires_at)
+
+    def delete(self, key: str) -> None:
+        self._values.pop(key, None)
+        self._hashes.pop(key, None)
+
+    def hset(self, key: str, field: str, value: bytes) -> None:
+        with self._lock:
+            self._hashes.setdefault(key, {})[field] = value
+
+    def hget(self, key: str, field: str) -> bytes | None:
+        return self._hashes.get(key, {}).get(field)
+
+    def hdel(self, key: str, field: str) -> None:
+        with self._lock:
+            fields = self._hashes.get(key)
+            if fields is not None:
+                fields.pop(field, None)
+                if not fields:
+                    del self._hashes[key]
+
+    def hgetall(self, key: str) -> dict[str, bytes]:
+        with self._lock:
+            return dict(self._hashes.get(key, {}))
+
+    def acquire(self, name: str, ttl: float) -> str | None:
+        now = time.monotonic()
+        with self._lock:
+            lease = self._leases.get(name)
+            if lease is not None and lease[1] > now:
+                return None
+            token = uuid.uuid4().hex
+            self._leases[name] = (token, now + ttl)
+            return token
+
+    def release(self, name: str, token: str) -> None:
+        with self._lock:
+            lease = self._leases.get(name)
+            if lease is not None and lease[0] == token:
+                del self._leases[name]
+
+    @contextlib.contextmanager
+    def lock(
+        self, name: str, ttl: float | None = None, timeout: float | None = None
+    ) -> Iterator[None]:
+        # No other process to race with: a blocking thread lock is enough
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        if not lock.acquire(
+            timeout=timeout or get_settings().state.lock_timeout_seconds
+        ):
+            raise LockTimeout(f"Could not acquire lock {name}")
+        try:
+            yield
+        finally:
+            lock.release()
+
+
+_backend: StateBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> StateBackend:
+    """The backend chosen by STATE_BACKEND, created on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _make_backend()
+    return _backend
+
+
+def _make_backend() -> StateBackend:
+    state_settings = get_settings().state
+    if state_settings.backend == "sqlite":
+        from ev_registration_bot.shared_state.sqlite_backend import SQLiteBackend
+
+        return SQLiteBackend(state_settings.sqlite_path)
+    if state_settings.backend == "resp":
+        from ev_registration_bot.shared_state.resp_backend import RespBackend
+
+        return RespBackend(state_settings.resp_url)
+    return MemoryBackend()
@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from ev_registration_bot.shared_state.backend import StateBackend
+
+_USER_DATA_KEY = "ptb:user_data"
+
+
+def _conversations_key(name: str) -> str:
+    return f"ptb:conversations:{name}"
+
+
+class BackendPersistence(BasePersistence[dict, dict, dict]):
+    """Keeps user data and conversation states in a StateBackend.
+
+    Data is loaded when the application starts and written back every
+    ``update_interval`` seconds. Workers don't re-read each other's writes
+    between updates: the webhook router sends every update of a chat to the
+    same worker, and the backend lets another worker pick the chat up where
+    it was left after a restart or a change in the number of workers.
+    Everything stored must be JSON serializable.
+    """
+
+    def __init__(self, backend: StateBackend, update_interval: float = 5):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.backend = backend
+
+    async def get_user_data(self) -> dict[int, dict]:
+        stored = await asyncio.to_thread(self.backend.hgetall, _USER_DATA_KEY)
+        return {int(user_id): json.loads(data) for user_id, data in stored.items()}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await asyncio.to_thread(
+            self.backend.hset,
+            _USER_DATA_KEY,
+            str(user_id),
+            json.dumps(data, ensure_ascii=False).encode(),
+        )
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await asyncio.to_thread(self.backend.hdel, _USER_DATA_KEY, str(user_id))
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def get_conversations(self, name: str) -> dict[tuple, object]:
+        stored = await asyncio.to_thread(self.backend.hgetall, _conversations_key(name))
+        return {
+            tuple(json.loads(key)): json.loads(state) for key, state in stored.items()
+        }
+
+    async def update_conversation(
+        self, name: str, key: tuple[int | str, ...], new_state: object | None
+    ) -> None:
+        field = json.dumps(list(key))
+        if new_state is None:
+            await asyncio.to_thread(self.backend.hdel, _conversations_key(name), field)
+        else:
+            await asyncio.to_thread(
+                self.backend.hset,
+                _conversations_key(name),
+                field,
+                json.dumps(new_state).encode(),
+            )
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
@@ -0,0 +1,161 @@
+import socket
+import threading
+import uuid
+from urllib.parse import urlparse
+
+from ev_registration_bot.shared_state.backend import StateBackend
+
+
+class RespError(Exception):
+    """Error reply from the server."""
+
+
+def encode_command(*args: bytes | str | int | float) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def read_reply(stream):
+    """Read one RESP2 reply from a buffered binary stream."""
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode()
+    if kind == b"-":
+        raise RespError(payload.decode())
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length == -1:
+            return None
+        data = stream.read(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(payload)
+        if length == -1:
+            return None
+        return [read_reply(stream) for _ in range(length)]
+    raise RespError(f"Unexpected reply {line!r}")
+
+
+class RespBackend(StateBackend):
+    """Backend on a Redis-protocol server, for workers on several hosts.
+
+    Uses one connection guarded by a lock: commands are short, and it lets
+    the WATCH/MULTI/EXEC release of a lease run without interleaving.
+    """
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self._address = (parsed.hostname or "127.0.0.1", parsed.port or 6379)
+        self._password = parsed.password
+        self._db = int(parsed.path.lstrip("/") or 0)
+        self._socket: socket.socket | None = None
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> None:
+        self._socket = socket.create_connection(self._address, timeout=5)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._stream = self._socket.makefile("rb")
+        if self._password:
+            self._call("AUTH", self._password)
+        if self._db:
+            self._call("SELECT", self._db)
+
+    def _close(self) -> None:
+        if self._socket is not None:
+            self._socket.close()
+        self._socket = self._stream = None
+
+    def _call(self, *args):
+        self._socket.sendall(encode_command(*args))
+        return read_reply(self._stream)
+
+    def execute(self, *args, retry: bool = True):
+        """Run one command.
+
+        A dropped connection is reopened and the command sent again once, as
+        the server may have closed an idle connection. Pass ``retry=False``
+        for commands that must not run twice: the first one may have been
+        applied before the connection dropped.
+        """
+        with self._lock:
+            if self._socket is None:
+                self._connect()
+            try:
+                return self._call(*args)
+            except (OSError, ConnectionError):
+                self._close()
+                if not retry:
+                    raise
+                self._connect()
+                return self._call(*args)
+
+    def get(self, key: str) -> bytes | None:
+        return self.execute("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        if ttl is None:
+            self.execute("SET", key, value)
+        else:
+            self.execute("SET", key, value, "PX", max(1, int(ttl * 1000)))
+
+    def delete(self, key: str) -> None:
+        self.execute("DEL", key)
+
+    def hset(self, key: str, field: str, value: bytes) -> None:
+        self.execute("HSET", key, field, value)
+
+    def hget(self, key: str, field: str) -> bytes | None:
+        return self.execute("HGET", key, field)
+
+    def hdel(self, key: str, field: str) -> None:
+        self.execute("HDEL", key, field)
+
+    def hgetall(self, key: str) -> dict[str, bytes]:
+        reply = self.execute("HGETALL", key) or []
+        return {reply[i].decode(): reply[i + 1] for i in range(0, len(reply), 2)}
+
+    def acquire(self, name: str, ttl: float) -> str | None:
+        key = f"lease:{name}"
+        token = uuid.uuid4().hex
+        try:
+            reply = self.execute(
+                "SET", key, token, "NX", "PX", max(1, int(ttl * 1000)), retry=False
+            )
+        except (OSError, ConnectionError):
+            # Sent again, a SET NX that did land would find its own lease
+            # taken; the lease is ours exactly if it holds our token
+            return token if self.execute("GET", key) == token.encode() else None
+        return token if reply == "OK" else None
+
+    def _release(self, key: str, token: str) -> None:
+        if self._socket is None:
+            self._connect()
+        # Delete only our own lease; EXEC aborts if it changed meanwhile
+        self._call("WATCH", key)
+        if self._call("GET", key) != token.encode():
+            self._call("UNWATCH")
+            return
+        self._call("MULTI")
+        self._call("DEL", key)
+        self._call("EXEC")
+
+    def release(self, name: str, token: str) -> None:
+        key = f"lease:{name}"
+        with self._lock:
+            try:
+                self._release(key, token)
+            except (OSError, ConnectionError):
+                # Closing drops the server's WATCH/MULTI state; checking the
+                # token again makes the retry safe whether or not DEL ran
+                self._close()
+                self._release(key, token)
@@ -0,0 +1,181 @@
+"""In-process stand-in for a Redis server, for running several workers locally.
+
+Speaks enough of RESP2 for RespBackend: PING, AUTH, SELECT, GET, SET (NX, PX,
+EX), DEL, HSET, HGET, HDEL, HGETALL, WATCH, UNWATCH, MULTI, EXEC, DISCARD.
+Everything runs under one lock, so each command is atomic like on Redis.
+
+    python -m ev_registration_bot.shared_state.resp_standin --port 6379
+"""
+
+import argparse
+import socketserver
+import threading
+import time
+
+from ev_registration_bot.shared_state.resp_backend import RespError, read_reply
+
+
+def _encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, RespError):
+        return b"-%s\r\n" % str(value).encode()
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_encode(item) for item in value)
+    raise TypeError(value)
+
+
+class _Store:
+    def __init__(self):
+        self.values: dict[bytes, bytes | dict[bytes, bytes]] = {}
+        self.expires_at: dict[bytes, float] = {}
+        # Bumped on every write, so WATCH can tell whether a key changed
+        self.versions: dict[bytes, int] = {}
+        self.lock = threading.Lock()
+
+    def _touch(self, key: bytes) -> None:
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _live(self, key: bytes):
+        expires_at = self.expires_at.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.expires_at[key]
+            del self.values[key]
+            self._touch(key)
+        return self.values.get(key)
+
+    def version(self, key: bytes) -> int:
+        self._live(key)
+        return self.versions.get(key, 0)
+
+    def run(self, command: list[bytes]):
+        name, args = command[0].upper(), command[1:]
+        if name == b"GET":
+            value = self._live(args[0])
+            if isinstance(value, dict):
+                return RespError("WRONGTYPE")
+            return value
+        if name == b"SET":
+            key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+            if b"NX" in options and self._live(key) is not None:
+                return None
+            self.values[key] = value
+            self.expires_at.pop(key, None)
+            for unit, scale in ((b"PX", 0.001), (b"EX", 1)):
+                if unit in options:
+                    ttl = int(args[2 + options.index(unit) + 1]) * scale
+                    self.expires_at[key] = time.monotonic() + ttl
+            self._touch(key)
+            return "OK"
+        if name == b"DEL":
+            removed = 0
+            for key in args:
+                if self._live(key) is not None:
+                    del self.values[key]
+                    self.expires_at.pop(key, None)
+                    self._touch(key)
+                    removed += 1
+            return removed
+        if name in (b"HSET", b"HGET", b"HDEL", b"HGETALL"):
+            fields = self._live(args[0])
+            if fields is not None and not isinstance(fields, dict):
+                return RespError("WRONGTYPE")
+            if name == b"HGET":
+                return (fields or {}).get(args[1])
+            if name == b"HGETALL":
+                return [item for pair in (fields or {}).items() for item in pair]
+            if name == b"HSET":
+                fields = self.values.setdefault(args[0], {})
+                added = 0
+                for i in range(1, len(args), 2):
+                    added += args[i] not in fields
+                    fields[args[i]] = args[i + 1]
+                self._touch(args[0])
+                return added
+            removed = 0
+            for field in args[1:]:
+                if fields and field in fields:
+                    del fields[field]
+                    removed += 1
+            if fields is not None and not fields:
+                del self.values[args[0]]
+            self._touch(args[0])
+            return removed
+        if name == b"PING":
+            return "PONG"
+        if name in (b"AUTH", b"SELECT"):
+            return "OK"
+        return RespError(f"ERR unknown command '{name.decode()}'")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        store: _Store = self.server.store
+        watched: dict[bytes, int] = {}
+        queued: list[list[bytes]] | None = None
+        while True:
+            try:
+                command = read_reply(self.rfile)
+            except (ConnectionError, OSError):
+                return
+            name = command[0].upper()
+            with store.lock:
+                if name == b"WATCH":
+                    for key in command[1:]:
+                        watched[key] = store.version(key)
+                    reply = "OK"
+                elif name == b"UNWATCH":
+                    watched.clear()
+                    reply = "OK"
+                elif name == b"MULTI":
+                    queued = []
+                    reply = "OK"
+                elif name == b"DISCARD":
+                    queued = None
+                    watched.clear()
+                    reply = "OK"
+                elif name == b"EXEC":
+                    if any(store.version(k) != v for k, v in watched.items()):
+                        reply = None
+                    else:
+                        reply = [store.run(queued_command) for queued_command in queued]
+                    queued = None
+                    watched.clear()
+                elif queued is not None:
+                    queued.append(command)
+                    reply = "QUEUED"
+                else:
+                    reply = store.run(command)
+            self.wfile.write(_encode(reply))
+
+
+class RespStandinServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str, port: int):
+        super().__init__((host, port), _Handler)
+        self.store = _Store()
+
+
+def start_standin(host: str = "127.0.0.1", port: int = 0) -> RespStandinServer:
+    """Serve in a daemon thread; ``port=0`` picks a free port."""
+    server = RespStandinServer(host, port)
+    threading.Thread(
+        target=server.serve_forever, name="resp-standin", daemon=True
+    ).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    RespStandinServer(args.host, args.port).serve_forever()
@@ -0,0 +1,111 @@
+import sqlite3
+import threading
+import time
+import uuid
+
+from ev_registration_bot.shared_state.backend import StateBackend
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires_at REAL
+);
+CREATE TABLE IF NOT EXISTS hashes (
+    key TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (key, field)
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SQLiteBackend(StateBackend):
+    """Backend for several workers on one host, sharing one SQLite file.
+
+    Expiry uses wall-clock time, which every process on the host agrees on.
+    """
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=10
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def _execute(self, sql: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection.execute(sql, parameters)
+
+    def get(self, key: str) -> bytes | None:
+        row = self._execute(
+            "SELECT value FROM kv WHERE key = ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        expires_at = None if ttl is None else time.time() + ttl
+        self._execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, expires_at),
+        )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM kv WHERE key = ?", (key,))
+            self._connection.execute("DELETE FROM hashes WHERE key = ?", (key,))
+
+    def hset(self, key: str, field: str, value: bytes) -> None:
+        self._execute(
+            "INSERT OR REPLACE INTO hashes (key, field, value) VALUES (?, ?, ?)",
+            (key, field, value),
+        )
+
+    def hget(self, key: str, field: str) -> bytes | None:
+        row = self._execute(
+            "SELECT value FROM hashes WHERE key = ? AND field = ?", (key, field)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def hdel(self, key: str, field: str) -> None:
+        self._execute("DELETE FROM hashes WHERE key = ? AND field = ?", (key, field))
+
+    def hgetall(self, key: str) -> dict[str, bytes]:
+        rows = self._execute(
+            "SELECT field, value FROM hashes WHERE key = ?", (key,)
+        ).fetchall()
+        return dict(rows)
+
+    def acquire(self, name: str, ttl: float) -> str | None:
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two processes can't
+            # both see the lease as free
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "DELETE FROM leases WHERE name = ? AND expires_at <= ?",
+                    (name, now),
+                )
+                cursor = self._connection.execute(
+                    "INSERT OR IGNORE INTO leases (name, token, expires_at) "
+                    "VALUES (?, ?, ?)",
+                    (name, token, now + ttl),
+                )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return token if cursor.rowcount == 1 else None
+
+    def release(self, name: str, token: str) -> None:
+        self._execute("DELETE FROM leases WHERE name = ? AND token = ?", (name, token))
@@ -0,0 +1,58 @@
+import time
+from typing import NamedTuple
+
+from telegram.error import NetworkError
+from telegram.request import HTTPXRequest
+
+from ev_registration_bot.config import TransportSettings
+from ev_registration_bot.tracing import get_current_span, start_span
+
+
+class BotApiStatus(NamedTuple):
+    # time.monotonic() of the last call that got a response, and of the last
+    # one that didn't; None until the first such call
+    reached_at: float | None
+    failed_at: float | None
+
+
+_status = BotApiStatus(None, None)
+
+
+def bot_api_status() -> BotApiStatus:
+    return _status
+
+
+class TracedHTTPXRequest(HTTPXRequest):
+    """HTTPX transport that records a span for every Bot API call made from a handler.
+
+    Calls made outside of a traced handler (e.g. ``getUpdates`` polling) are
+    passed through untouched so they don't start traces of their own.
+    """
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        global _status
+        try:
+            if get_current_span() is None:
+                result = await super().do_request(url, method, *args, **kwargs)
+            else:
+                with start_span(f"telegram.{url.rsplit('/', 1)[-1]}"):
+                    result = await super().do_request(url, method, *args, **kwargs)
+        except NetworkError:
+            _status = _status._replace(failed_at=time.monotonic())
+            raise
+        _status = _status._replace(reached_at=time.monotonic())
+        return result
+
+
+def make_request(
+    transport: TransportSettings, connection_pool_size: int
+) -> TracedHTTPXRequest:
+    """Bot API transport with the configured timeouts and HTTP version."""
+    return TracedHTTPXRequest(
+        connection_pool_size=connection_pool_size,
+        connect_timeout=transport.telegram_connect_timeout,
+        read_timeout=transport.telegram_read_timeout,
+        write_timeout=transport.telegram_write_timeout,
+        pool_timeout=transport.telegram_pool_timeout,
+        http_version="2" if transport.telegram_http2 else "1.1",
+    )
@@ -0,0 +1,67 @@
+"""Moscow wall-clock time, read through a clock that can be swapped out.
+
+Times of day are whole minutes since local midnight, so slots and cut-offs
+compare as ints. Moscow has kept UTC+3 without DST since 2014, but the
+offset of a date is still looked up in zoneinfo, once per date; ISO times
+of a day's slots are then glued together without localizing each one.
+"""
+
+import datetime
+import functools
+import time
+from typing import Callable
+from zoneinfo import ZoneInfo
+
+MOSCOW_TZ = ZoneInfo("Europe/Moscow")
+
+MINUTES_PER_DAY = 24 * 60
+
+_clock: Callable[[], float] = time.time
+
+
+def set_clock(clock: Callable[[], float] | None) -> None:
+    """Read the time from ``clock`` (seconds since the epoch); None restores time.time."""
+    global _clock
+    _clock = clock or time.time
+
+
+def timestamp() -> float:
+    """Seconds since the epoch, from the current clock."""
+    return _clock()
+
+
+def now() -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(_clock(), MOSCOW_TZ)
+
+
+def today() -> datetime.date:
+    return now().date()
+
+
+def minutes(value: datetime.time) -> int:
+    """Minutes since midnight of a wall-clock time; seconds are dropped."""
+    return value.hour * 60 + value.minute
+
+
+def local_midnight(day: datetime.date) -> datetime.datetime:
+    return datetime.datetime(day.year, day.month, day.day, tzinfo=MOSCOW_TZ)
+
+
+@functools.lru_cache(maxsize=64)
+def utc_offset(day: datetime.date) -> str:
+    """UTC offset of ``day`` as ISO strings end with it, e.g. "+03:00"."""
+    return local_midnight(day).isoformat()[19:]
+
+
+def at_minute(day: datetime.date, minute: int) -> datetime.datetime:
+    return local_midnight(day) + datetime.timedelta(minutes=minute)
+
+
+def iso_at(day: datetime.date, minute: int) -> str:
+    """ISO time of ``minute`` on ``day``, e.g. 2024-06-01T13:30:00+03:00."""
+    return f"{day.isoformat()}T{minute // 60:02d}:{minute % 60:02d}:00{utc_offset(day)}"
+
+
+def iso_minute(value: str) -> int:
+    """Minute of day of an ISO time in local time, as the bot writes them."""
+    return int(value[11:13]) * 60 + int(value[14:16])
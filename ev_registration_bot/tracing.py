@@ -0,0 +1,301 @@
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from typing import Any, Callable, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+_sample_ratio: float = 0.0
+_exporter: "SpanExporter | None" = None
+
+
+class SpanContext(NamedTuple):
+    """What a span's children need from it, kept after the span has ended."""
+
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+
+class Span:
+    """A single timed operation. Sampled-out spans are never exported."""
+
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "name",
+        "attributes",
+        "sampled",
+        "start_ns",
+        "end_ns",
+        "error",
+        "_token",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        parent: "Span | SpanContext | None",
+        attributes: dict[str, Any],
+    ):
+        if parent is None:
+            self.trace_id = os.urandom(16).hex()
+            self.parent_id = ""
+            self.sampled = _exporter is not None and random.random() < _sample_ratio
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.sampled = parent.sampled
+        self.span_id = os.urandom(8).hex() if self.sampled else ""
+        self.name = name
+        self.attributes = attributes
+        self.error: str | None = None
+        self.end_ns = 0
+
+    def context(self) -> SpanContext:
+        return SpanContext(self.trace_id, self.span_id, self.sampled)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if self.sampled and value is not None:
+            self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current_span.reset(self._token)
+        if not self.sampled:
+            return
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        if _exporter is not None:
+            _exporter.submit(self)
+
+
+def start_span(name: str, **attributes: Any) -> Span:
+    """Open a span as a child of the span active in the current context.
+
+    Use as a context manager. Works across ``await`` because the active span
+    lives in a ``ContextVar``.
+    """
+    return Span(name, _current_span.get(), attributes)
+
+
+def continue_trace(parent: SpanContext | None, name: str, **attributes: Any) -> Span:
+    """Open a span under ``parent``, which may have ended in an earlier update.
+
+    Starts a new trace when ``parent`` is None. Lets the handlers of one
+    booking, each run for a separate update, share a single trace.
+    """
+    return Span(name, parent, attributes)
+
+
+def get_current_span() -> Span | None:
+    return _current_span.get()
+
+
+def set_span_attribute(key: str, value: Any) -> None:
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+def traced(
+    name: str,
+    attributes: Callable[[], dict[str, Any]] | None = None,
+):
+    """Wrap a sync or async function in a span.
+
+    ``attributes`` is called after the function returns, so it can report
+    values the function itself has just set (e.g. the chosen commune).
+    """
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with start_span(name) as span:
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        if attributes is not None and span.sampled:
+                            for key, value in attributes().items():
+                                span.set_attribute(key, value)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with start_span(name) as span:
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    if attributes is not None and span.sampled:
+                        for key, value in attributes().items():
+                            span.set_attribute(key, value)
+
+        return wrapper
+
+    return decorator
+
+
+def _otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span: Span) -> dict[str, Any]:
+    encoded: dict[str, Any] = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        # SPAN_KIND_INTERNAL
+        "kind": 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [
+            {"key": key, "value": _otlp_value(value)}
+            for key, value in span.attributes.items()
+        ],
+        # STATUS_CODE_OK / STATUS_CODE_ERROR
+        "status": (
+            {"code": 1} if span.error is None else {"code": 2, "message": span.error}
+        ),
+    }
+    if span.parent_id:
+        encoded["parentSpanId"] = span.parent_id
+    return encoded
+
+
+class SpanExporter:
+    """Batch finished spans on a background thread and export them as OTLP/JSON.
+
+    Each batch is appended as one line to ``file_path`` (the format the
+    OpenTelemetry collector ``file`` receiver reads) and/or POSTed to an
+    OTLP/HTTP ``collector_url`` such as ``http://127.0.0.1:4318/v1/traces``.
+    """
+
+    def __init__(
+        self,
+        service_name: str,
+        file_path: str | None = None,
+        collector_url: str | None = None,
+        batch_size: int = 256,
+        flush_interval: float = 2.0,
+    ):
+        self._resource = {
+            "attributes": [
+                {"key": "service.name", "value": {"stringValue": service_name}}
+            ]
+        }
+        self._file_path = file_path
+        self._collector_url = collector_url
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue: queue.SimpleQueue[Span | None] = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._run, name="span-exporter", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, span: Span) -> None:
+        self._queue.put(span)
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        batch: list[Span] = []
+        deadline = time.monotonic() + self._flush_interval
+        while True:
+            try:
+                span = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                pass
+            else:
+                if span is None:
+                    self._export(batch)
+                    return
+                batch.append(span)
+            if len(batch) >= self._batch_size or time.monotonic() >= deadline:
+                self._export(batch)
+                batch = []
+                deadline = time.monotonic() + self._flush_interval
+
+    def _export(self, batch: list[Span]) -> None:
+        if not batch:
+            return
+        payload = json.dumps(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": self._resource,
+                        "scopeSpans": [
+                            {
+                                "scope": {"name": "ev_registration_bot"},
+                                "spans": [_otlp_span(span) for span in batch],
+                            }
+                        ],
+                    }
+                ]
+            },
+            ensure_ascii=False,
+        )
+        try:
+            if self._file_path:
+                with open(self._file_path, "a", encoding="utf-8") as f:
+                    f.write(payload + "\n")
+            if self._collector_url:
+                request = urllib.request.Request(
+                    self._collector_url,
+                    data=payload.encode(),
+                    headers={"Content-Type": "application/json"},
+                    method="POST",
+                )
+                urllib.request.urlopen(request, timeout=5).close()
+        except Exception:
+            logger.exception("Failed to export %d spans", len(batch))
+
+
+def configure_tracing(
+    sample_ratio: float,
+    service_name: str,
+    file_path: str | None = None,
+    collector_url: str | None = None,
+) -> None:
+    """Start exporting a ``sample_ratio`` share of traces.
+
+    The decision is made once per root span and inherited by its children,
+    so a sampled booking is always exported in full.
+    """
+    global _exporter, _sample_ratio
+    if _exporter is not None:
+        _exporter.shutdown()
+    _sample_ratio = sample_ratio
+    _exporter = SpanExporter(service_name, file_path, collector_url)
+    atexit.register(_exporter.shutdown)
+    logger.info("Tracing enabled, sampling %.0f%% of traces", sample_ratio * 100)
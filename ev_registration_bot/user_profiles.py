@@ -0,0 +1,74 @@
+"""Details of a user's last booking, so it can be repeated in one tap.
+
+Profiles live in the state backend when it is shared. The memory backend
+would forget them on every restart, so with it they go to a SQLite file
+of their own instead, like the outbox and the reminders.
+"""
+
+import json
+import re
+import threading
+from typing import NamedTuple
+
+from ev_registration_bot.config import get_settings
+from ev_registration_bot.shared_state.backend import StateBackend, get_backend
+from ev_registration_bot.shared_state.sqlite_backend import SQLiteBackend
+
+# Profiles of users who stop booking are forgotten after a year
+_PROFILE_TTL_SECONDS = 365 * 24 * 60 * 60
+
+PHONE_REGEX = re.compile(
+    r"^(\+7|8)(\s|-)?(\()?[0-9]{3}(\))?(\s|-)?([0-9]{3})(\s|-)?([0-9]{2})(\s|-)?([0-9]{2})$"
+)
+
+
+class UserProfile(NamedTuple):
+    # Commune id, see get_commune
+    commune: str
+    # VisitType value
+    visit_type: str
+    children_amount: int
+    registration_name: str
+    registration_amount: int
+    # Matches PHONE_REGEX
+    phone: str
+
+
+_file_backend: SQLiteBackend | None = None
+_file_backend_lock = threading.Lock()
+
+
+def _backend() -> StateBackend:
+    global _file_backend
+    backend = get_backend()
+    if backend.shared:
+        return backend
+    with _file_backend_lock:
+        if _file_backend is None:
+            _file_backend = SQLiteBackend(get_settings().profiles.path)
+    return _file_backend
+
+
+def _key(user_id: int) -> str:
+    return f"profile:{user_id}"
+
+
+def save(user_id: int, profile: UserProfile) -> None:
+    _backend().set(
+        _key(user_id),
+        json.dumps(profile, ensure_ascii=False, separators=(",", ":")).encode(),
+        _PROFILE_TTL_SECONDS,
+    )
+
+
+def load(user_id: int) -> UserProfile | None:
+    data = _backend().get(_key(user_id))
+    if data is None:
+        return None
+    try:
+        profile = UserProfile(*json.loads(data))
+    except (TypeError, ValueError):
+        return None
+    if not PHONE_REGEX.match(profile.phone):
+        return None
+    return profile
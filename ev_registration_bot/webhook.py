@@ -0,0 +1,225 @@
+"""Webhook mode: one router in front of several bot workers.
+
+The router receives Telegram's webhook calls and forwards each update to the
+worker owning its chat (``chat_id % number of workers``). Each worker gets
+its updates through one queue, in the order they arrived, and processes them
+one at a time, so the updates of a chat are handled in order.
+
+    python -m ev_registration_bot.webhook        # the router
+    BOT_MODE=webhook python -m ev_registration_bot.bot_main   # each worker
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import logging
+import queue
+import signal
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from telegram import Update
+from telegram.ext import Application
+
+from ev_registration_bot.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def partition_key(update: dict) -> int:
+    """Chat id of a raw update, falling back to the sender and the update id."""
+    for field in (
+        "message",
+        "edited_message",
+        "channel_post",
+        "edited_channel_post",
+        "callback_query",
+        "my_chat_member",
+        "chat_member",
+        "chat_join_request",
+    ):
+        payload = update.get(field)
+        if not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return int(chat["id"])
+        sender = payload.get("from")
+        if sender and "id" in sender:
+            return int(sender["id"])
+    for payload in update.values():
+        if isinstance(payload, dict) and "id" in (payload.get("from") or {}):
+            return int(payload["from"]["id"])
+    return int(update.get("update_id", 0))
+
+
+class _Forwarder:
+    """Sends one worker's updates in arrival order over a keep-alive connection."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._queue: queue.Queue = queue.Queue()
+        self._client = httpx.Client(timeout=10)
+        threading.Thread(
+            target=self._run, name=f"webhook-forward-{url}", daemon=True
+        ).start()
+
+    def forward(self, body: bytes) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        self._queue.put((body, future))
+        return future
+
+    def _run(self) -> None:
+        while True:
+            body, future = self._queue.get()
+            try:
+                response = self._client.post(
+                    self.url,
+                    content=body,
+                    headers={"Content-Type": "application/json"},
+                )
+                future.set_result(response.status_code)
+            except httpx.HTTPError as error:
+                logger.error("Failed to forward update to %s: %s", self.url, error)
+                future.set_result(HTTPStatus.BAD_GATEWAY)
+
+
+class _RouterRequestHandler(BaseHTTPRequestHandler):
+    server: "WebhookRouter"
+
+    def do_POST(self) -> None:
+        router = self.server
+        if router.secret_token and (
+            self.headers.get(_SECRET_HEADER) != router.secret_token
+        ):
+            self._reply(HTTPStatus.FORBIDDEN)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            update = json.loads(body)
+        except ValueError:
+            self._reply(HTTPStatus.BAD_REQUEST)
+            return
+        forwarder = router.forwarders[partition_key(update) % len(router.forwarders)]
+        # Telegram retries unless we answer 2xx, so only ack once forwarded
+        status = forwarder.forward(body).result()
+        self._reply(HTTPStatus.OK if status < 300 else HTTPStatus.BAD_GATEWAY)
+
+    def _reply(self, status: HTTPStatus) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class WebhookRouter(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, workers: list[str], secret_token):
+        super().__init__((host, port), _RouterRequestHandler)
+        self.forwarders = [_Forwarder(url) for url in workers]
+        self.secret_token = secret_token
+
+
+def set_webhook(token: str, url: str, secret_token: str | None) -> None:
+    params = {"url": url}
+    if secret_token:
+        params["secret_token"] = secret_token
+    response = httpx.post(
+        f"https://api.telegram.org/bot{token}/setWebhook", data=params, timeout=10
+    )
+    response.raise_for_status()
+
+
+def run_router() -> None:
+    settings = get_settings()
+    webhook_settings = settings.webhook
+    router = WebhookRouter(
+        webhook_settings.listen,
+        webhook_settings.port,
+        webhook_settings.workers,
+        webhook_settings.secret_token,
+    )
+    if webhook_settings.public_url:
+        set_webhook(
+            settings.telegram.bot_token,
+            webhook_settings.public_url,
+            webhook_settings.secret_token,
+        )
+    logger.info(
+        "Routing webhook updates on port %s to %d workers",
+        webhook_settings.port,
+        len(router.forwarders),
+    )
+    router.serve_forever()
+
+
+async def _serve_updates(
+    application: Application,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+) -> None:
+    # Minimal HTTP/1.1 with keep-alive: the router is the only client
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            try:
+                update = Update.de_json(json.loads(body), application.bot)
+            except ValueError:
+                status = b"400 Bad Request"
+            else:
+                await application.update_queue.put(update)
+                status = b"200 OK"
+            writer.write(b"HTTP/1.1 %s\r\nContent-Length: 0\r\n\r\n" % status)
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                return
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return
+    finally:
+        writer.close()
+
+
+async def run_worker(application: Application, host: str, port: int) -> None:
+    """Run ``application`` on updates pushed by the router until SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    async with application:
+        await application.start()
+        server = await asyncio.start_server(
+            lambda reader, writer: _serve_updates(application, reader, writer),
+            host,
+            port,
+        )
+        logger.info("Worker receiving updates on %s:%s", host, port)
+        async with server:
+            await stop.wait()
+        await application.stop()
+
+
+if __name__ == "__main__":
+    from ev_registration_bot.logging_config import parse_sample_rates, setup_logging
+
+    logging_settings = get_settings().logging
+    setup_logging(
+        logging_settings.level,
+        logging_settings.json_format,
+        parse_sample_rates(logging_settings.sample_rates),
+    )
+    run_router()
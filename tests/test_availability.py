@@ -0,0 +1,133 @@
+import datetime
+import random
+import unittest
+from unittest import mock
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.config import Schedule
+from ev_registration_bot.google_calendar_helper import (
+    bulk_availability,
+    capacity_stats,
+    schedule,
+)
+from ev_registration_bot.google_calendar_helper.availability_kernel import (
+    compute_day,
+    pack,
+)
+from ev_registration_bot.google_calendar_helper.google_calendar_create import (
+    has_capacity,
+    lecture_places_left,
+)
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    LectureSlot,
+    Slot,
+)
+from ev_registration_bot.google_calendar_helper.utils import VisitType, get_communes
+
+DAY = datetime.date(2024, 6, 3)
+GUEST_LIMIT = 12
+
+
+def random_day(rng: random.Random) -> tuple[list[Slot], list[LectureSlot]]:
+    """A day of visits starting on the quarter hour, as Calendar returns them."""
+
+    def span(longest: int) -> tuple[str, str]:
+        start = rng.randrange(9 * 60, 21 * 60, 15)
+        end = start + rng.choice(range(15, longest + 1, 15))
+        return time_utils.iso_at(DAY, start), time_utils.iso_at(DAY, end)
+
+    therapy = [
+        Slot(start=start, end=end, name="Ivanova")
+        for start, end in (span(60) for _ in range(rng.randint(0, 2)))
+    ]
+    lectures = [
+        LectureSlot(
+            start=start, end=end, name="Petrova", total_guests=rng.randint(1, 6)
+        )
+        for start, end in (span(90) for _ in range(rng.randint(0, 6)))
+    ]
+    return therapy, lectures
+
+
+class AvailabilityKernelTest(unittest.TestCase):
+    def test_matches_the_booking_checks(self):
+        rng = random.Random(0)
+        midnight = time_utils.local_midnight(DAY)
+        candidates = [(start, start + 30) for start in range(9 * 60, 22 * 60, 30)]
+        for _ in range(300):
+            therapy, lectures = random_day(rng)
+            result = compute_day(
+                pack([minute for slot in candidates for minute in slot]),
+                pack(
+                    [
+                        schedule.minute_of_day(value, midnight)
+                        for visit in therapy
+                        for value in (visit.start, visit.end)
+                    ]
+                ),
+                pack(
+                    [
+                        value
+                        for visit in lectures
+                        for value in (
+                            schedule.minute_of_day(visit.start, midnight),
+                            schedule.minute_of_day(visit.end, midnight),
+                            visit.total_guests,
+                        )
+                    ]
+                ),
+                GUEST_LIMIT,
+            )
+            for (start, end), (_, _, therapy_free, places) in zip(candidates, result):
+                start_time = time_utils.iso_at(DAY, start)
+                end_time = time_utils.iso_at(DAY, end)
+                self.assertEqual(
+                    therapy_free,
+                    has_capacity(
+                        start_time,
+                        end_time,
+                        VisitType.THERAPY,
+                        1,
+                        GUEST_LIMIT,
+                        therapy,
+                        lectures,
+                    ),
+                )
+                self.assertEqual(
+                    places,
+                    max(
+                        0,
+                        lecture_places_left(
+                            start_time, end_time, GUEST_LIMIT, therapy, lectures
+                        ),
+                    ),
+                )
+
+
+class HolidayTest(unittest.TestCase):
+    def setUp(self):
+        self.commune = next(iter(get_communes()))
+        holiday = Schedule(holidays=frozenset({DAY}))
+        patcher = mock.patch.object(schedule, "get_schedule", return_value=holiday)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bulk_availability_skips_holidays(self):
+        with mock.patch.object(
+            bulk_availability, "get_events_for_day", side_effect=AssertionError
+        ):
+            self.assertIsNone(bulk_availability._prepare_day(self.commune, DAY, 60))
+
+    def test_holiday_has_no_free_hours(self):
+        stats = capacity_stats.compute_day_capacity(self.commune, DAY, [], [])
+        self.assertEqual(stats.free_hours, 0)
+
+    def test_working_day_has_free_hours(self):
+        stats = capacity_stats.compute_day_capacity(
+            self.commune, DAY + datetime.timedelta(days=1), [], []
+        )
+        self.assertGreater(stats.free_hours, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+import asyncio
+import datetime
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from ev_registration_bot import booking_worker, config
+from ev_registration_bot.config import OutboxSettings
+from ev_registration_bot.google_calendar_helper import booking_outbox, events_cache
+from ev_registration_bot.google_calendar_helper.circuit_breaker import (
+    CircuitOpenError,
+)
+from ev_registration_bot.google_calendar_helper.utils import get_communes
+from ev_registration_bot.shared_state import backend as backend_module
+from ev_registration_bot.shared_state.backend import MemoryBackend
+
+DAY = datetime.date(2024, 6, 3)
+BODY = {
+    "start": {"dateTime": "2024-06-03T11:00:00+03:00"},
+    "end": {"dateTime": "2024-06-03T12:00:00+03:00"},
+    "summary": "Ivanova",
+    "description": "+79990000000",
+}
+
+
+def http_error(status: int) -> HttpError:
+    return HttpError(httplib2.Response({"status": status}), b"")
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connection = sqlite3.connect(
+            os.path.join(directory.name, "outbox.sqlite3"),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        connection.executescript(booking_outbox._SCHEMA)
+        self.addCleanup(connection.close)
+        self.addCleanup(setattr, booking_outbox, "_connection", None)
+        booking_outbox._connection = connection
+        self.addCleanup(setattr, booking_outbox, "_reservations_loaded", False)
+        booking_outbox._reservations_loaded = False
+
+        previous = backend_module._backend
+        backend_module._backend = MemoryBackend()
+        self.addCleanup(setattr, backend_module, "_backend", previous)
+        # Listeners like the reminders' would open their files in the cwd
+        self.addCleanup(
+            setattr, events_cache, "_day_listeners", events_cache._day_listeners
+        )
+        events_cache._day_listeners = []
+        self.addCleanup(events_cache._days.clear)
+        self.addCleanup(events_cache._local_generations.clear)
+
+        settings = config.get_settings()
+        self.addCleanup(setattr, config, "_settings", settings)
+        config._settings = settings.model_copy(
+            update={"outbox": OutboxSettings(OUTBOX_MAX_ATTEMPTS=2)}
+        )
+
+        self.commune = next(iter(get_communes()))
+        self.inserted = []
+        self.deleted = []
+        self.insert_error = None
+        for name, fake in (
+            ("insert_event", self.insert_event),
+            ("delete_event", self.delete_event),
+        ):
+            patcher = mock.patch.object(booking_worker, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.context = mock.Mock()
+        self.context.bot.send_message = mock.AsyncMock()
+
+    def insert_event(self, booking):
+        self.inserted.append(booking.event_id)
+        if self.insert_error is not None:
+            raise self.insert_error
+
+    def delete_event(self, commune, event_id):
+        self.deleted.append((commune, event_id))
+
+    def enqueue(self, event_id: str = "a1") -> bool:
+        return booking_outbox.enqueue(event_id, self.commune, DAY, BODY, chat_id=7)
+
+    def flush(self) -> None:
+        asyncio.run(booking_worker.flush_outbox(self.context))
+
+    def make_due(self) -> None:
+        booking_outbox._connection.execute("UPDATE outbox SET next_attempt_at = 0")
+
+    def row(self, event_id: str = "a1") -> tuple[str, int]:
+        return booking_outbox._connection.execute(
+            "SELECT status, attempts FROM outbox WHERE event_id = ?", (event_id,)
+        ).fetchone()
+
+    def test_enqueue_is_idempotent(self):
+        self.assertTrue(self.enqueue())
+        self.assertFalse(self.enqueue())
+        (visit,) = booking_outbox.pending_visits(self.commune, DAY)
+        self.assertEqual(visit.event_id, "a1")
+        self.flush()
+        self.assertEqual(self.inserted, ["a1"])
+
+    def test_reservations_are_published_again_after_a_restart(self):
+        self.enqueue()
+        backend_module._backend = MemoryBackend()
+        booking_outbox._reservations_loaded = False
+        self.assertTrue(booking_outbox.is_pending(self.commune, DAY, "a1"))
+
+    def test_inserted_booking_is_done(self):
+        self.enqueue()
+        self.flush()
+        self.assertEqual(self.row(), ("done", 1))
+        self.assertFalse(booking_outbox.is_pending(self.commune, DAY, "a1"))
+        self.flush()
+        self.assertEqual(self.inserted, ["a1"])
+
+    def test_conflict_counts_as_inserted(self):
+        self.enqueue()
+        self.insert_error = http_error(409)
+        self.flush()
+        self.assertEqual(self.row(), ("done", 1))
+        self.context.bot.send_message.assert_not_awaited()
+
+    def test_day_is_superseded_before_the_reservation_goes(self):
+        self.enqueue()
+        pending_when_invalidated = []
+        invalidate_day = events_cache.invalidate_day
+
+        def check_reserved(commune, day):
+            pending_when_invalidated.append(
+                booking_outbox.is_pending(commune, day, "a1")
+            )
+            invalidate_day(commune, day)
+
+        with mock.patch.object(events_cache, "invalidate_day", check_reserved):
+            self.flush()
+        self.assertEqual(pending_when_invalidated, [True])
+        self.assertFalse(booking_outbox.is_pending(self.commune, DAY, "a1"))
+
+    def test_cancelled_booking_is_not_inserted(self):
+        self.enqueue()
+        self.assertTrue(booking_outbox.cancel(self.commune, DAY, "a1"))
+        self.flush()
+        self.assertEqual(self.inserted, [])
+        self.assertEqual(self.row(), ("cancelled", 0))
+
+    def test_booking_cancelled_during_the_insert_is_deleted(self):
+        self.enqueue()
+
+        def insert_then_cancel(booking):
+            self.inserted.append(booking.event_id)
+            booking_outbox.cancel(self.commune, DAY, booking.event_id)
+
+        with mock.patch.object(booking_worker, "insert_event", insert_then_cancel):
+            self.flush()
+        self.assertEqual(self.row(), ("done", 1))
+        self.assertEqual(self.deleted, [(self.commune, "a1")])
+
+    def test_open_circuit_spends_no_attempt(self):
+        self.enqueue()
+        self.insert_error = CircuitOpenError()
+        self.flush()
+        self.assertEqual(self.row(), ("pending", 0))
+        self.assertTrue(booking_outbox.is_pending(self.commune, DAY, "a1"))
+
+    def test_outage_is_retried_until_the_attempts_run_out(self):
+        self.enqueue()
+        self.insert_error = http_error(503)
+        self.flush()
+        self.assertEqual(self.row(), ("pending", 1))
+        # Backing off
+        self.flush()
+        self.assertEqual(self.inserted, ["a1"])
+        self.make_due()
+        self.flush()
+        self.assertEqual(self.row(), ("failed", 2))
+        self.assertFalse(booking_outbox.is_pending(self.commune, DAY, "a1"))
+        self.context.bot.send_message.assert_awaited_once()
+        self.assertEqual(self.context.bot.send_message.await_args.args[0], 7)
+
+    def test_rejected_booking_fails_at_once(self):
+        self.enqueue()
+        self.insert_error = http_error(400)
+        self.flush()
+        self.assertEqual(self.row(), ("failed", 1))
+        self.assertFalse(booking_outbox.is_pending(self.commune, DAY, "a1"))
+        self.context.bot.send_message.assert_awaited_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import datetime
+import random
+import unittest
+
+import numpy as np
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.google_calendar_helper.capacity_matrix import (
+    build_capacity_matrix,
+    compute_capacity,
+)
+from ev_registration_bot.google_calendar_helper.google_calendar_create import (
+    has_capacity,
+    lecture_places_left,
+)
+from ev_registration_bot.google_calendar_helper.schedule import get_day_templates
+from ev_registration_bot.google_calendar_helper.utils import (
+    VisitType,
+    get_commune_guest_limit,
+    get_communes,
+)
+from tests.test_availability import DAY, random_day
+
+
+class ComputeCapacityTest(unittest.TestCase):
+    def test_one_day(self):
+        slot_starts = np.array([600, 660, 720], np.int32)
+        bookable = np.array([[True, True, False]])
+        # A therapy 10:30-11:15, lectures of 3 guests 11:15-12:30 and 2 at 11:45
+        therapy = np.array([[0, 630, 675]], np.int32)
+        lectures = np.array([[0, 675, 750, 3], [0, 705, 720, 2]], np.int32)
+        free_places, therapy_free = compute_capacity(
+            slot_starts, 60, bookable, therapy, lectures, 10
+        )
+        self.assertEqual(free_places.tolist(), [[0, 0, -1]])
+        self.assertEqual(therapy_free.tolist(), [[False, False, False]])
+        free_places, _ = compute_capacity(
+            slot_starts, 60, np.ones((1, 3), bool), therapy[:0], lectures, 10
+        )
+        self.assertEqual(free_places.tolist(), [[10, 5, 7]])
+
+
+class BuildCapacityMatrixTest(unittest.TestCase):
+    def setUp(self):
+        self.commune = next(iter(get_communes()))
+        self.guest_limit = get_commune_guest_limit(self.commune)
+
+    def check(self, events, duration_minutes, now):
+        matrix = build_capacity_matrix(self.commune, events, duration_minutes, now)
+        self.assertEqual(matrix.days, tuple(events))
+        for row, (day, (therapy, lectures)) in enumerate(events.items()):
+            starts = {
+                template.start_minute
+                for template in get_day_templates(self.commune, day, duration_minutes)
+            }
+            first_minute = (
+                time_utils.minutes(now.time()) + 1 if day == now.date() else 0
+            )
+            for column, start in enumerate(matrix.slot_starts.tolist()):
+                places = int(matrix.free_places[row, column])
+                if start not in starts or start < first_minute:
+                    self.assertEqual(places, -1)
+                    self.assertFalse(matrix.therapy_free[row, column])
+                    continue
+                start_time = time_utils.iso_at(day, start)
+                end_time = time_utils.iso_at(day, start + duration_minutes)
+                self.assertEqual(
+                    places,
+                    max(
+                        0,
+                        lecture_places_left(
+                            start_time, end_time, self.guest_limit, therapy, lectures
+                        ),
+                    ),
+                )
+                self.assertEqual(
+                    bool(matrix.therapy_free[row, column]),
+                    has_capacity(
+                        start_time,
+                        end_time,
+                        VisitType.THERAPY,
+                        1,
+                        self.guest_limit,
+                        therapy,
+                        lectures,
+                    ),
+                )
+
+    def test_matches_the_booking_checks(self):
+        rng = random.Random(0)
+        now = time_utils.local_midnight(DAY - datetime.timedelta(days=1))
+        for _ in range(50):
+            # random_day's visits are on DAY; one day is enough per matrix
+            events = {DAY: random_day(rng)}
+            for duration_minutes in (30, 60):
+                self.check(events, duration_minutes, now)
+
+    def test_past_slots_of_today_cannot_be_booked(self):
+        now = time_utils.at_minute(DAY, 15 * 60) + datetime.timedelta(seconds=30)
+        self.check({DAY: ([], [])}, 30, now)
+
+
+if __name__ == "__main__":
+    unittest.main()
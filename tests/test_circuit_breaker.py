@@ -0,0 +1,94 @@
+import unittest
+from unittest import mock
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from ev_registration_bot.google_calendar_helper import circuit_breaker
+from ev_registration_bot.google_calendar_helper.circuit_breaker import (
+    BreakerState,
+    CircuitOpenError,
+    get_breaker,
+    guarded_call,
+)
+from ev_registration_bot.google_calendar_helper.utils import get_communes
+
+
+class GuardedCallTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(circuit_breaker._breakers.clear)
+        circuit_breaker._breakers.clear()
+        self.now = 1000.0
+        clock = mock.Mock()
+        clock.monotonic = lambda: self.now
+        patcher = mock.patch.object(circuit_breaker, "time", clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.commune = next(iter(get_communes()))
+        self.breaker = get_breaker(self.commune)
+        self.calls = 0
+
+    def succeed(self, seconds: float = 0.0) -> str:
+        self.calls += 1
+        self.now += seconds
+        return "ok"
+
+    def fail(self, status: int = 503):
+        self.calls += 1
+        raise HttpError(httplib2.Response({"status": status}), b"")
+
+    def open_breaker(self) -> None:
+        for _ in range(self.breaker.failure_threshold):
+            with self.assertRaises(HttpError):
+                guarded_call(self.commune, self.fail)
+        self.assertEqual(self.breaker.state, BreakerState.OPEN)
+
+    def test_open_breaker_does_not_call(self):
+        self.open_breaker()
+        calls = self.calls
+        with self.assertRaises(CircuitOpenError):
+            guarded_call(self.commune, self.succeed)
+        self.assertEqual(self.calls, calls)
+
+    def test_rejected_request_is_not_an_outage(self):
+        for _ in range(self.breaker.failure_threshold):
+            with self.assertRaises(HttpError):
+                guarded_call(self.commune, self.fail, 400)
+        self.assertEqual(self.breaker.state, BreakerState.CLOSED)
+
+    def test_slow_call_counts_as_a_failure(self):
+        for _ in range(self.breaker.failure_threshold):
+            guarded_call(self.commune, self.succeed, self.breaker.slow_call_seconds + 1)
+        self.assertEqual(self.breaker.state, BreakerState.OPEN)
+
+    def test_single_probe_closes_the_breaker(self):
+        self.open_breaker()
+        self.now += self.breaker.open_seconds
+        self.assertEqual(self.breaker.state, BreakerState.HALF_OPEN)
+
+        def probe():
+            # Everyone else waits for the probe
+            with self.assertRaises(CircuitOpenError):
+                guarded_call(self.commune, self.succeed)
+            return self.succeed()
+
+        self.assertEqual(guarded_call(self.commune, probe), "ok")
+        self.assertEqual(self.breaker.state, BreakerState.CLOSED)
+        self.assertEqual(guarded_call(self.commune, self.succeed), "ok")
+
+    def test_failed_probe_opens_the_breaker_again(self):
+        self.open_breaker()
+        self.now += self.breaker.open_seconds
+        with self.assertRaises(HttpError):
+            guarded_call(self.commune, self.fail)
+        self.assertEqual(self.breaker.state, BreakerState.OPEN)
+        self.now += self.breaker.open_seconds - 1
+        with self.assertRaises(CircuitOpenError):
+            guarded_call(self.commune, self.succeed)
+        self.now += 1
+        self.assertEqual(guarded_call(self.commune, self.succeed), "ok")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from ev_registration_bot import config
+from ev_registration_bot.config import CommuneSettings, CommunesSettings
+from ev_registration_bot.google_calendar_helper.utils import (
+    find_communes,
+    get_commune,
+)
+
+
+class FindCommunesTest(unittest.TestCase):
+    def setUp(self):
+        settings = config.get_settings()
+        self.addCleanup(setattr, config, "_settings", settings)
+        registry = tuple(
+            CommuneSettings(
+                id=commune_id,
+                label=commune_id,
+                config_dir=commune_id,
+                guest_limit=8,
+                lecture_color=1,
+            )
+            for commune_id in ("GERMAN", "Bavaria", "spb", "SPB")
+        )
+        config._settings = settings.model_copy(
+            update={"communes": CommunesSettings(COMMUNES=registry)}
+        )
+
+    def test_ids_match_as_configured(self):
+        self.assertEqual(
+            find_communes(["Bavaria", "spb", "SPB"]),
+            [get_commune("Bavaria"), get_commune("spb"), get_commune("SPB")],
+        )
+
+    def test_ids_match_regardless_of_case(self):
+        self.assertEqual(
+            find_communes(["german", "BAVARIA"]),
+            [get_commune("GERMAN"), get_commune("Bavaria")],
+        )
+
+    def test_unknown_and_ambiguous_ids_list_the_configured_ones(self):
+        with self.assertRaises(ValueError) as raised:
+            find_communes(["GERMAN", "moscow", "Spb"])
+        self.assertEqual(
+            str(raised.exception),
+            "Invalid commune moscow, Spb. Please choose from "
+            "'GERMAN', 'Bavaria', 'spb', 'SPB'.",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import datetime
+import math
+import os
+import tempfile
+import unittest
+
+from ev_registration_bot.google_calendar_helper import events_cache
+from ev_registration_bot.google_calendar_helper.google_calendar_get import Slot
+from ev_registration_bot.google_calendar_helper.utils import get_communes
+from ev_registration_bot.shared_state import backend as backend_module
+from ev_registration_bot.shared_state.backend import MemoryBackend
+from ev_registration_bot.shared_state.sqlite_backend import SQLiteBackend
+
+DAY = datetime.date(2024, 6, 3)
+VISIT = Slot(
+    start="2024-06-03T11:00:00+03:00",
+    end="2024-06-03T12:00:00+03:00",
+    name="Ivanova+1",
+    event_id="a1",
+)
+
+
+class EventsCacheTest(unittest.TestCase):
+    def use_backend(self, backend):
+        previous = backend_module._backend
+        backend_module._backend = backend
+        self.addCleanup(setattr, backend_module, "_backend", previous)
+        self.addCleanup(events_cache._days.clear)
+        self.addCleanup(events_cache._local_generations.clear)
+        events_cache._days.clear()
+        events_cache._local_generations.clear()
+
+    def setUp(self):
+        # Listeners like the reminders' would open their files in the cwd
+        self.addCleanup(
+            setattr, events_cache, "_day_listeners", events_cache._day_listeners
+        )
+        events_cache._day_listeners = []
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.use_backend(SQLiteBackend(os.path.join(directory.name, "state.sqlite3")))
+        self.commune = next(iter(get_communes()))
+
+    def fetch(self):
+        """Mirror the day the way fetch_events_for_day does."""
+        generation = events_cache.generation(self.commune, DAY)
+        events_cache.put_day(self.commune, DAY, [VISIT], [], generation)
+
+    def test_fresh_copy_is_served(self):
+        self.fetch()
+        cached = events_cache.get_day(self.commune, DAY, 60)
+        self.assertEqual(cached.therapy_visits, [VISIT])
+
+    def test_change_by_another_worker_supersedes_the_copy(self):
+        self.fetch()
+        # What invalidate_day on another worker leaves in the shared backend
+        events_cache._bump_generation(self.commune, DAY)
+        self.assertIsNone(events_cache.get_day(self.commune, DAY, 60))
+        self.assertEqual(events_cache.get_age(self.commune, DAY), math.inf)
+        # Still good enough to fall back to while Calendar is down
+        self.assertIsNotNone(events_cache.get_day(self.commune, DAY, math.inf))
+
+    def test_change_during_the_fetch_supersedes_the_copy(self):
+        generation = events_cache.generation(self.commune, DAY)
+        events_cache.invalidate_day(self.commune, DAY)
+        events_cache.put_day(self.commune, DAY, [VISIT], [], generation)
+        self.assertIsNone(events_cache.get_day(self.commune, DAY, 60))
+
+    def test_copy_of_another_worker_is_adopted(self):
+        self.fetch()
+        # This worker never fetched the day itself
+        events_cache._days.clear()
+        cached = events_cache.get_day(self.commune, DAY, 60)
+        self.assertEqual(cached.therapy_visits, [VISIT])
+
+    def test_update_day_supersedes_copies_elsewhere(self):
+        self.fetch()
+        stale = events_cache._days[(self.commune, DAY)]
+        events_cache.update_day(self.commune, DAY, stale._replace(therapy_visits=[]))
+        self.assertEqual(events_cache.get_day(self.commune, DAY, 60).therapy_visits, [])
+        # Another worker still holding the old copy no longer trusts it
+        events_cache._days[(self.commune, DAY)] = stale
+        self.assertEqual(events_cache.get_day(self.commune, DAY, 60).therapy_visits, [])
+
+    def test_update_day_keeps_fetched_at(self):
+        self.fetch()
+        cached = events_cache._days[(self.commune, DAY)]
+        events_cache.update_day(self.commune, DAY, cached._replace(therapy_visits=[]))
+        updated = events_cache.get_day(self.commune, DAY, 60)
+        self.assertEqual(updated.fetched_at, cached.fetched_at)
+
+    def test_update_of_superseded_copy_drops_the_day(self):
+        self.fetch()
+        cached = events_cache._days[(self.commune, DAY)]
+        events_cache._bump_generation(self.commune, DAY)
+        events_cache.update_day(self.commune, DAY, cached._replace(therapy_visits=[]))
+        self.assertIsNone(events_cache.get_day(self.commune, DAY, math.inf))
+
+    def test_unshared_backend_serves_its_own_fetch(self):
+        self.use_backend(MemoryBackend())
+        self.fetch()
+        self.assertIsNotNone(events_cache.get_day(self.commune, DAY, 60))
+        events_cache.invalidate_day(self.commune, DAY)
+        self.assertIsNone(events_cache.get_day(self.commune, DAY, math.inf))
+        self.fetch()
+        self.assertIsNotNone(events_cache.get_day(self.commune, DAY, 60))
+
+    def test_unshared_backend_supersedes_a_fetch_overtaken_by_a_booking(self):
+        self.use_backend(MemoryBackend())
+        # The prewarm thread reads the generation, then lists the events
+        generation = events_cache.generation(self.commune, DAY)
+        # Meanwhile flush_outbox inserts a booking and drops the day
+        events_cache.invalidate_day(self.commune, DAY)
+        # The listing, taken before the insert, arrives
+        events_cache.put_day(self.commune, DAY, [], [], generation)
+        self.assertIsNone(events_cache.get_day(self.commune, DAY, 60))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import datetime
+import unittest
+
+from ev_registration_bot import health
+from ev_registration_bot.google_calendar_helper import google_calendar_get
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    record_token_result,
+)
+from ev_registration_bot.google_calendar_helper.utils import get_communes
+
+
+class CheckTokensTest(unittest.TestCase):
+    def setUp(self):
+        results = google_calendar_get._token_results
+        self.addCleanup(setattr, google_calendar_get, "_token_results", results)
+        google_calendar_get._token_results = {}
+        self.communes = list(get_communes())
+
+    def load_all(self, expiry):
+        for commune in self.communes:
+            record_token_result(commune, None, expiry)
+
+    def test_unknown_until_loaded(self):
+        result = health.check_tokens()
+        self.assertEqual(result.status, health.DEGRADED)
+        self.assertIn(self.communes[0].name, result.detail)
+
+    def test_loaded_tokens_report_their_expiry(self):
+        expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+            hours=1
+        )
+        self.load_all(expiry.replace(tzinfo=None))
+        result = health.check_tokens()
+        self.assertEqual(result.status, health.OK)
+        self.assertIn(f"{self.communes[0].name} expires in 3", result.detail)
+
+    def test_failed_load_fails_until_a_load_succeeds(self):
+        self.load_all(None)
+        record_token_result(self.communes[0], ValueError("Invalid credentials"))
+        result = health.check_tokens()
+        self.assertEqual(result.status, health.FAIL)
+        self.assertIn("Invalid credentials", result.detail)
+        record_token_result(self.communes[0], None)
+        self.assertEqual(health.check_tokens().status, health.OK)
+
+
+if __name__ == "__main__":
+    unittest.main()
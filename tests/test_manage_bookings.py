@@ -0,0 +1,150 @@
+import contextlib
+import datetime
+import unittest
+from unittest import mock
+
+from ev_registration_bot.google_calendar_helper import (
+    booking_outbox,
+    events_cache,
+    manage_bookings,
+)
+from ev_registration_bot.google_calendar_helper.booking_outbox import PendingVisit
+from ev_registration_bot.google_calendar_helper.user_bookings import UserBooking
+from ev_registration_bot.google_calendar_helper.utils import get_communes
+from ev_registration_bot.shared_state import backend as backend_module
+from ev_registration_bot.shared_state.backend import MemoryBackend
+
+DAY = datetime.date(2024, 6, 3)
+NEXT_DAY = DAY + datetime.timedelta(days=1)
+
+
+class RecordingBackend(MemoryBackend):
+    """Remembers the order locks are taken in and which are held."""
+
+    def __init__(self):
+        super().__init__()
+        self.taken: list[str] = []
+        self.held: set[str] = set()
+
+    @contextlib.contextmanager
+    def lock(self, name, ttl=None, timeout=None):
+        with super().lock(name, ttl, timeout):
+            self.taken.append(name)
+            self.held.add(name)
+            try:
+                yield
+            finally:
+                self.held.discard(name)
+
+
+class ManageBookingsTest(unittest.TestCase):
+    def setUp(self):
+        previous = backend_module._backend
+        self.backend = backend_module._backend = RecordingBackend()
+        self.addCleanup(setattr, backend_module, "_backend", previous)
+        # No outbox file: nothing is queued but what a test reserves
+        self.addCleanup(
+            setattr,
+            booking_outbox,
+            "_reservations_loaded",
+            booking_outbox._reservations_loaded,
+        )
+        booking_outbox._reservations_loaded = True
+        self.addCleanup(
+            setattr, events_cache, "_day_listeners", events_cache._day_listeners
+        )
+        events_cache._day_listeners = []
+        self.addCleanup(events_cache._days.clear)
+        self.addCleanup(events_cache._local_generations.clear)
+
+        self.commune = next(iter(get_communes()))
+        self.held_by_calendar_call: list[set[str]] = []
+        self.reminders = mock.Mock()
+        for name, fake in (
+            ("get_events_for_day", lambda day, commune: ([], [])),
+            ("move_event", self.calendar_call),
+            ("delete_event", self.calendar_call),
+            ("reminders", self.reminders),
+        ):
+            patcher = mock.patch.object(manage_bookings, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def calendar_call(self, *args):
+        self.held_by_calendar_call.append(set(self.backend.held))
+
+    def lock_of(self, day: datetime.date) -> str:
+        return f"reservation:{self.commune.name}:{day.isoformat()}"
+
+    def booking(self, day: datetime.date) -> UserBooking:
+        return UserBooking(
+            event_id="a1",
+            commune=self.commune.name,
+            start=f"{day.isoformat()}T11:00:00+03:00",
+            end=f"{day.isoformat()}T12:00:00+03:00",
+            visit_type="therapy",
+            guests=1,
+            summary="Ivanova",
+        )
+
+    def reschedule(self, booking: UserBooking, day: datetime.date) -> bool:
+        moved = self.booking(day)
+        return manage_bookings.reschedule_booking(7, booking, moved.start, moved.end)
+
+    def test_move_takes_the_earlier_day_first(self):
+        both = {self.lock_of(DAY), self.lock_of(NEXT_DAY)}
+        self.assertTrue(self.reschedule(self.booking(NEXT_DAY), DAY))
+        self.assertTrue(self.reschedule(self.booking(DAY), NEXT_DAY))
+        self.assertEqual(self.backend.taken, [*sorted(both)] * 2)
+        self.assertEqual(self.held_by_calendar_call, [both, both])
+        self.assertEqual(self.backend.held, set())
+
+    def test_move_within_a_day_takes_its_lock_once(self):
+        booking = self.booking(DAY)
+        self.assertTrue(
+            manage_bookings.reschedule_booking(
+                7, booking, booking.start.replace("11:", "15:"), booking.end
+            )
+        )
+        self.assertEqual(self.backend.taken, [self.lock_of(DAY)])
+
+    def test_full_slot_is_not_moved(self):
+        with mock.patch.object(manage_bookings, "has_capacity", return_value=False):
+            self.assertFalse(self.reschedule(self.booking(NEXT_DAY), DAY))
+        self.assertEqual(self.held_by_calendar_call, [])
+        self.assertEqual(self.backend.held, set())
+        self.reminders.schedule.assert_not_called()
+
+    def test_queued_booking_cannot_be_moved(self):
+        booking = self.booking(DAY)
+        booking_outbox._reserve(
+            self.commune,
+            DAY,
+            PendingVisit("a1", booking.start, booking.end, booking.summary, ""),
+        )
+        with self.assertRaises(manage_bookings.BookingStillPendingError):
+            self.reschedule(booking, NEXT_DAY)
+        self.assertEqual(self.backend.taken, [])
+
+    def test_queued_booking_is_cancelled_without_calendar(self):
+        booking = self.booking(DAY)
+        booking_outbox._reserve(
+            self.commune,
+            DAY,
+            PendingVisit("a1", booking.start, booking.end, booking.summary, ""),
+        )
+        manage_bookings.cancel_booking(7, booking)
+        self.assertEqual(self.held_by_calendar_call, [])
+        self.assertTrue(booking_outbox.is_cancelled("a1"))
+        self.assertFalse(booking_outbox.is_pending(self.commune, DAY, "a1"))
+        self.reminders.cancel.assert_called_once_with("a1")
+
+    def test_booking_in_calendar_is_deleted_under_its_day_lock(self):
+        manage_bookings.cancel_booking(7, self.booking(DAY))
+        self.assertEqual(self.held_by_calendar_call, [{self.lock_of(DAY)}])
+        self.assertEqual(self.backend.held, set())
+        self.reminders.cancel.assert_called_once_with("a1")
+
+
+if __name__ == "__main__":
+    unittest.main()
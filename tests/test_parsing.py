@@ -0,0 +1,97 @@
+import datetime
+import random
+import string
+import unittest
+
+from ev_registration_bot.parsing import (
+    SlotChoice,
+    format_date_label,
+    parse_date_label,
+    parse_slot_label,
+    slot_label,
+)
+
+DAY = datetime.date(2024, 6, 3)
+
+_ALPHABET = string.digits + ".:-() мест" + string.ascii_letters
+
+
+def _iso(day: datetime.date, minute: int) -> str:
+    return f"{day.isoformat()}T{minute // 60:02d}:{minute % 60:02d}:00+03:00"
+
+
+def _random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 24)))
+
+
+def _mutate(rng: random.Random, text: str) -> str:
+    chars = list(text)
+    for _ in range(rng.randint(1, 3)):
+        position = rng.randint(0, len(chars))
+        action = rng.random()
+        if action < 0.4 and chars:
+            del chars[min(position, len(chars) - 1)]
+        elif action < 0.8:
+            chars.insert(position, rng.choice(_ALPHABET))
+        elif chars:
+            chars[min(position, len(chars) - 1)] = rng.choice(_ALPHABET)
+    return "".join(chars)
+
+
+class ParsingTest(unittest.TestCase):
+    def test_date_label_round_trip(self):
+        self.assertEqual(format_date_label(DAY), "3.06.2024")
+        self.assertEqual(parse_date_label("3.06.2024"), DAY)
+
+    def test_slot_label_round_trip(self):
+        label = slot_label(_iso(DAY, 13 * 60 + 30), _iso(DAY, 14 * 60 + 30), 4)
+        self.assertEqual(label, "13:30-14:30 (4 мест)")
+        choice = parse_slot_label(label)
+        self.assertEqual(choice, SlotChoice("13:30", "14:30", 4))
+        self.assertEqual((choice.start_minute, choice.end_minute), (810, 870))
+
+    def test_therapy_slot_label_has_no_places(self):
+        label = slot_label(_iso(DAY, 11 * 60), _iso(DAY, 12 * 60))
+        self.assertEqual(parse_slot_label(label), SlotChoice("11:00", "12:00", None))
+
+    def test_rejects_other_text(self):
+        for text in ("", "/start", "31.02.2024", "3.06", "3.06.2024 ", "1.1.1.1"):
+            self.assertIsNone(parse_date_label(text), text)
+        for text in ("", "13:30", "13:30-14:30 (мест)", "1:30-2:30", "13:30-14:30 "):
+            self.assertIsNone(parse_slot_label(text), text)
+
+    def test_fuzz(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            day = DAY + datetime.timedelta(days=rng.randint(0, 400))
+            date_label = format_date_label(day)
+            self.assertEqual(parse_date_label(date_label), day)
+
+            start = rng.randrange(0, 23 * 60, 30)
+            places = rng.choice([None, rng.randint(0, 10)])
+            label = slot_label(_iso(day, start), _iso(day, start + 60), places)
+            choice = parse_slot_label(label)
+            self.assertEqual((choice.start_minute, choice.places), (start, places))
+
+            for text in (
+                _random_text(rng),
+                _mutate(rng, date_label),
+                _mutate(rng, label),
+            ):
+                # Either rejected or read back exactly as written
+                parsed_day = parse_date_label(text)
+                if parsed_day is not None:
+                    parts = [int(part) for part in text.split(".")]
+                    self.assertEqual(
+                        parts, [parsed_day.day, parsed_day.month, parsed_day.year]
+                    )
+                parsed_slot = parse_slot_label(text)
+                if parsed_slot is not None:
+                    self.assertTrue(
+                        text.startswith(f"{parsed_slot.start}-{parsed_slot.end}")
+                    )
+                    self.assertEqual(parsed_slot.places is None, "(" not in text)
+
+
+if __name__ == "__main__":
+    unittest.main()
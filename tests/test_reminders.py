@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from ev_registration_bot import send_queue, time_utils
+from ev_registration_bot.google_calendar_helper import reminders
+from ev_registration_bot.google_calendar_helper.utils import get_communes
+from ev_registration_bot.shared_state import backend as backend_module
+from ev_registration_bot.shared_state.backend import MemoryBackend
+
+DAY = datetime.date(2024, 6, 3)
+START = "2024-06-03T11:00:00+03:00"
+
+
+class RemindersTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "reminders.sqlite3")
+        self.restart()
+        self.addCleanup(self.forget_file)
+
+        previous = backend_module._backend
+        backend_module._backend = MemoryBackend()
+        self.addCleanup(setattr, backend_module, "_backend", previous)
+        self.addCleanup(send_queue._queue.clear)
+
+        self.now = time_utils.local_midnight(DAY).timestamp() - 2 * 24 * 3600
+        time_utils.set_clock(lambda: self.now)
+        self.addCleanup(time_utils.set_clock, None)
+
+        reminders.schedule("a1", 7, next(iter(get_communes())), START)
+        self.now = reminders._send_at(START) + 1
+
+    def forget_file(self):
+        if reminders._connection is not None:
+            reminders._connection.close()
+        reminders._connection = None
+        reminders._heap = []
+        reminders._heap_loaded = False
+
+    def restart(self):
+        """Forget everything but the file, as a new process would."""
+        self.forget_file()
+        reminders._connection = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        reminders._connection.executescript(reminders._SCHEMA)
+        send_queue._queue.clear()
+
+    def lapse_claim(self):
+        self.now += reminders._CLAIM_TTL_SECONDS + 1
+        # Leases expire on the backend's own clock
+        backend_module._backend._leases.clear()
+
+    def tick(self) -> list[send_queue.Notification]:
+        asyncio.run(reminders.send_reminders(None))
+        queued = list(send_queue._queue)
+        send_queue._queue.clear()
+        return queued
+
+    def test_reminder_queued_when_the_bot_stopped_is_sent_after_restart(self):
+        self.assertEqual([n.chat_id for n in self.tick()], [7])
+        self.restart()
+        # Still claimed by the stopped process
+        self.assertEqual(self.tick(), [])
+        self.lapse_claim()
+        self.assertEqual([n.chat_id for n in self.tick()], [7])
+
+    def test_failed_send_is_retried_once_the_claim_lapses(self):
+        self.assertEqual(len(self.tick()), 1)
+        self.lapse_claim()
+        self.assertEqual(len(self.tick()), 1)
+
+    def test_delivered_reminder_is_not_sent_again(self):
+        (notification,) = self.tick()
+        notification.on_sent()
+        self.lapse_claim()
+        self.assertEqual(self.tick(), [])
+        self.restart()
+        self.assertEqual(self.tick(), [])
+
+    def test_visit_moved_too_close_for_a_reminder_loses_the_old_one(self):
+        self.now = reminders._send_at(START) - 3600
+        moved = datetime.datetime.fromtimestamp(self.now + 3600, time_utils.MOSCOW_TZ)
+        reminders.schedule(
+            "a1", 7, next(iter(get_communes())), moved.isoformat(timespec="seconds")
+        )
+        self.now = reminders._send_at(START) + 1
+        self.assertEqual(self.tick(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import datetime
+import unittest
+
+from ev_registration_bot import time_utils
+from ev_registration_bot.config import WorkingHoursSettings
+from ev_registration_bot.google_calendar_helper.schedule import (
+    first_bookable_minute,
+    is_past_closing,
+)
+
+DAY = datetime.date(2024, 6, 3)
+HOURS = WorkingHoursSettings(
+    opens_at=datetime.time(11), closes_at=datetime.time(21), breaks=()
+)
+
+
+class ScheduleClockTest(unittest.TestCase):
+    def at(self, hour: int, minute: int, second: int = 0, microsecond: int = 0):
+        """Stop the clock at that Moscow time on DAY and return time_utils.now()."""
+        moment = datetime.datetime(
+            2024, 6, 3, hour, minute, second, microsecond, tzinfo=time_utils.MOSCOW_TZ
+        )
+        time_utils.set_clock(moment.timestamp)
+        self.addCleanup(time_utils.set_clock, None)
+        return time_utils.now()
+
+    def test_first_bookable_minute_on_the_minute(self):
+        self.assertEqual(first_bookable_minute(DAY, self.at(15, 0)), 15 * 60)
+
+    def test_first_bookable_minute_rounds_up(self):
+        # The 15:00 slot has begun by then
+        self.assertEqual(first_bookable_minute(DAY, self.at(15, 0, 30)), 15 * 60 + 1)
+        self.assertEqual(first_bookable_minute(DAY, self.at(15, 0, 0, 1)), 15 * 60 + 1)
+
+    def test_first_bookable_minute_of_another_day(self):
+        tomorrow = DAY + datetime.timedelta(days=1)
+        self.assertEqual(first_bookable_minute(tomorrow, self.at(15, 0, 30)), 0)
+
+    def test_is_past_closing(self):
+        self.assertFalse(is_past_closing(HOURS, self.at(20, 59, 59)))
+        self.assertTrue(is_past_closing(HOURS, self.at(21, 0)))
+
+    def test_iso_at_matches_the_clock(self):
+        now = self.at(15, 30)
+        self.assertEqual(time_utils.iso_at(DAY, 15 * 60 + 30), now.isoformat())
+        self.assertEqual(time_utils.iso_minute(now.isoformat()), 15 * 60 + 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import unittest
+
+from telegram.ext import ApplicationBuilder, CallbackContext
+
+from ev_registration_bot import sessions, time_utils
+
+IDLE_SECONDS = 300
+SWEEP_SECONDS = 60
+
+
+class ExpireIdleTest(unittest.TestCase):
+    def setUp(self):
+        self.application = ApplicationBuilder().token("0:test").build()
+        self.addCleanup(sessions._last_seen.clear)
+        self.addCleanup(sessions._cleanups.clear)
+        sessions._last_seen.clear()
+        sessions._cleanups.clear()
+        self.now = 1_700_000_000.0
+        time_utils.set_clock(lambda: self.now)
+        self.addCleanup(time_utils.set_clock, None)
+
+    def update_from(self, user_id: int) -> None:
+        """What the handlers leave behind for an abandoned booking."""
+        sessions.touch(user_id, time_utils.timestamp())
+        user_data = CallbackContext(self.application, user_id=user_id).user_data
+        user_data.setdefault("message_ids", []).append(int(self.now))
+        user_data["chat_id"] = user_id
+
+    def test_session_count_stays_flat(self):
+        counts = []
+        next_sweep = self.now + SWEEP_SECONDS
+        # A new user every second, none of whom ever comes back
+        for user_id in range(1, 3001):
+            self.now += 1
+            self.update_from(user_id)
+            if self.now >= next_sweep:
+                next_sweep += SWEEP_SECONDS
+                sessions.expire_idle(self.application, self.now, IDLE_SECONDS)
+                counts.append(len(self.application.user_data))
+        # Everyone idle for IDLE_SECONDS is gone by the next sweep
+        self.assertLessEqual(max(counts), IDLE_SECONDS + SWEEP_SECONDS)
+        self.assertEqual(min(counts[10:]), max(counts[10:]))
+        self.assertEqual(len(sessions._last_seen), len(self.application.user_data))
+        # Nothing is left queued for a persistence the bot doesn't have
+        self.assertEqual(self.application._user_ids_to_be_deleted_in_persistence, set())
+        self.assertEqual(len(sessions._cleanups), 3000 - counts[-1])
+
+    def test_session_sizes_of_few_sessions_are_exact(self):
+        for user_id in range(1, 11):
+            self.update_from(user_id)
+        count, size = sessions.session_sizes(self.application, self.now)
+        self.assertEqual(count, 10)
+        self.assertEqual(
+            size,
+            sum(len(json.dumps(data)) for data in self.application.user_data.values()),
+        )
+
+    def test_session_sizes_tracks_users_loaded_from_persistence(self):
+        self.application._user_data[42]["chat_id"] = 42
+        sessions.session_sizes(self.application, self.now)
+        self.assertEqual(
+            sessions.expire_idle(
+                self.application, self.now + IDLE_SECONDS, IDLE_SECONDS
+            ),
+            1,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from ev_registration_bot.shared_state.backend import LockTimeout, MemoryBackend
+from ev_registration_bot.shared_state.resp_backend import RespBackend
+from ev_registration_bot.shared_state.resp_standin import start_standin
+from ev_registration_bot.shared_state.sqlite_backend import SQLiteBackend
+
+
+class BackendContract:
+    """Behaviour every StateBackend must share; mixed into one case per backend."""
+
+    def make_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.backend = self.make_backend()
+
+    def test_get_set_delete(self):
+        self.assertIsNone(self.backend.get("key"))
+        self.backend.set("key", b"value")
+        self.assertEqual(self.backend.get("key"), b"value")
+        self.backend.set("key", b"other")
+        self.assertEqual(self.backend.get("key"), b"other")
+        self.backend.delete("key")
+        self.assertIsNone(self.backend.get("key"))
+
+    def test_set_expires(self):
+        self.backend.set("key", b"value", ttl=0.05)
+        self.assertEqual(self.backend.get("key"), b"value")
+        time.sleep(0.1)
+        self.assertIsNone(self.backend.get("key"))
+
+    def test_hashes(self):
+        self.backend.hset("hash", "a", b"1")
+        self.backend.hset("hash", "b", b"2")
+        self.assertEqual(self.backend.hget("hash", "a"), b"1")
+        self.assertIsNone(self.backend.hget("hash", "c"))
+        self.assertEqual(self.backend.hgetall("hash"), {"a": b"1", "b": b"2"})
+        self.backend.hdel("hash", "a")
+        self.assertEqual(self.backend.hgetall("hash"), {"b": b"2"})
+        self.backend.delete("hash")
+        self.assertEqual(self.backend.hgetall("hash"), {})
+
+    def test_lease_is_exclusive_until_released(self):
+        token = self.backend.acquire("lease", ttl=10)
+        self.assertIsNotNone(token)
+        self.assertIsNone(self.backend.acquire("lease", ttl=10))
+        self.backend.release("lease", token)
+        self.assertIsNotNone(self.backend.acquire("lease", ttl=10))
+
+    def test_release_with_another_token_keeps_the_lease(self):
+        token = self.backend.acquire("lease", ttl=10)
+        self.backend.release("lease", "not-the-token")
+        self.assertIsNone(self.backend.acquire("lease", ttl=10))
+        self.backend.release("lease", token)
+
+    def test_lease_expires(self):
+        stale_token = self.backend.acquire("lease", ttl=0.05)
+        time.sleep(0.1)
+        token = self.backend.acquire("lease", ttl=10)
+        self.assertIsNotNone(token)
+        # The previous holder waking up must not release the new lease
+        self.backend.release("lease", stale_token)
+        self.assertIsNone(self.backend.acquire("lease", ttl=10))
+
+    def test_lock_times_out(self):
+        with self.backend.lock("lock", ttl=10, timeout=1):
+            started = time.monotonic()
+            with self.assertRaises(LockTimeout):
+                with self.backend.lock("lock", ttl=10, timeout=0.05):
+                    pass
+            self.assertLess(time.monotonic() - started, 1)
+        with self.backend.lock("lock", ttl=10, timeout=0.05):
+            pass
+
+    def test_lock_excludes_other_threads(self):
+        inside = []
+        overlaps = []
+
+        def work():
+            for _ in range(20):
+                with self.backend.lock("counter", ttl=10, timeout=10):
+                    inside.append(1)
+                    overlaps.append(len(inside))
+                    time.sleep(0.001)
+                    inside.pop()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(overlaps), 80)
+        self.assertEqual(max(overlaps), 1)
+
+
+class MemoryBackendTest(BackendContract, unittest.TestCase):
+    def make_backend(self):
+        return MemoryBackend()
+
+
+class SQLiteBackendTest(BackendContract, unittest.TestCase):
+    def make_backend(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "state.sqlite3")
+        return SQLiteBackend(self.path)
+
+    def test_connections_share_the_file(self):
+        other = SQLiteBackend(self.path)
+        token = self.backend.acquire("lease", ttl=10)
+        self.assertIsNone(other.acquire("lease", ttl=10))
+        self.backend.set("key", b"value")
+        self.assertEqual(other.get("key"), b"value")
+        self.backend.release("lease", token)
+        self.assertIsNotNone(other.acquire("lease", ttl=10))
+
+
+class RespBackendTest(BackendContract, unittest.TestCase):
+    def setUp(self):
+        self.server = start_standin(port=0)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        super().setUp()
+
+    def make_backend(self):
+        return RespBackend(f"redis://127.0.0.1:{self.server.server_address[1]}/0")
+
+    def drop_connection(self, backend):
+        # As if the server had closed an idle connection
+        backend._socket.shutdown(2)
+
+    def test_reconnects_after_dropped_connection(self):
+        self.backend.set("key", b"value")
+        self.drop_connection(self.backend)
+        self.assertEqual(self.backend.get("key"), b"value")
+
+    def test_acquire_whose_reply_was_lost_holds_the_lease(self):
+        backend = self.backend
+        call = backend._call
+
+        def lose_reply(*args):
+            reply = call(*args)
+            if args[0] == "SET":
+                raise ConnectionError("reply lost")
+            return reply
+
+        backend._call = lose_reply
+        token = backend.acquire("lease", ttl=10)
+        backend._call = call
+        # Sending SET NX again would have found the lease taken by itself
+        self.assertIsNotNone(token)
+        self.assertIsNone(backend.acquire("lease", ttl=10))
+        backend.release("lease", token)
+        self.assertIsNotNone(backend.acquire("lease", ttl=10))
+
+    def test_acquire_that_never_landed_is_not_held(self):
+        backend = self.backend
+        backend.set("key", b"value")
+        self.drop_connection(backend)
+        token = backend.acquire("lease", ttl=10)
+        # Not retried; the check after reconnecting finds no lease of ours
+        self.assertIsNone(token)
+        self.assertIsNotNone(backend.acquire("lease", ttl=10))
+
+    def test_release_is_retried_on_a_fresh_connection(self):
+        token = self.backend.acquire("lease", ttl=10)
+        self.drop_connection(self.backend)
+        self.backend.release("lease", token)
+        self.assertIsNotNone(self.backend.acquire("lease", ttl=10))
+
+    def test_release_aborts_if_the_lease_changes_under_watch(self):
+        token = self.backend.acquire("lease", ttl=10)
+        other = self.make_backend()
+        call = self.backend._call
+
+        def take_over(*args):
+            if args[0] == "MULTI":
+                # Another worker takes the lease between GET and EXEC
+                other.set("lease:lease", b"theirs")
+            return call(*args)
+
+        self.backend._call = take_over
+        self.backend.release("lease", token)
+        self.backend._call = call
+        self.assertEqual(other.get("lease:lease"), b"theirs")
+
+    def test_standin_transaction_without_watch(self):
+        self.backend.execute("MULTI")
+        self.assertEqual(self.backend.execute("SET", "a", b"1"), "QUEUED")
+        self.assertEqual(self.backend.execute("HSET", "h", "f", b"2"), "QUEUED")
+        self.assertEqual(self.backend.execute("EXEC"), ["OK", 1])
+        self.assertEqual(self.backend.get("a"), b"1")
+        self.assertEqual(self.backend.hget("h", "f"), b"2")
+
+
+if __name__ == "__main__":
+    unittest.main()
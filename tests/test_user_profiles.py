@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+from ev_registration_bot import config, user_profiles
+from ev_registration_bot.shared_state import backend as backend_module
+from ev_registration_bot.shared_state.backend import MemoryBackend
+from ev_registration_bot.shared_state.sqlite_backend import SQLiteBackend
+
+PROFILE = user_profiles.UserProfile("GERMAN", "Лекция", 0, "Иванова", 1, "+79991234567")
+
+
+class UserProfilesTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "user_profiles.sqlite3")
+        settings = config.get_settings()
+        self.addCleanup(setattr, config, "_settings", settings)
+        config._settings = settings.model_copy(
+            update={"profiles": config.ProfileSettings(PROFILES_PATH=self.path)}
+        )
+        self.addCleanup(setattr, user_profiles, "_file_backend", None)
+        user_profiles._file_backend = None
+
+    def use_backend(self, backend):
+        previous = backend_module._backend
+        backend_module._backend = backend
+        self.addCleanup(setattr, backend_module, "_backend", previous)
+
+    def test_profile_outlives_the_memory_backend(self):
+        self.use_backend(MemoryBackend())
+        user_profiles.save(1, PROFILE)
+        # A restart: new memory backend, same file
+        self.use_backend(MemoryBackend())
+        user_profiles._file_backend = None
+        self.assertEqual(user_profiles.load(1), PROFILE)
+
+    def test_shared_backend_keeps_the_profile_itself(self):
+        shared = SQLiteBackend(os.path.join(os.path.dirname(self.path), "state"))
+        self.use_backend(shared)
+        user_profiles.save(1, PROFILE)
+        self.assertIsNotNone(shared.get(user_profiles._key(1)))
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import datetime
+import unittest
+
+from ev_registration_bot import send_queue, time_utils
+from ev_registration_bot.google_calendar_helper import booking_outbox, waitlist
+from ev_registration_bot.google_calendar_helper.events_cache import CachedDay
+from ev_registration_bot.google_calendar_helper.google_calendar_get import (
+    LectureSlot,
+)
+from ev_registration_bot.google_calendar_helper.utils import (
+    get_commune_guest_limit,
+    get_communes,
+)
+from ev_registration_bot.shared_state import backend as backend_module
+from ev_registration_bot.shared_state.backend import MemoryBackend
+
+DAY = datetime.date(2024, 6, 3)
+START, END = 11 * 60, 12 * 60
+
+
+class WaitlistTest(unittest.TestCase):
+    def setUp(self):
+        previous = backend_module._backend
+        backend_module._backend = MemoryBackend()
+        self.addCleanup(setattr, backend_module, "_backend", previous)
+        # No outbox file: nothing is queued for insertion
+        self.addCleanup(
+            setattr,
+            booking_outbox,
+            "_reservations_loaded",
+            booking_outbox._reservations_loaded,
+        )
+        booking_outbox._reservations_loaded = True
+        self.addCleanup(send_queue._queue.clear)
+        send_queue._queue.clear()
+
+        self.now = time_utils.local_midnight(DAY).timestamp()
+        time_utils.set_clock(lambda: self.now)
+        self.addCleanup(time_utils.set_clock, None)
+
+        self.commune = next(iter(get_communes()))
+        for chat_id in (1, 2, 3):
+            waitlist.join(self.commune, DAY, START, END, chat_id)
+
+    def day_with_places(self, places: int) -> CachedDay:
+        guests = get_commune_guest_limit(self.commune) - places
+        lecture = LectureSlot(
+            start=time_utils.iso_at(DAY, START),
+            end=time_utils.iso_at(DAY, END),
+            name="Ivanova",
+            total_guests=guests,
+        )
+        return CachedDay([], [lecture], self.now, None)
+
+    def told(self) -> list[int]:
+        return [notification.chat_id for notification in send_queue._queue]
+
+    def test_free_place_is_offered_once(self):
+        waitlist._on_day_changed(self.commune, DAY, self.day_with_places(1))
+        # The mirror refreshing the unchanged day must not tell the next waiter
+        waitlist._on_day_changed(self.commune, DAY, self.day_with_places(1))
+        self.assertEqual(self.told(), [1])
+        self.assertEqual(
+            waitlist.get_waitlists(self.commune, DAY), {(START, END): [2, 3]}
+        )
+
+    def test_only_places_freed_beyond_the_offers_are_offered(self):
+        waitlist._on_day_changed(self.commune, DAY, self.day_with_places(1))
+        waitlist._on_day_changed(self.commune, DAY, self.day_with_places(2))
+        self.assertEqual(self.told(), [1, 2])
+
+    def test_place_is_offered_again_once_the_offer_lapses(self):
+        waitlist._on_day_changed(self.commune, DAY, self.day_with_places(1))
+        self.now += waitlist._OFFER_HOLD_SECONDS + 1
+        waitlist._on_day_changed(self.commune, DAY, self.day_with_places(1))
+        self.assertEqual(self.told(), [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()